@@ -1,23 +1,57 @@
 # app.py - BrainHR IT Solutions Backend (FULLY IMPLEMENTED)
 import os
+import io
+import re
+import html
+import zlib
+import unicodedata
 import sys
+import json
+import hashlib
 import logging
 import sqlite3
 import zipfile
 import tempfile
+import time
+import base64
+import queue
+import threading
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from datetime import datetime, timedelta
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from flask import Flask, request, jsonify, session, send_file, make_response
 from flask_cors import CORS
+import click
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
+from workers import RESUME_TEXT_MAX_CHARS, extract_resume_text, hash_password_batch
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # thumbnails fall back to storing the original upload
+    Image = None
+
+try:
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.errors import PdfReadError
+except ImportError:  # merged timesheet bundles are unavailable
+    PdfReader = PdfWriter = None
+
+try:
+    from scipy import sparse
+except ImportError:  # candidate match scoring is disabled
+    sparse = None
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
@@ -51,9 +85,25 @@ app.config.update(
     PERMANENT_SESSION_LIFETIME=timedelta(days=1)
 )
 
+# Password hashing runs in a bounded process pool so hashing bursts (e.g. logins
+# at shift start) do not tie up request threads. PASSWORD_HASH_METHOD accepts any
+# werkzeug method string; hashes made with other parameters are upgraded on login.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 8))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+PASSWORD_HASH_BATCH_SIZE = 8  # passwords per job when bulk hashing
+# Worker pools are started lazily from a threaded server, where forking would copy
+# whatever locks other threads hold at that moment; start them from a clean process.
+POOL_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+EMPLOYEE_IMPORT_MAX_ROWS = int(os.getenv('EMPLOYEE_IMPORT_MAX_ROWS', 5000))
+
 # Admin credentials
 ADMIN_USERNAME = "BHRadmin"
-ADMIN_PASSWORD_HASH = generate_password_hash("BHR@6789$")
+ADMIN_PASSWORD_HASH = generate_password_hash("BHR@6789$", method=PASSWORD_HASH_METHOD)
+# Canonical "method:params" prefix of freshly generated hashes
+PASSWORD_HASH_PREFIX = ADMIN_PASSWORD_HASH.split('$', 1)[0]
 
 # File Upload config
 UPLOAD_FOLDER = 'uploads'
@@ -61,13 +111,209 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB
 
+# Orphaned upload collection: files younger than the grace period are never
+# removed, so an upload whose row has not been committed yet is safe.
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv('UPLOAD_GC_GRACE_SECONDS', 24 * 60 * 60))
+UPLOAD_GC_BATCH_SIZE = int(os.getenv('UPLOAD_GC_BATCH_SIZE', 200))
+
+# (table, column) pairs whose values point at files in UPLOAD_FOLDER
+UPLOAD_REFERENCES = [
+    ('applications', 'resume_filename'),
+    ('timesheets', 'file_path'),
+    ('timesheet_versions', 'file_path'),
+    ('visa_docs', 'file_path'),
+    ('courses', 'thumbnail_url'),
+    ('courses', 'thumbnail_variants'),
+]
+# Employee-owned rows only keep their files while the employee exists. Deleting an
+# employee removes these rows, but older deletes left them behind.
+UPLOAD_REFERENCE_OWNERS = {
+    'timesheets': 'employee_id IN (SELECT id FROM employees)',
+    'timesheet_versions': 'timesheet_id IN (SELECT id FROM timesheets WHERE employee_id IN (SELECT id FROM employees))',
+    'visa_docs': 'employee_id IN (SELECT id FROM employees)',
+}
+
+# Course thumbnail variants: (name, bounding box in px), each rendered as JPEG and WebP.
+# Variant files are content-addressed, so they are served as immutable.
+THUMBNAIL_SIZES = [('sm', 320), ('md', 640), ('lg', 1280)]
+THUMBNAIL_DEFAULT_SIZE = 'md'
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+THUMBNAIL_PREFIX = 'thumb_'
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Superseded timesheet uploads kept per period; older versions are dropped
+# from history and their files left to the upload GC.
+TIMESHEET_HISTORY_LIMIT = int(os.getenv('TIMESHEET_HISTORY_LIMIT', 5))
+
+# Timesheets are uploaded per week of month (weeks 1-4 in the employee portal)
+TIMESHEET_WEEKS_PER_MONTH = int(os.getenv('TIMESHEET_WEEKS_PER_MONTH', 4))
+TIMESHEET_MATRIX_MAX_MONTHS = 24
+
+# Merged timesheet PDFs, cached by the digests of their source files
+BUNDLE_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'bundle_cache')
+BUNDLE_CACHE_MAX_FILES = int(os.getenv('BUNDLE_CACHE_MAX_FILES', 100))
+# pypdf keeps every appended document in memory until the bundle is written,
+# so a single bundle is capped; larger selections must be split by the caller.
+BUNDLE_MAX_DOCUMENTS = int(os.getenv('BUNDLE_MAX_DOCUMENTS', 200))
+os.makedirs(BUNDLE_CACHE_FOLDER, exist_ok=True)
+
+# Employee portal delta sync: tables whose writes bump the change sequence
+SYNC_TABLES = ['timesheets', 'visa_docs', 'activities', 'messages']
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', 500))
+
+CONVERSATION_PREVIEW_LENGTH = 200
+CONVERSATION_PAGE_SIZE = 50
+BROADCAST_AUDIENCES = ('employees', 'managers', 'role')
+MARK_READ_MAX_IDS = 500
+# Compact (v2) columns: enums stored as small integers, timestamps as epoch seconds.
+# Unknown enum values are stored as given and passed through unchanged.
+NOTIFICATION_TYPES = {'timesheet': 1, 'activity': 2, 'visa': 3, 'message': 4, 'application': 5}
+NOTIFICATION_STATUSES = {'new': 0, 'read': 1}
+# messages.sender, sender_type and receiver_type share one code table; context is free text from clients
+MESSAGE_PARTY_TYPES = {'employee': 1, 'manager': 2, 'admin': 3}
+MESSAGE_CONTEXTS = {'general': 1, 'messages': 2, 'direct_message': 3}
+TIMESHEET_STATUSES = {'draft': 0, 'submitted': 1, 'approved': 2, 'rejected': 3}
+EPOCH_NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+EVENT_TYPES = {
+    'timesheet_uploaded': 1, 'timesheet_submitted': 2, 'timesheet_approved': 3, 'timesheet_rejected': 4,
+    'visa_doc_uploaded': 5, 'activity_posted': 6, 'message_sent': 7, 'application_submitted': 8,
+}
+EVENT_PAGE_SIZE = 50
+APPLICATION_PAGE_SIZE = 50
+# Resume text is extracted after /api/apply returns, in a small process pool (0 disables)
+RESUME_EXTRACT_WORKERS = int(os.getenv('RESUME_EXTRACT_WORKERS', 1))
+RESUME_SEARCH_PAGE_SIZE = 20
+RESUME_STORE_RETRIES = 3
+# 'pending' rows whose job was lost (worker restart, failed store) are picked up again by
+# `flask extract-resumes` once they have been queued this long
+RESUME_PENDING_STALE_SECONDS = int(os.getenv('RESUME_PENDING_STALE_SECONDS', 600))
+# Candidate/job match scoring: hashed term counts, TF-IDF weighted at scoring time
+MATCH_FEATURES = 2 ** 18
+COURSE_RECOMMENDATION_LIMIT = int(os.getenv('COURSE_RECOMMENDATION_LIMIT', 6))
+MATCH_STOPWORDS = frozenset('''
+    a an and are as at be by for from has have in is it its of on or our that the this to was we were will with
+    you your experience years work working team skills ability strong knowledge using
+'''.split())
+# Near-duplicate applicants: 64-value MinHash signatures per section (identity fields,
+# resume text), split into 16 LSH bands of 4 rows. Pairs above ~0.5 Jaccard usually
+# share a bucket; bucket-mates are confirmed by signature agreement.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+MINHASH_PRIME = 2 ** 31 - 1
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.5))
+APPLICATION_MAX_PAGE_SIZE = 500
+APPLICATION_SORT_FIELDS = ('applied_at', 'name', 'experience_years', 'location', 'visa_status', 'job_title', 'viewed',
+                           'match_score', 'duplicate_group', 'id')
+APPLICATION_FACETS = {'visa_status': 'visa_status', 'location': 'location', 'job': 'job_id'}
+# Read notifications older than NOTIFICATION_ROLLUP_DAYS collapse into daily per-employee
+# counts; anything older than NOTIFICATION_TTL_DAYS is deleted.
+NOTIFICATION_ROLLUP_DAYS = int(os.getenv('NOTIFICATION_ROLLUP_DAYS', 30))
+NOTIFICATION_TTL_DAYS = int(os.getenv('NOTIFICATION_TTL_DAYS', 365))
+NOTIFICATION_RETENTION_BATCH_SIZE = int(os.getenv('NOTIFICATION_RETENTION_BATCH_SIZE', 1000))
+INCREMENTAL_VACUUM_PAGES = int(os.getenv('INCREMENTAL_VACUUM_PAGES', 2000))
+# Read messages older than MESSAGE_ARCHIVE_MONTHS move to messages_archive, kept in
+# MESSAGE_ARCHIVE_DB (attached as "archive") when set, otherwise in the main database.
+MESSAGE_ARCHIVE_MONTHS = int(os.getenv('MESSAGE_ARCHIVE_MONTHS', 12))
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.getenv('MESSAGE_ARCHIVE_BATCH_SIZE', 500))
+MESSAGE_ARCHIVE_DB = os.getenv('MESSAGE_ARCHIVE_DB')
+MESSAGE_ARCHIVE_COLUMNS = ('id', 'sender', 'sender_name', 'employee_id', 'context', 'context_id', 'message', 'created_at',
+                           'sender_id', 'sender_type', 'receiver_id', 'receiver_type', 'is_read')
+MESSAGE_ARCHIVE_TABLE = '''
+    id INTEGER PRIMARY KEY, sender INTEGER NOT NULL, sender_name TEXT, employee_id INTEGER,
+    context INTEGER NOT NULL, context_id INTEGER, message TEXT NOT NULL, created_at INTEGER,
+    sender_id INTEGER, sender_type INTEGER, receiver_id INTEGER, receiver_type INTEGER,
+    is_read INTEGER DEFAULT 1, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+'''
+MESSAGE_SEARCH_PAGE_SIZE = 20
+MESSAGE_SEARCH_MAX_PAGE_SIZE = 100
+
+# Bulk timesheet actions: action -> (statuses it applies to, resulting status)
+TIMESHEET_TRANSITIONS = {
+    'submit': ({'draft', 'rejected'}, 'submitted'),
+    'approve': ({'submitted'}, 'approved'),
+    'reject': ({'submitted'}, 'rejected'),
+}
+# Periods in these states can't be re-uploaded; a reviewer rejects a submitted timesheet to reopen it
+TIMESHEET_LOCKED_STATUSES = ('submitted', 'approved')
+
 # Database file name
 DB_FILE = 'brainhr.db'
 
+def sql_enum_case(column, codes):
+    """SQL CASE mapping a TEXT enum column to its integer codes (unknown values kept as-is)."""
+    cases = ' '.join(f"WHEN '{name}' THEN {code}" for name, code in codes.items())
+    return f'CASE {column} {cases} ELSE {column} END'
+
+def sql_enum_name(column, codes):
+    """Inverse of sql_enum_case: SQL CASE mapping integer codes back to their names."""
+    cases = ' '.join(f"WHEN {code} THEN '{name}'" for name, code in codes.items())
+    return f'CASE {column} {cases} ELSE {column} END'
+
+def rebuild_compact_table(cursor, table, columns, conversions, schema='main'):
+    """Copy a table still using TEXT enums/timestamps into its compact (v2) layout; False if already compact.
+
+    change_seq (delta sync) is carried over when the old table has it. Indexes and
+    triggers go with the old table, so callers create them afterwards.
+    """
+    cursor.execute(f'PRAGMA {schema}.table_info({table})')
+    old_columns = {row[1]: row[2] for row in cursor.fetchall()}
+    if old_columns['created_at'].upper() == 'INTEGER':
+        return False
+    names = [name for name in old_columns if name != 'change_seq']
+    if 'change_seq' in old_columns:
+        columns = columns.replace('FOREIGN KEY', 'change_seq INTEGER,\n                FOREIGN KEY')
+        names.append('change_seq')
+    cursor.execute(f'DROP TABLE IF EXISTS {schema}.{table}_v2')  # left over from an interrupted rebuild
+    cursor.execute(f'CREATE TABLE {schema}.{table}_v2 ({columns})')
+    cursor.execute(f'''
+        INSERT INTO {schema}.{table}_v2 ({', '.join(names)})
+        SELECT {', '.join(conversions.get(name, name) for name in names)} FROM {schema}.{table}
+    ''')
+    cursor.execute(f'DROP TABLE {schema}.{table}')
+    cursor.execute(f'ALTER TABLE {schema}.{table}_v2 RENAME TO {table}')
+    logger.info(f"Migrated {schema}.{table} to compact schema v2")
+    return True
+
+def add_sync_tracking(cursor, table):
+    """Give a table a change_seq column kept current by insert/update triggers (existing rows are numbered once)."""
+    try:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN change_seq INTEGER')
+        cursor.execute(f'''
+            UPDATE {table} SET change_seq = (SELECT seq FROM sync_sequence WHERE id = 1) + id
+        ''')
+        cursor.execute(f'''
+            UPDATE sync_sequence SET seq = seq + (SELECT COALESCE(MAX(id), 0) FROM {table}) WHERE id = 1
+        ''')
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE sync_sequence SET seq = seq + 1 WHERE id = 1;
+            UPDATE {table} SET change_seq = (SELECT seq FROM sync_sequence WHERE id = 1) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table}
+        WHEN NEW.change_seq IS OLD.change_seq
+        BEGIN
+            UPDATE sync_sequence SET seq = seq + 1 WHERE id = 1;
+            UPDATE {table} SET change_seq = (SELECT seq FROM sync_sequence WHERE id = 1) WHERE id = NEW.id;
+        END
+    ''')
+
+def create_message_archive_indexes(conn, schema):
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_messages_archive_employee ON messages_archive(employee_id, id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_messages_archive_sender ON messages_archive(sender_type, sender_id, id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_messages_archive_receiver ON messages_archive(receiver_type, receiver_id, id)')
+
 def init_db():
     """Initialize the SQLite database."""
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
+        # Only takes effect on a new, empty database; convert an existing file once,
+        # offline, with `flask enable-incremental-vacuum` (a full VACUUM).
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS applications (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT NOT NULL,
@@ -110,15 +356,6 @@ def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, created_by_admin INTEGER DEFAULT 1
             )
         ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS timesheets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
-                year INTEGER NOT NULL, month INTEGER NOT NULL, week INTEGER NOT NULL,
-                filename TEXT NOT NULL, file_path TEXT NOT NULL, status TEXT DEFAULT 'draft',
-                submitted_at TIMESTAMP, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (employee_id) REFERENCES employees(id)
-            )
-        ''')
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS visa_docs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
@@ -127,36 +364,56 @@ def init_db():
                 FOREIGN KEY (employee_id) REFERENCES employees(id)
             )
         ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS activities (
+        compact_tables = {
+            'timesheets': f'''
                 id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
-                activity_name TEXT NOT NULL, activity_description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                year INTEGER NOT NULL, month INTEGER NOT NULL, week INTEGER NOT NULL,
+                filename TEXT NOT NULL, file_path TEXT NOT NULL,
+                status INTEGER NOT NULL DEFAULT {TIMESHEET_STATUSES['draft']}, submitted_at INTEGER,
+                created_at INTEGER NOT NULL DEFAULT ({EPOCH_NOW_SQL}),
+                version INTEGER DEFAULT 1, file_sha256 TEXT, reviewed_at INTEGER, review_note TEXT, submit_note TEXT,
                 FOREIGN KEY (employee_id) REFERENCES employees(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
+            ''',
+            'messages': f'''
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sender INTEGER NOT NULL,
+                sender_name TEXT, employee_id INTEGER, context INTEGER NOT NULL, context_id INTEGER, message TEXT NOT NULL,
+                created_at INTEGER NOT NULL DEFAULT ({EPOCH_NOW_SQL}),
+                sender_id INTEGER, sender_type INTEGER DEFAULT {MESSAGE_PARTY_TYPES['employee']},
+                receiver_id INTEGER, receiver_type INTEGER DEFAULT {MESSAGE_PARTY_TYPES['employee']}, is_read INTEGER DEFAULT 0,
+                FOREIGN KEY (employee_id) REFERENCES employees(id)
+            ''',
+            'activities': f'''
                 id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
-                type TEXT NOT NULL, title TEXT NOT NULL, description TEXT,
-                related_id INTEGER, status TEXT DEFAULT 'new', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                activity_name TEXT NOT NULL, activity_description TEXT,
+                created_at INTEGER NOT NULL DEFAULT ({EPOCH_NOW_SQL}),
                 FOREIGN KEY (employee_id) REFERENCES employees(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT NOT NULL,
-                sender_name TEXT, employee_id INTEGER, context TEXT NOT NULL, context_id INTEGER, message TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ''',
+            'notifications': f'''
+                id INTEGER PRIMARY KEY AUTOINCREMENT, employee_id INTEGER NOT NULL,
+                type INTEGER NOT NULL, title TEXT NOT NULL, description TEXT, related_id INTEGER,
+                status INTEGER NOT NULL DEFAULT {NOTIFICATION_STATUSES['new']},
+                created_at INTEGER NOT NULL DEFAULT ({EPOCH_NOW_SQL}),
                 FOREIGN KEY (employee_id) REFERENCES employees(id)
-            )
-        ''')
+            ''',
+        }
+        for table, columns in compact_tables.items():
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns})')
         
         try:
             cursor.execute('ALTER TABLE courses ADD COLUMN archived INTEGER DEFAULT 0')
         except sqlite3.OperationalError:
             pass
         
+        try:
+            cursor.execute('ALTER TABLE courses ADD COLUMN thumbnail_variants TEXT')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE applications ADD COLUMN duplicate_group INTEGER')
+        except sqlite3.OperationalError:
+            pass
+        
         try:
             cursor.execute('ALTER TABLE jobs ADD COLUMN assessment_url TEXT')
         except sqlite3.OperationalError:
@@ -207,6 +464,110 @@ def init_db():
         except sqlite3.OperationalError:
             pass
         
+        try:
+            cursor.execute('ALTER TABLE timesheets ADD COLUMN version INTEGER DEFAULT 1')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE timesheets ADD COLUMN file_sha256 TEXT')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE timesheets ADD COLUMN reviewed_at TIMESTAMP')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE timesheets ADD COLUMN review_note TEXT')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE timesheets ADD COLUMN submit_note TEXT')
+        except sqlite3.OperationalError:
+            pass
+        
+        # Schema v2 migration: rebuild tables still using TEXT enums/timestamps, once the
+        # columns added above exist.
+        epoch = f"COALESCE(CAST(strftime('%s', created_at) AS INTEGER), {EPOCH_NOW_SQL})"
+        compact_copies = {
+            'timesheets': {
+                'status': sql_enum_case("COALESCE(status, 'draft')", TIMESHEET_STATUSES),
+                'submitted_at': "CAST(strftime('%s', submitted_at) AS INTEGER)",
+                'reviewed_at': "CAST(strftime('%s', reviewed_at) AS INTEGER)",
+                'created_at': epoch,
+            },
+            'messages': {
+                'sender': sql_enum_case('sender', MESSAGE_PARTY_TYPES),
+                'sender_type': sql_enum_case('sender_type', MESSAGE_PARTY_TYPES),
+                'receiver_type': sql_enum_case('receiver_type', MESSAGE_PARTY_TYPES),
+                'context': sql_enum_case('context', MESSAGE_CONTEXTS),
+                'created_at': epoch,
+            },
+            'activities': {'created_at': epoch},
+            'notifications': {
+                'type': sql_enum_case('type', NOTIFICATION_TYPES),
+                'status': f"CASE WHEN status = 'read' THEN {NOTIFICATION_STATUSES['read']} ELSE {NOTIFICATION_STATUSES['new']} END",
+                'created_at': epoch,
+            },
+        }
+        cursor.execute('PRAGMA table_info(messages)')
+        if {row[1]: row[2] for row in cursor.fetchall()}['created_at'].upper() != 'INTEGER':
+            # The search view compares the old TEXT types and its triggers would block the
+            # table renames; both are recreated below, decoding to the names FTS indexed.
+            for trigger in ('insert', 'delete', 'before_update', 'after_update'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS messages_fts_{trigger}')
+            cursor.execute('DROP VIEW IF EXISTS messages_fts_source')
+        for table, conversions in compact_copies.items():
+            rebuild_compact_table(cursor, table, compact_tables[table], conversions)
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS timesheet_versions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timesheet_id INTEGER NOT NULL,
+                version INTEGER NOT NULL, filename TEXT NOT NULL, file_path TEXT NOT NULL,
+                status TEXT, submitted_at TIMESTAMP, created_at TIMESTAMP,
+                superseded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, reviewed_at TIMESTAMP, review_note TEXT,
+                FOREIGN KEY (timesheet_id) REFERENCES timesheets(id)
+            )
+        ''')
+        try:
+            cursor.execute('ALTER TABLE timesheet_versions ADD COLUMN reviewed_at TIMESTAMP')
+        except sqlite3.OperationalError:
+            pass
+        
+        try:
+            cursor.execute('ALTER TABLE timesheet_versions ADD COLUMN review_note TEXT')
+        except sqlite3.OperationalError:
+            pass
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timesheet_versions_timesheet ON timesheet_versions(timesheet_id, version)')
+        
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_timesheets_period'")
+        if not cursor.fetchone():
+            # One row per (employee, year, month, week): fold earlier uploads into history first
+            cursor.execute('''
+                SELECT employee_id, year, month, week FROM timesheets
+                GROUP BY employee_id, year, month, week HAVING COUNT(*) > 1
+            ''')
+            for period in cursor.fetchall():
+                cursor.execute(f'''
+                    SELECT id, filename, file_path, {sql_enum_name('status', TIMESHEET_STATUSES)},
+                           datetime(submitted_at, 'unixepoch'), datetime(created_at, 'unixepoch') FROM timesheets
+                    WHERE employee_id = ? AND year = ? AND month = ? AND week = ? ORDER BY id
+                ''', period)
+                rows = cursor.fetchall()
+                latest_id = rows[-1][0]
+                cursor.executemany('''
+                    INSERT INTO timesheet_versions (timesheet_id, version, filename, file_path, status, submitted_at, created_at, superseded_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(latest_id, version, row[1], row[2], row[3], row[4], row[5], rows[version][5])
+                      for version, row in enumerate(rows[:-1], start=1)])
+                cursor.executemany('DELETE FROM timesheets WHERE id = ?', [(row[0],) for row in rows[:-1]])
+                cursor.execute('UPDATE timesheets SET version = ? WHERE id = ?', (len(rows), latest_id))
+                logger.info(f"Folded {len(rows) - 1} duplicate timesheets into history for period {period}")
+            cursor.execute('CREATE UNIQUE INDEX idx_timesheets_period ON timesheets(employee_id, year, month, week)')
+        
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS managers (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -218,11 +579,651 @@ def init_db():
             )
         ''')
         
+        # Change sequence for delta sync: every insert/update on a synced table
+        # takes the next value, so clients can ask for "everything after N".
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sync_sequence (
+                id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO sync_sequence (id, seq) VALUES (1, 0)')
+        for table in SYNC_TABLES:
+            add_sync_tracking(cursor, table)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timesheets_sync ON timesheets(employee_id, change_seq)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_visa_docs_sync ON visa_docs(employee_id, change_seq)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_sync ON activities(employee_id, change_seq)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_receiver_sync ON messages(employee_id, change_seq)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender_sync ON messages(sender_id, change_seq)')
+        
+        # Full-text message search. The index reads from a view that adds an
+        # `audience` column of to<type><id>/from<type><id> tokens, so the
+        # visibility filter is intersected inside FTS instead of after ranking.
+        receiver_type = f"COALESCE({sql_enum_name('receiver_type', MESSAGE_PARTY_TYPES)}, 'employee')"
+        cursor.execute(f'''
+            CREATE VIEW IF NOT EXISTS messages_fts_source AS
+            SELECT id, message, sender_name,
+                   'to' || {receiver_type}
+                   || COALESCE(CASE WHEN {receiver_type} = 'employee' THEN employee_id ELSE receiver_id END, '')
+                   || ' from' || COALESCE({sql_enum_name('sender_type', MESSAGE_PARTY_TYPES)}, '') || COALESCE(sender_id, '') AS audience
+            FROM messages
+        ''')
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        fts_exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    message, sender_name, audience,
+                    content = 'messages_fts_source', content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+                BEGIN
+                    INSERT INTO messages_fts (rowid, message, sender_name, audience)
+                    SELECT id, message, sender_name, audience FROM messages_fts_source WHERE id = NEW.id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_fts_delete BEFORE DELETE ON messages
+                BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message, sender_name, audience)
+                    SELECT 'delete', id, message, sender_name, audience FROM messages_fts_source WHERE id = OLD.id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_fts_before_update
+                BEFORE UPDATE OF message, sender_name, sender_id, sender_type, receiver_id, receiver_type, employee_id ON messages
+                BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message, sender_name, audience)
+                    SELECT 'delete', id, message, sender_name, audience FROM messages_fts_source WHERE id = OLD.id;
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS messages_fts_after_update
+                AFTER UPDATE OF message, sender_name, sender_id, sender_type, receiver_id, receiver_type, employee_id ON messages
+                BEGIN
+                    INSERT INTO messages_fts (rowid, message, sender_name, audience)
+                    SELECT id, message, sender_name, audience FROM messages_fts_source WHERE id = NEW.id;
+                END
+            ''')
+            if not fts_exists:
+                cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Message search unavailable (FTS5 not supported): {e}")
+        
+        # Extracted resume text (status: pending/done/failed) indexed for recruiter search.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS resume_texts (
+                application_id INTEGER PRIMARY KEY, status TEXT NOT NULL DEFAULT 'pending',
+                content TEXT, error TEXT, extracted_at TIMESTAMP, queued_at TIMESTAMP,
+                FOREIGN KEY (application_id) REFERENCES applications(id)
+            )
+        ''')
+        try:
+            cursor.execute('ALTER TABLE resume_texts ADD COLUMN queued_at TIMESTAMP')
+        except sqlite3.OperationalError:
+            pass
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_resume_texts_status ON resume_texts(status)')
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS resumes_fts USING fts5(
+                    content, content = 'resume_texts', content_rowid = 'application_id',
+                    tokenize = 'porter unicode61 remove_diacritics 2'
+                )
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS resumes_fts_insert AFTER INSERT ON resume_texts
+                BEGIN
+                    INSERT INTO resumes_fts (rowid, content) VALUES (NEW.application_id, NEW.content);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS resumes_fts_delete AFTER DELETE ON resume_texts
+                BEGIN
+                    INSERT INTO resumes_fts (resumes_fts, rowid, content) VALUES ('delete', OLD.application_id, OLD.content);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS resumes_fts_update AFTER UPDATE OF content ON resume_texts
+                BEGIN
+                    INSERT INTO resumes_fts (resumes_fts, rowid, content) VALUES ('delete', OLD.application_id, OLD.content);
+                    INSERT INTO resumes_fts (rowid, content) VALUES (NEW.application_id, NEW.content);
+                END
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Resume search unavailable (FTS5 not supported): {e}")
+        
+        # Match scoring: raw hashed term counts per job/resume, document frequencies
+        # per feature, and the latest score for each (job, application) with the
+        # vector generation it was computed at. Any vector change bumps the generation,
+        # so scores from an older one are recomputed, a whole job at a time, when read.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS match_vectors (
+                kind TEXT NOT NULL, ref_id INTEGER NOT NULL, indices BLOB NOT NULL, counts BLOB NOT NULL,
+                PRIMARY KEY (kind, ref_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE TABLE IF NOT EXISTS match_df (feature INTEGER PRIMARY KEY, df INTEGER NOT NULL)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS match_scores (
+                job_id INTEGER NOT NULL, application_id INTEGER NOT NULL, score REAL NOT NULL,
+                scored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (job_id, application_id)
+            ) WITHOUT ROWID
+        ''')
+        try:
+            cursor.execute('ALTER TABLE match_scores ADD COLUMN generation INTEGER')
+        except sqlite3.OperationalError:
+            pass
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_match_scores_rank ON match_scores(job_id, score DESC)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS match_generation (
+                id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO match_generation (id, generation) VALUES (1, 0)')
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS match_vectors_{event.lower()} AFTER {event} ON match_vectors
+                BEGIN
+                    UPDATE match_generation SET generation = generation + 1 WHERE id = 1;
+                END
+            ''')
+        if sparse is not None:
+            # Jobs posted (and resumes extracted) before match scoring existed
+            rebuild_match_vectors(cursor)
+        
+        # Precomputed course recommendations, rewritten whenever courses or jobs change
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS course_related (
+                course_id INTEGER NOT NULL, related_id INTEGER NOT NULL, score REAL NOT NULL,
+                PRIMARY KEY (course_id, related_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_courses (
+                job_id INTEGER NOT NULL, course_id INTEGER NOT NULL, score REAL NOT NULL,
+                PRIMARY KEY (job_id, course_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # One row per (owner, counterparty, context) with the latest message and
+        # the owner's unread count, maintained by create_message / mark-read.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'conversations'")
+        conversations_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                owner_type TEXT NOT NULL, owner_id INTEGER NOT NULL,
+                counterparty_type TEXT NOT NULL, counterparty_id INTEGER NOT NULL,
+                context TEXT NOT NULL, last_message_id INTEGER, last_message TEXT,
+                last_sender_type TEXT, last_at TIMESTAMP, unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (owner_type, owner_id, counterparty_type, counterparty_id, context)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_recent ON conversations(owner_type, owner_id, last_at DESC, last_message_id DESC)')
+        if not conversations_exist:
+            # conversations keeps the names; messages is already compact here
+            sender_type = f"COALESCE({sql_enum_name('sender_type', MESSAGE_PARTY_TYPES)}, 'employee')"
+            context = sql_enum_name('context', MESSAGE_CONTEXTS)
+            cursor.execute(f'''
+                INSERT INTO conversations (owner_type, owner_id, counterparty_type, counterparty_id, context,
+                                           last_message_id, last_at, unread_count)
+                SELECT owner_type, owner_id, counterparty_type, counterparty_id, context, MAX(id),
+                       datetime(MAX(created_at), 'unixepoch'), SUM(unread)
+                FROM (
+                    SELECT {receiver_type} AS owner_type,
+                           COALESCE(CASE WHEN {receiver_type} = 'employee' THEN employee_id ELSE receiver_id END, 0) AS owner_id,
+                           {sender_type} AS counterparty_type, COALESCE(sender_id, 0) AS counterparty_id,
+                           {context} AS context, id, created_at, is_read = 0 AS unread
+                    FROM messages
+                    UNION ALL
+                    SELECT {sender_type}, COALESCE(sender_id, 0), {receiver_type},
+                           COALESCE(CASE WHEN {receiver_type} = 'employee' THEN employee_id ELSE receiver_id END, 0),
+                           {context}, id, created_at, 0
+                    FROM messages
+                )
+                GROUP BY owner_type, owner_id, counterparty_type, counterparty_id, context
+            ''')
+            cursor.execute(f'''
+                UPDATE conversations SET
+                    last_message = (SELECT substr(message, 1, {CONVERSATION_PREVIEW_LENGTH}) FROM messages WHERE id = last_message_id),
+                    last_sender_type = (SELECT {sender_type} FROM messages WHERE id = last_message_id)
+            ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_thread_sender ON messages(sender_type, sender_id, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_thread_receiver ON messages(receiver_type, receiver_id, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_thread_employee ON messages(employee_id, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_employee_status ON notifications(employee_id, status, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_applied ON applications(applied_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_job ON applications(job_id, applied_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_visa ON applications(visa_status, applied_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_location ON applications(location, applied_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applications_duplicate_group ON applications(duplicate_group)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applicant_signatures (
+                application_id INTEGER PRIMARY KEY, identity BLOB, resume BLOB
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applicant_buckets (
+                band INTEGER NOT NULL, bucket INTEGER NOT NULL, application_id INTEGER NOT NULL,
+                PRIMARY KEY (band, bucket, application_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_applicant_buckets_application ON applicant_buckets(application_id, band)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS manager_team (
+                manager_id INTEGER NOT NULL, employee_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (manager_id, employee_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_manager_team_employee ON manager_team(employee_id, manager_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_visa_docs_employee ON visa_docs(employee_id, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_activities_employee ON activities(employee_id, created_at)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_rollups (
+                employee_id INTEGER NOT NULL, day TEXT NOT NULL, type INTEGER NOT NULL, count INTEGER NOT NULL,
+                PRIMARY KEY (employee_id, day, type)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Append-only timeline written by the write paths (see record_event).
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'events'")
+        events_exist = cursor.fetchone() is not None
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, type INTEGER NOT NULL,
+                actor_type TEXT NOT NULL, actor_id INTEGER, employee_id INTEGER, related_id INTEGER,
+                summary TEXT, created_at INTEGER NOT NULL DEFAULT ({EPOCH_NOW_SQL})
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_actor ON events(actor_type, actor_id, created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_type ON events(type, created_at, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_employee ON events(employee_id, created_at, id)')
+        if not events_exist:
+            epoch = "CASE WHEN typeof(created_at) = 'integer' THEN created_at ELSE CAST(strftime('%s', created_at) AS INTEGER) END"
+            cursor.execute(f'''
+                INSERT INTO events (type, actor_type, actor_id, employee_id, related_id, summary, created_at)
+                SELECT * FROM (
+                    SELECT {EVENT_TYPES['timesheet_uploaded']}, 'employee', employee_id, employee_id, id,
+                           'Week ' || week || ', Month ' || month || ', Year ' || year, {epoch} FROM timesheets
+                    UNION ALL
+                    SELECT {EVENT_TYPES['visa_doc_uploaded']}, 'employee', employee_id, employee_id, id, doc_name, {epoch} FROM visa_docs
+                    UNION ALL
+                    SELECT {EVENT_TYPES['activity_posted']}, 'employee', employee_id, employee_id, id, activity_name, {epoch} FROM activities
+                    UNION ALL
+                    SELECT {EVENT_TYPES['message_sent']}, COALESCE({sql_enum_name('sender_type', MESSAGE_PARTY_TYPES)}, 'employee'),
+                           sender_id, CASE WHEN receiver_type = {MESSAGE_PARTY_TYPES['employee']} THEN employee_id
+                                           WHEN sender_type = {MESSAGE_PARTY_TYPES['employee']} THEN sender_id END,
+                           id, {sql_enum_name('context', MESSAGE_CONTEXTS)}, {epoch} FROM messages
+                    UNION ALL
+                    SELECT {EVENT_TYPES['application_submitted']}, 'applicant', NULL, NULL, id,
+                           name || ' applied for ' || job_title, CAST(strftime('%s', applied_at) AS INTEGER) FROM applications
+                ) ORDER BY 7
+            ''')
+        
+        # Broadcasts are stored once; recipients only get a receipt row once they read one.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, audience TEXT NOT NULL, audience_role TEXT,
+                sender TEXT NOT NULL, sender_name TEXT, sender_id INTEGER, sender_type TEXT,
+                context TEXT NOT NULL, message TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_audience ON broadcasts(audience, audience_role, id)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_receipts (
+                recipient_type TEXT NOT NULL, recipient_id INTEGER NOT NULL, broadcast_id INTEGER NOT NULL,
+                read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (recipient_type, recipient_id, broadcast_id)
+            ) WITHOUT ROWID
+        ''')
+        # Delta sync: a broadcast is a change for its recipients when it is sent and when they read it.
+        # Receipts written before this column existed keep NULL; their broadcasts are all new to sync.
+        add_sync_tracking(cursor, 'broadcasts')
+        try:
+            cursor.execute('ALTER TABLE broadcast_receipts ADD COLUMN change_seq INTEGER')
+        except sqlite3.OperationalError:
+            pass
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS broadcast_receipts_sync_insert AFTER INSERT ON broadcast_receipts
+            BEGIN
+                UPDATE sync_sequence SET seq = seq + 1 WHERE id = 1;
+                UPDATE broadcast_receipts SET change_seq = (SELECT seq FROM sync_sequence WHERE id = 1)
+                WHERE recipient_type = NEW.recipient_type AND recipient_id = NEW.recipient_id
+                  AND broadcast_id = NEW.broadcast_id;
+            END
+        ''')
+        conn.commit()
+        
+        # An archive written before schema v2 is converted here, never on the read path
+        archive_schema = 'main'
+        if MESSAGE_ARCHIVE_DB and os.path.exists(MESSAGE_ARCHIVE_DB):
+            cursor.execute('ATTACH DATABASE ? AS archive', (MESSAGE_ARCHIVE_DB,))
+            archive_schema = 'archive'
+        cursor.execute(f"SELECT 1 FROM {archive_schema}.sqlite_master WHERE type = 'table' AND name = 'messages_archive'")
+        if cursor.fetchone() and rebuild_compact_table(cursor, 'messages_archive', MESSAGE_ARCHIVE_TABLE,
+                                                       compact_copies['messages'], schema=archive_schema):
+            create_message_archive_indexes(cursor, archive_schema)
         conn.commit()
 
-init_db()
+def create_app():
+    """WSGI entry point (`gunicorn 'app:create_app()'`): bring the schema up to date, then serve.
+
+    Importing this module never touches the database, so worker processes and
+    tests can import it freely; run `flask init-db` before CLI commands on a
+    database that no server has started against yet.
+    """
+    init_db()
+    return app
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database or migrate it to the current schema."""
+    init_db()
+    click.echo(f"Database {DB_FILE} is up to date.")
 
 # ---------- Helpers ----------
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    Caches are per process: writers invalidate their own worker's copy and the
+    TTL bounds how stale other workers can be.
+    """
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# Completeness matrices keyed by (start, end, employee_id)
+timesheet_matrix_cache = TTLCache(maxsize=64, ttl=300)
+
+# /api/manager/overview payloads keyed by manager id; cleared by timesheet, visa doc,
+# activity, message and team writes
+manager_overview_cache = TTLCache(maxsize=256, ttl=60)
+
+# Employee/manager profiles keyed by (user type, id)
+profile_cache = TTLCache(maxsize=2048, ttl=600)
+
+def get_profile(user_type, user_id):
+    """Read-through lookup of {'id', 'username', 'name', 'email'} for an employee, manager or admin."""
+    if user_type == 'admin':
+        return {'id': user_id, 'username': ADMIN_USERNAME, 'name': 'BrainHR Admin', 'email': None}
+    try:
+        key = (user_type, int(user_id))
+    except (TypeError, ValueError):
+        return None
+    if user_type not in ('employee', 'manager'):
+        return None
+    profile = profile_cache.get(key)
+    if profile is None:
+        table = 'employees' if user_type == 'employee' else 'managers'
+        with sqlite3.connect(DB_FILE) as conn:
+            row = conn.execute(f'SELECT id, username, employee_name, email FROM {table} WHERE id = ?', (key[1],)).fetchone()
+        if row is None:
+            return None
+        profile = {'id': row[0], 'username': row[1], 'name': row[2], 'email': row[3]}
+        profile_cache.set(key, profile)
+    return profile
+
+class PasswordHashBusy(Exception):
+    """Raised when the password hashing pool has too much pending work."""
+
+_password_pool = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(max(1, PASSWORD_HASH_MAX_PENDING))
+
+def _get_password_pool():
+    global _password_pool
+    with _password_pool_lock:
+        if _password_pool is None:
+            _password_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=POOL_MP_CONTEXT)
+        return _password_pool
+
+def _reset_password_pool():
+    global _password_pool
+    with _password_pool_lock:
+        _password_pool = None
+
+def _submit_password_job(fn, *args):
+    """Submit to the pool once a pending slot is free; the slot is held until the job itself finishes."""
+    if not _password_slots.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise PasswordHashBusy('Password hashing is busy, please retry')
+    try:
+        future = _get_password_pool().submit(fn, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+    future.add_done_callback(lambda _: _password_slots.release())
+    return future
+
+def _run_password_job(fn, *args):
+    """Run a werkzeug hash function in the pool; raises PasswordHashBusy when busy or timed out."""
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    for attempt in range(2):
+        try:
+            return _submit_password_job(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT)
+        except FutureTimeoutError:
+            raise PasswordHashBusy('Password hashing timed out, please retry')
+        except BrokenProcessPool:
+            logger.warning("Password hashing pool broke; restarting it")
+            _reset_password_pool()
+            if attempt:
+                raise PasswordHashBusy('Password hashing was interrupted, please retry')
+
+def hash_password(password):
+    return _run_password_job(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    return _run_password_job(check_password_hash, password_hash, password)
+
+def hash_passwords(passwords):
+    """Hash many passwords on the shared pool in small batches.
+
+    At most PASSWORD_HASH_WORKERS batches are queued at a time, so logins
+    submitted meanwhile wait behind a few batches rather than the whole import.
+    """
+    if PASSWORD_HASH_WORKERS <= 0 or len(passwords) < 2:
+        return hash_password_batch(passwords, PASSWORD_HASH_METHOD)
+    hashes, pending = [], deque()
+    try:
+        for start in range(0, len(passwords), PASSWORD_HASH_BATCH_SIZE):
+            if len(pending) >= PASSWORD_HASH_WORKERS:
+                hashes.extend(pending.popleft().result(timeout=PASSWORD_HASH_TIMEOUT))
+            pending.append(_submit_password_job(
+                hash_password_batch, passwords[start:start + PASSWORD_HASH_BATCH_SIZE], PASSWORD_HASH_METHOD))
+        while pending:
+            hashes.extend(pending.popleft().result(timeout=PASSWORD_HASH_TIMEOUT))
+    except FutureTimeoutError:
+        raise PasswordHashBusy('Password hashing timed out, please retry')
+    except BrokenProcessPool:
+        logger.warning("Password hashing pool broke; restarting it")
+        _reset_password_pool()
+        raise PasswordHashBusy('Password hashing was interrupted, please retry')
+    finally:
+        for future in pending:
+            future.cancel()
+    return hashes
+
+_resume_pool = None
+_resume_pool_lock = threading.Lock()
+
+def _get_resume_pool():
+    global _resume_pool
+    with _resume_pool_lock:
+        if _resume_pool is None:
+            _resume_pool = ProcessPoolExecutor(max_workers=RESUME_EXTRACT_WORKERS, mp_context=POOL_MP_CONTEXT)
+        return _resume_pool
+
+def store_resume_text(application_id, future):
+    """Save a finished extraction job's text (and thereby index and score it) or its failure.
+
+    Database errors (usually a busy writer) are retried with backoff; if the row still
+    can't be written it is marked 'failed' so `flask extract-resumes --retry-failed`
+    picks it up, instead of staying 'pending' forever.
+    """
+    try:
+        text, status, error = future.result(), 'done', None
+    except Exception as e:
+        text, status, error = None, 'failed', str(e)[:500]
+        logger.warning(f"Resume extraction failed for application {application_id}: {e}")
+    for attempt in range(RESUME_STORE_RETRIES):
+        try:
+            with sqlite3.connect(DB_FILE) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE resume_texts SET status = ?, content = ?, error = ?, extracted_at = CURRENT_TIMESTAMP
+                    WHERE application_id = ?
+                ''', (status, text, error, application_id))
+                if text and sparse is not None:
+                    store_match_vector(cursor, 'resume', application_id, text)
+                if text:
+                    index_applicant(cursor, application_id, 'resume', minhash_signature(resume_shingles(text)))
+                conn.commit()
+            return
+        except sqlite3.Error as e:
+            logger.warning(f"Store resume text for application {application_id} failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < RESUME_STORE_RETRIES:
+                time.sleep(0.5 * 2 ** attempt)
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.execute('''
+                UPDATE resume_texts SET status = 'failed', error = ? WHERE application_id = ?
+            ''', ('Could not store the extracted text', application_id))
+            conn.commit()
+    except sqlite3.Error as e:
+        # Still 'pending': `flask extract-resumes` queues it again once it is stale
+        logger.error(f"Store resume text error: {e}")
+
+# Done-callbacks run on the pool's management thread, which must not block on the
+# database or scoring; they only hand the result to this store thread.
+_resume_results = queue.Queue()
+_resume_store_thread = None
+
+def _store_resume_results():
+    while True:
+        application_id, future = _resume_results.get()
+        try:
+            store_resume_text(application_id, future)
+        except Exception as e:
+            logger.error(f"Store resume text error: {e}")
+        finally:
+            _resume_results.task_done()
+
+def _start_resume_store_thread():
+    global _resume_store_thread
+    with _resume_pool_lock:
+        if _resume_store_thread is None:
+            _resume_store_thread = threading.Thread(target=_store_resume_results, name='resume-store', daemon=True)
+            _resume_store_thread.start()
+
+def _submit_resume_job(application_id, path):
+    global _resume_pool
+    _start_resume_store_thread()
+    try:
+        future = _get_resume_pool().submit(extract_resume_text, path)
+    except BrokenProcessPool:
+        with _resume_pool_lock:
+            _resume_pool = None
+        future = _get_resume_pool().submit(extract_resume_text, path)
+    future.add_done_callback(lambda done: _resume_results.put((application_id, done)))
+    return future
+
+def claim_resume_extractions(retry_failed=False):
+    """(application id, resume filename) of resumes to extract: 'pending' rows never queued or
+    not queued within RESUME_PENDING_STALE_SECONDS, plus 'failed' rows if retry_failed.
+
+    Claiming bumps queued_at in the same statement, so a concurrent run or a job
+    still in flight in the web workers isn't queued twice.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE resume_texts SET queued_at = CURRENT_TIMESTAMP
+            WHERE (status = 'pending' AND (queued_at IS NULL OR queued_at < datetime('now', ?)))
+               OR (status = 'failed' AND ?)
+            RETURNING application_id
+        ''', (f'-{RESUME_PENDING_STALE_SECONDS} seconds', retry_failed))
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+        if not ids:
+            return []
+        cursor.execute(f"SELECT id, resume_filename FROM applications WHERE id IN ({','.join('?' for _ in ids)})", ids)
+        return cursor.fetchall()
+
+def queue_resume_extraction(application_id, path):
+    """Extract a resume in the background; the resume_texts row must already exist as 'pending'.
+
+    A job lost to a worker restart stays 'pending'; run `flask extract-resumes`
+    periodically to queue such rows again.
+    """
+    if RESUME_EXTRACT_WORKERS <= 0:
+        return None
+    return _submit_resume_job(application_id, path)
+
+def password_needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != PASSWORD_HASH_PREFIX
+
+def rehash_password_in_background(table, user_id, old_hash, password):
+    """Upgrade a stored hash to the current parameters without delaying the login response."""
+    if PASSWORD_HASH_WORKERS <= 0 or not _password_slots.acquire(blocking=False):
+        return  # try again on a later login
+
+    def store(future):
+        _password_slots.release()
+        try:
+            new_hash = future.result()
+            with sqlite3.connect(DB_FILE) as conn:
+                conn.execute(f'UPDATE {table} SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                             (new_hash, user_id, old_hash))
+                conn.commit()
+            logger.info(f"Rehashed password for {table} id {user_id}")
+        except Exception as e:
+            logger.warning(f"Password rehash failed for {table} id {user_id}: {e}")
+
+    try:
+        _get_password_pool().submit(generate_password_hash, password, PASSWORD_HASH_METHOD).add_done_callback(store)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _password_slots.release()
+        _reset_password_pool()
+        logger.warning(f"Could not schedule password rehash: {e}")
+
+def password_busy_response(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -262,32 +1263,332 @@ def admin_only_login_required(f):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'pdf', 'doc', 'docx'}
 
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def resolve_upload_path(stored_path):
+    """Locate a stored upload path, including rows written with Windows separators."""
+    if stored_path and os.path.exists(stored_path):
+        return stored_path
+    name = os.path.basename(str(stored_path or '').replace('\\', '/'))
+    candidate = os.path.join(app.config['UPLOAD_FOLDER'], name)
+    return candidate if name and os.path.exists(candidate) else None
+
+def build_thumbnail_variants(data, digest):
+    """Render the fixed-size JPEG/WebP variants of an image, reusing any already on disk."""
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    else:
+        image = image.convert('RGB')
+
+    variants = {}
+    for name, box in THUMBNAIL_SIZES:
+        variant = image.copy()
+        variant.thumbnail((box, box), Image.LANCZOS)
+        entry = {'width': variant.width, 'height': variant.height}
+        for fmt, ext, options in (('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+                                  ('WEBP', 'webp', {'method': 4})):
+            filename = f"{THUMBNAIL_PREFIX}{digest}_{name}.{ext}"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if not os.path.exists(filepath):
+                tmp_path = f"{filepath}.tmp"
+                variant.save(tmp_path, fmt, quality=THUMBNAIL_QUALITY, **options)
+                os.replace(tmp_path, filepath)
+            entry['webp' if fmt == 'WEBP' else 'jpeg'] = f"/uploads/{filename}"
+        variants[name] = entry
+    return variants
+
+def save_course_thumbnail(file):
+    """Store an uploaded course thumbnail; returns (thumbnail_url, variants JSON or None)."""
+    data = file.read()
+    if Image is not None:
+        try:
+            digest = hashlib.sha256(data).hexdigest()[:20]
+            variants = build_thumbnail_variants(data, digest)
+            return variants[THUMBNAIL_DEFAULT_SIZE]['jpeg'], json.dumps(variants)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning(f"Could not build thumbnail variants for {file.filename}: {e}")
+
+    filename = secure_filename(f"{datetime.now().timestamp()}_{file.filename}")
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'wb') as out:
+        out.write(data)
+    return f"/uploads/{filename}", None
+
+def format_epoch(value):
+    """Epoch seconds as the 'YYYY-MM-DD HH:MM:SS' UTC string CURRENT_TIMESTAMP columns produce."""
+    if value is None or isinstance(value, str):
+        return value
+    return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+NOTIFICATION_TYPE_NAMES = {code: name for name, code in NOTIFICATION_TYPES.items()}
+NOTIFICATION_STATUS_NAMES = {code: name for name, code in NOTIFICATION_STATUSES.items()}
+
+def notification_to_dict(row):
+    notification = dict(row)
+    notification['type'] = NOTIFICATION_TYPE_NAMES.get(notification['type'], notification['type'])
+    notification['status'] = NOTIFICATION_STATUS_NAMES.get(notification['status'], notification['status'])
+    notification['created_at'] = format_epoch(notification['created_at'])
+    return notification
+
+def activity_to_dict(row):
+    activity = dict(row)
+    activity['created_at'] = format_epoch(activity['created_at'])
+    return activity
+
+MESSAGE_PARTY_TYPE_NAMES = {code: name for name, code in MESSAGE_PARTY_TYPES.items()}
+MESSAGE_CONTEXT_NAMES = {code: name for name, code in MESSAGE_CONTEXTS.items()}
+TIMESHEET_STATUS_NAMES = {code: name for name, code in TIMESHEET_STATUSES.items()}
+MESSAGE_ENUM_NAMES = {
+    'sender': MESSAGE_PARTY_TYPE_NAMES, 'sender_type': MESSAGE_PARTY_TYPE_NAMES,
+    'receiver_type': MESSAGE_PARTY_TYPE_NAMES, 'context': MESSAGE_CONTEXT_NAMES,
+}
+
+def message_to_dict(row):
+    """Decode a messages (or messages_archive) row; queries selecting a subset of columns are fine."""
+    message = dict(row)
+    for column, names in MESSAGE_ENUM_NAMES.items():
+        if column in message:
+            message[column] = names.get(message[column], message[column])
+    if 'created_at' in message:
+        message['created_at'] = format_epoch(message['created_at'])
+    return message
+
+def timesheet_to_dict(row):
+    timesheet = dict(row)
+    timesheet['status'] = TIMESHEET_STATUS_NAMES.get(timesheet['status'], timesheet['status'])
+    for column in ('submitted_at', 'created_at', 'reviewed_at'):
+        if column in timesheet:
+            timesheet[column] = format_epoch(timesheet[column])
+    return timesheet
+
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPES.items()}
+
+def record_event(cursor, event_type, actor_type, actor_id, employee_id=None, related_id=None, summary=None):
+    """Append to the events timeline inside the caller's transaction."""
+    cursor.execute('''
+        INSERT INTO events (type, actor_type, actor_id, employee_id, related_id, summary) VALUES (?, ?, ?, ?, ?, ?)
+    ''', (EVENT_TYPES[event_type], actor_type, actor_id, employee_id, related_id, summary))
+
+def event_to_dict(row):
+    event = dict(row)
+    event['type'] = EVENT_TYPE_NAMES.get(event['type'], event['type'])
+    event['created_at'] = format_epoch(event['created_at'])
+    profile = get_profile(event['actor_type'], event['actor_id']) if event['actor_type'] != 'applicant' else None
+    event['actor_name'] = profile['name'] if profile else None
+    return event
+
+def course_to_dict(row):
+    return {
+        'id': row['id'], 'title': row['title'], 'category': row['category'], 'description': row['description'],
+        'thumbnail_url': row['thumbnail_url'], 'video_url': row['video_url'], 'key_skills': row['key_skills'],
+        'programming_languages': row['programming_languages'], 'course_duration': row['course_duration'],
+        'total_sessions': row['total_sessions'], 'session_duration': row['session_duration'], 'level': row['level'],
+        'target_audience': row['target_audience'], 'mode': row['mode'], 'course_contents': row['course_contents'],
+        'what_you_will_learn': row['what_you_will_learn'],
+        'thumbnail_variants': json.loads(row['thumbnail_variants']) if row['thumbnail_variants'] else None
+    }
+
+def current_identity():
+    """(user type, id) of the logged-in user, checked in the same order as get_unread_count."""
+    if session.get('employee_id'):
+        return 'employee', session['employee_id']
+    if session.get('manager_id'):
+        return 'manager', session['manager_id']
+    if session.get('admin_id'):
+        return 'admin', session['admin_id']
+    return None, None
+
+def message_visibility(user_type, user_id, alias='m'):
+    """SQL condition and params for the messages a user can see (as in the */my-messages routes)."""
+    code = MESSAGE_PARTY_TYPES.get(user_type, user_type)
+    if user_type == 'employee':
+        return (f"(({alias}.employee_id = ? AND {alias}.receiver_type = ?) "
+                f"OR ({alias}.sender_id = ? AND {alias}.sender_type = ?))"), [user_id, code, user_id, code]
+    return (f"(({alias}.receiver_id = ? AND {alias}.receiver_type = ?) "
+            f"OR ({alias}.sender_id = ? AND {alias}.sender_type = ?))"), [user_id, code, user_id, code]
+
+def fts_phrases(text):
+    """User input as space-separated quoted FTS5 terms (last one as prefix), or None if empty."""
+    terms = [term.replace('"', '') for term in text.split()][:16]
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += '*'
+    return ' '.join(phrases)
+
+def fts_match_query(text, user_type, user_id):
+    """Build an FTS5 MATCH expression: quoted user terms scoped to the user's audience tokens."""
+    phrases = fts_phrases(text)
+    if not phrases:
+        return None
+    return f"{{audience}}: (to{user_type}{user_id} OR from{user_type}{user_id}) AND {{message sender_name}}: ({phrases})"
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Inverse of encode_cursor; raises ValueError on a malformed token."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception as e:
+        raise ValueError('Invalid cursor') from e
+
+def message_parties(message):
+    """((sender type, id), (receiver type, id)) of a decoded message; employee receivers are keyed by employee_id."""
+    receiver_type = message['receiver_type'] or 'employee'
+    receiver_id = message['employee_id'] if receiver_type == 'employee' else message['receiver_id']
+    return (message['sender_type'] or 'employee', message['sender_id'] or 0), (receiver_type, receiver_id or 0)
+
+def party_clause(role, party_type, party_id, alias='m'):
+    """SQL condition and params matching messages sent by ('sender') or addressed to ('receiver') a party."""
+    code = MESSAGE_PARTY_TYPES.get(party_type, party_type)
+    if role == 'sender':
+        return f'({alias}.sender_type = ? AND {alias}.sender_id = ?)', [code, party_id]
+    if party_type == 'employee':
+        return f"({alias}.receiver_type = ? AND {alias}.employee_id = ?)", [code, party_id]
+    return f'({alias}.receiver_type = ? AND {alias}.receiver_id = ?)', [code, party_id]
+
+def record_conversation_message(cursor, message_id, message):
+    """Upsert both participants' conversation rows for a newly inserted message."""
+    (sender_type, sender_id), (receiver_type, receiver_id) = message_parties(message)
+    preview = message['message'][:CONVERSATION_PREVIEW_LENGTH]
+    cursor.executemany('''
+        INSERT INTO conversations (owner_type, owner_id, counterparty_type, counterparty_id, context,
+                                   last_message_id, last_message, last_sender_type, last_at, unread_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ON CONFLICT (owner_type, owner_id, counterparty_type, counterparty_id, context) DO UPDATE SET
+            last_message_id = excluded.last_message_id, last_message = excluded.last_message,
+            last_sender_type = excluded.last_sender_type, last_at = excluded.last_at,
+            unread_count = unread_count + excluded.unread_count
+    ''', [
+        (sender_type, sender_id, receiver_type, receiver_id, message['context'], message_id, preview, sender_type, 0),
+        (receiver_type, receiver_id, sender_type, sender_id, message['context'], message_id, preview, sender_type, 1),
+    ])
+
+def release_conversation_unread(cursor, messages):
+    """Decrement receivers' conversation unread counts for messages that were just marked read."""
+    counts = Counter()
+    for message in messages:
+        sender, receiver = message_parties(message)
+        counts[receiver + sender + (message['context'],)] += 1
+    cursor.executemany('''
+        UPDATE conversations SET unread_count = MAX(unread_count - ?, 0)
+        WHERE owner_type = ? AND owner_id = ? AND counterparty_type = ? AND counterparty_id = ? AND context = ?
+    ''', [(count,) + key for key, count in counts.items()])
+
+def broadcast_audience(user_type, user_id, alias='b'):
+    """SQL condition and params for the broadcasts a user receives, or (None, []) if none can reach them.
+
+    Only broadcasts sent since the account was created count, so a new user
+    doesn't start with the whole broadcast history unread.
+    """
+    if user_type == 'employee':
+        return (f"({alias}.audience = 'employees' OR ({alias}.audience = 'role' "
+                f"AND {alias}.audience_role = (SELECT role FROM employees WHERE id = ?))) "
+                f"AND {alias}.created_at >= COALESCE((SELECT created_at FROM employees WHERE id = ?), '')"), [user_id, user_id]
+    if user_type == 'manager':
+        return (f"{alias}.audience = 'managers' "
+                f"AND {alias}.created_at >= COALESCE((SELECT created_at FROM managers WHERE id = ?), '')"), [user_id]
+    return None, []
+
+def get_user_broadcasts(cursor, user_type, user_id, context=None):
+    """A user's broadcasts shaped like message rows, read state taken from their receipts.
+
+    Broadcast rows carry a negative id (-broadcast_id) so they can sit in the
+    same list as messages and be marked read through /api/messages/mark-read/<id>.
+    """
+    audience, params = broadcast_audience(user_type, user_id)
+    if not audience:
+        return []
+    query = f'''
+        SELECT b.*, r.read_at FROM broadcasts b
+        LEFT JOIN broadcast_receipts r
+               ON r.recipient_type = ? AND r.recipient_id = ? AND r.broadcast_id = b.id
+        WHERE {audience}
+    '''
+    params = [user_type, user_id] + params
+    if context:
+        query += ' AND b.context = ?'
+        params.append(context)
+    cursor.execute(query, params)
+    return [broadcast_to_message(row, user_type, user_id) for row in cursor.fetchall()]
+
+def broadcast_to_message(row, user_type, user_id):
+    """A broadcasts row (joined with the recipient's read_at) shaped like a message row."""
+    return {
+        'id': -row['id'], 'broadcast_id': row['id'], 'is_broadcast': True,
+        'audience': row['audience'], 'audience_role': row['audience_role'],
+        'sender': row['sender'], 'sender_name': row['sender_name'],
+        'sender_id': row['sender_id'], 'sender_type': row['sender_type'],
+        'employee_id': user_id if user_type == 'employee' else None,
+        'receiver_id': user_id, 'receiver_type': user_type,
+        'context': row['context'], 'context_id': None, 'message': row['message'],
+        'is_read': 1 if row['read_at'] else 0, 'created_at': row['created_at'],
+    }
+
+def mark_broadcast_read(cursor, user_type, user_id, broadcast_id):
+    """Record a read receipt if the broadcast reaches the user; returns False if it does not."""
+    audience, params = broadcast_audience(user_type, user_id)
+    if not audience:
+        return False
+    cursor.execute(f'SELECT 1 FROM broadcasts b WHERE b.id = ? AND {audience}', [broadcast_id] + params)
+    if not cursor.fetchone():
+        return False
+    cursor.execute('''
+        INSERT OR IGNORE INTO broadcast_receipts (recipient_type, recipient_id, broadcast_id) VALUES (?, ?, ?)
+    ''', (user_type, user_id, broadcast_id))
+    return True
+
+def count_unread_messages(cursor, user_type, user_id):
+    """Unread messages and broadcasts addressed to a user (what /api/unread-count reports)."""
+    to_me, params = party_clause('receiver', user_type, user_id, alias='messages')
+    cursor.execute(f'SELECT COUNT(*) FROM messages WHERE is_read = 0 AND {to_me}', params)
+    unread = cursor.fetchone()[0]
+    audience, audience_params = broadcast_audience(user_type, user_id)
+    if audience:
+        cursor.execute(f'''
+            SELECT COUNT(*) FROM broadcasts b
+            WHERE {audience} AND NOT EXISTS (
+                SELECT 1 FROM broadcast_receipts r
+                WHERE r.recipient_type = ? AND r.recipient_id = ? AND r.broadcast_id = b.id
+            )
+        ''', audience_params + [user_type, user_id])
+        unread += cursor.fetchone()[0]
+    return unread
+
+def parse_id_list(values):
+    """Validate a JSON list of integer ids (at most MARK_READ_MAX_IDS); raises ValueError."""
+    if not isinstance(values, list) or not values or len(values) > MARK_READ_MAX_IDS:
+        raise ValueError(f'ids must be a non-empty list of at most {MARK_READ_MAX_IDS} ids')
+    try:
+        return sorted({int(value) for value in values})
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+
 def populate_sender_names(messages):
     """Fetch and populate actual sender names from database based on sender_type and sender_id"""
     if not messages:
         return messages
     
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        for msg in messages:
-            if not msg.get('sender_id') or msg.get('sender_name') in ['Admin', 'Manager', 'Employee']:
-                sender_type = msg.get('sender_type', 'employee')
-                sender_id = msg.get('sender_id')
-                
-                if sender_type == 'employee' and sender_id:
-                    cursor.execute('SELECT employee_name FROM employees WHERE id = ?', (sender_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        msg['sender_name'] = result['employee_name']
-                elif sender_type == 'manager' and sender_id:
-                    cursor.execute('SELECT employee_name FROM managers WHERE id = ?', (sender_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        msg['sender_name'] = result['employee_name']
-                elif sender_type == 'admin':
-                    msg['sender_name'] = 'BrainHR Admin'
+    for msg in messages:
+        if not msg.get('sender_id') or msg.get('sender_name') in ['Admin', 'Manager', 'Employee']:
+            sender_type = msg.get('sender_type', 'employee')
+            sender_id = msg.get('sender_id')
+            
+            if sender_type == 'admin' or sender_id:
+                profile = get_profile(sender_type, sender_id)
+                if profile:
+                    msg['sender_name'] = profile['name']
     
     return messages
 
@@ -344,8 +1645,13 @@ def health():
 @app.route('/uploads/<filename>')
 def download_file(filename):
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+        filename = secure_filename(filename)
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if os.path.exists(file_path):
+            if filename.startswith(THUMBNAIL_PREFIX):
+                response = send_file(file_path, as_attachment=False, max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+                return response
             return send_file(file_path, as_attachment=False)
         return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -368,7 +1674,12 @@ def admin_login():
         return jsonify({'error': 'username and password required'}), 400
 
     # existing admin check (keeps your current ADMIN_USERNAME / ADMIN_PASSWORD_HASH logic)
-    if username == ADMIN_USERNAME and check_password_hash(ADMIN_PASSWORD_HASH, password):
+    try:
+        valid = username == ADMIN_USERNAME and verify_password(ADMIN_PASSWORD_HASH, password)
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
+
+    if valid:
         session.permanent = True
         session['admin_logged_in'] = True
         session['admin_id'] = 1
@@ -425,7 +1736,9 @@ def manager_login():
             cursor.execute('SELECT * FROM managers WHERE username = ?', (username,))
             manager = cursor.fetchone()
 
-        if manager and check_password_hash(manager['password_hash'], password):
+        if manager and verify_password(manager['password_hash'], password):
+            if password_needs_rehash(manager['password_hash']):
+                rehash_password_in_background('managers', manager['id'], manager['password_hash'], password)
             session.permanent = True
             session['manager_logged_in'] = True
             session['manager_id'] = manager['id']
@@ -436,6 +1749,8 @@ def manager_login():
 
         logger.warning(f"Invalid manager login attempt: {username}")
         return jsonify({'error': 'Invalid credentials'}), 401
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Manager login error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -460,18 +1775,12 @@ def manager_check():
 @manager_login_required
 def get_manager_info():
     try:
-        manager_id = session.get('manager_id')
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, employee_name FROM managers WHERE id = ?', (manager_id,))
-            manager = cursor.fetchone()
-        
+        manager = get_profile('manager', session.get('manager_id'))
         if manager:
             return jsonify({
                 'id': manager['id'],
                 'username': manager['username'],
-                'name': manager['employee_name']
+                'name': manager['name']
             })
         return jsonify({'error': 'Manager not found'}), 404
     except Exception as e:
@@ -500,7 +1809,9 @@ def employee_login():
             cursor.execute('SELECT * FROM employees WHERE employee_id_field = ? AND username = ?', (employee_id_field, username))
             employee = cursor.fetchone()
 
-        if employee and check_password_hash(employee['password_hash'], password):
+        if employee and verify_password(employee['password_hash'], password):
+            if password_needs_rehash(employee['password_hash']):
+                rehash_password_in_background('employees', employee['id'], employee['password_hash'], password)
             session.permanent = True
             session['employee_logged_in'] = True
             session['employee_id'] = employee['id']
@@ -511,6 +1822,8 @@ def employee_login():
 
         logger.warning(f"Invalid employee login attempt: {employee_id_field} / {username}")
         return jsonify({'error': 'Invalid credentials'}), 401
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Employee login error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -534,18 +1847,12 @@ def employee_check():
 @employee_login_required
 def get_employee_info():
     try:
-        employee_id = session.get('employee_id')
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, employee_name FROM employees WHERE id = ?', (employee_id,))
-            employee = cursor.fetchone()
-        
+        employee = get_profile('employee', session.get('employee_id'))
         if employee:
             return jsonify({
                 'id': employee['id'],
                 'username': employee['username'],
-                'name': employee['employee_name']
+                'name': employee['name']
             })
         return jsonify({'error': 'Employee not found'}), 404
     except Exception as e:
@@ -575,7 +1882,7 @@ def create_employee():
         if not data or not all(k in data for k in ['username', 'password', 'employee_name', 'employee_id_field']):
             return jsonify({'error': 'Missing required fields: username, password, employee_name, employee_id_field'}), 400
         
-        password_hash = generate_password_hash(data['password'])
+        password_hash = hash_password(data['password'])
         
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
@@ -586,16 +1893,121 @@ def create_employee():
             conn.commit()
             employee_id = cursor.lastrowid
         
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
         logger.info(f"Employee created: {data['username']}")
         return jsonify({'success': True, 'employee_id': employee_id}), 201
     except sqlite3.IntegrityError as e:
         if 'employee_id_field' in str(e):
             return jsonify({'error': 'Employee ID already exists'}), 400
         return jsonify({'error': 'Username already exists'}), 400
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Create employee error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/employees/import', methods=['POST'])
+@login_required
+def import_employees():
+    """Create employees from an uploaded CSV/XLSX; returns a per-row report.
+
+    All rows are validated before anything is written. Valid rows are inserted
+    in one transaction; rows with errors are reported and skipped.
+    """
+    try:
+        if 'file' not in request.files or not request.files['file'].filename:
+            return jsonify({'error': 'File is required'}), 400
+        file = request.files['file']
+        dry_run = str(request.form.get('dry_run', request.args.get('dry_run', ''))).lower() in ('1', 'true', 'yes')
+        
+        extension = file.filename.rsplit('.', 1)[-1].lower()
+        if extension == 'csv':
+            df = pd.read_csv(file, dtype=str, keep_default_na=False)
+        elif extension in ('xlsx', 'xls'):
+            df = pd.read_excel(file, dtype=str).fillna('')
+        else:
+            return jsonify({'error': 'Invalid file type. Please upload CSV or XLSX.'}), 400
+        
+        df.columns = [str(col).strip().lower().replace(' ', '_') for col in df.columns]
+        df = df.rename(columns={'employee_id': 'employee_id_field', 'name': 'employee_name'})
+        required = ['username', 'password', 'employee_name', 'employee_id_field']
+        missing_columns = [col for col in required if col not in df.columns]
+        if missing_columns:
+            return jsonify({'error': f'Missing required columns: {", ".join(missing_columns)}'}), 400
+        if len(df) > EMPLOYEE_IMPORT_MAX_ROWS:
+            return jsonify({'error': f'Import is limited to {EMPLOYEE_IMPORT_MAX_ROWS} rows'}), 400
+        for col in ('email', 'role'):
+            if col not in df.columns:
+                df[col] = ''
+        rows = [{key: str(value).strip() for key, value in record.items()}
+                for record in df[required + ['email', 'role']].to_dict('records')]
+        
+        # One indexed lookup for every username / employee ID already taken
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT username, employee_id_field FROM employees
+                WHERE username IN (SELECT value FROM json_each(?))
+                   OR employee_id_field IN (SELECT value FROM json_each(?))
+            ''', (json.dumps([row['username'] for row in rows]), json.dumps([row['employee_id_field'] for row in rows])))
+            existing = cursor.fetchall()
+        taken_usernames = {username for username, _ in existing}
+        taken_ids = {emp_id for _, emp_id in existing}
+        
+        report, valid = [], []
+        seen_usernames, seen_ids = set(), set()
+        for index, row in enumerate(rows):
+            errors = [f'{field} is required' for field in required if not row[field]]
+            if row['username'] in taken_usernames:
+                errors.append('Username already exists')
+            elif row['username'] and row['username'] in seen_usernames:
+                errors.append('Duplicate username in file')
+            if row['employee_id_field'] in taken_ids:
+                errors.append('Employee ID already exists')
+            elif row['employee_id_field'] and row['employee_id_field'] in seen_ids:
+                errors.append('Duplicate employee ID in file')
+            seen_usernames.add(row['username'])
+            seen_ids.add(row['employee_id_field'])
+            
+            entry = {'row': index + 2, 'username': row['username'], 'employee_id_field': row['employee_id_field']}
+            if errors:
+                entry.update(status='error', errors=errors)
+            else:
+                entry['status'] = 'valid' if dry_run else 'created'
+                valid.append(row)
+            report.append(entry)
+        
+        if valid and not dry_run:
+            hashes = hash_passwords([row['password'] for row in valid])
+            with sqlite3.connect(DB_FILE) as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO employees (username, password_hash, password, employee_name, email, employee_id_field, role)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(row['username'], password_hash, row['password'], row['employee_name'], row['email'],
+                       row['employee_id_field'], row['role'] or 'employee')
+                      for row, password_hash in zip(valid, hashes)])
+                conn.commit()
+            timesheet_matrix_cache.clear()
+            manager_overview_cache.clear()
+            logger.info(f"Imported {len(valid)} employees")
+        
+        return jsonify({
+            'success': True,
+            'dry_run': dry_run,
+            'created': 0 if dry_run else len(valid),
+            'failed': len(rows) - len(valid),
+            'rows': report
+        }), 200 if dry_run else 201
+    except sqlite3.IntegrityError as e:
+        return jsonify({'error': f'Import aborted, no employees were created: {e}'}), 409
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
+    except Exception as e:
+        logger.error(f"Import employees error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/employees/<int:employee_id>', methods=['PUT'])
 @login_required
 def update_employee(employee_id):
@@ -606,7 +2018,7 @@ def update_employee(employee_id):
             cursor = conn.cursor()
             
             if 'password' in data and data['password']:
-                password_hash = generate_password_hash(data['password'])
+                password_hash = hash_password(data['password'])
                 cursor.execute('''
                     UPDATE employees SET password_hash = ?, password = ?, employee_name = ?, email = ?, employee_id_field = ?, role = ?
                     WHERE id = ?
@@ -619,12 +2031,17 @@ def update_employee(employee_id):
             
             conn.commit()
         
+        profile_cache.pop(('employee', employee_id))
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
         logger.info(f"Employee updated: {employee_id}")
         return jsonify({'success': True})
     except sqlite3.IntegrityError as e:
         if 'employee_id_field' in str(e):
             return jsonify({'error': 'Employee ID already exists'}), 400
         return jsonify({'error': 'Update failed due to duplicate value'}), 400
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Update employee error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -636,8 +2053,18 @@ def delete_employee(employee_id):
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM employees WHERE id = ?', (employee_id,))
+            cursor.execute('DELETE FROM manager_team WHERE employee_id = ?', (employee_id,))
+            # Their uploads become unreferenced and are removed by the upload GC after the grace period
+            cursor.execute('''
+                DELETE FROM timesheet_versions WHERE timesheet_id IN (SELECT id FROM timesheets WHERE employee_id = ?)
+            ''', (employee_id,))
+            cursor.execute('DELETE FROM timesheets WHERE employee_id = ?', (employee_id,))
+            cursor.execute('DELETE FROM visa_docs WHERE employee_id = ?', (employee_id,))
             conn.commit()
         
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
+        profile_cache.pop(('employee', employee_id))
         logger.info(f"Employee deleted: {employee_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -651,7 +2078,7 @@ def reset_employee_password(employee_id):
         import secrets
         import string
         temp_password = ''.join(secrets.choice(string.ascii_letters + string.digits + '!@#$%') for _ in range(12))
-        password_hash = generate_password_hash(temp_password)
+        password_hash = hash_password(temp_password)
         
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
@@ -660,6 +2087,8 @@ def reset_employee_password(employee_id):
         
         logger.info(f"Employee password reset: {employee_id}")
         return jsonify({'temporary_password': temp_password})
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Reset password error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -687,7 +2116,7 @@ def create_manager():
         if not data or not all(k in data for k in ['username', 'password', 'employee_name']):
             return jsonify({'error': 'Missing required fields: username, password, employee_name'}), 400
         
-        password_hash = generate_password_hash(data['password'])
+        password_hash = hash_password(data['password'])
         
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
@@ -702,6 +2131,8 @@ def create_manager():
         return jsonify({'success': True, 'manager_id': manager_id}), 201
     except sqlite3.IntegrityError:
         return jsonify({'error': 'Username already exists'}), 400
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Create manager error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -716,7 +2147,7 @@ def update_manager(manager_id):
             cursor = conn.cursor()
             
             if 'password' in data:
-                password_hash = generate_password_hash(data['password'])
+                password_hash = hash_password(data['password'])
                 cursor.execute('''
                     UPDATE managers SET password_hash = ?, employee_name = ?, email = ?
                     WHERE id = ?
@@ -729,8 +2160,11 @@ def update_manager(manager_id):
             
             conn.commit()
         
+        profile_cache.pop(('manager', manager_id))
         logger.info(f"Manager updated: {manager_id}")
         return jsonify({'success': True})
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Update manager error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -742,8 +2176,10 @@ def delete_manager(manager_id):
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM managers WHERE id = ?', (manager_id,))
+            cursor.execute('DELETE FROM manager_team WHERE manager_id = ?', (manager_id,))
             conn.commit()
         
+        profile_cache.pop(('manager', manager_id))
         logger.info(f"Manager deleted: {manager_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -757,7 +2193,7 @@ def reset_manager_password(manager_id):
         import secrets
         import string
         temp_password = ''.join(secrets.choice(string.ascii_letters + string.digits + '!@#$%') for _ in range(12))
-        password_hash = generate_password_hash(temp_password)
+        password_hash = hash_password(temp_password)
         
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
@@ -766,6 +2202,8 @@ def reset_manager_password(manager_id):
         
         logger.info(f"Manager password reset: {manager_id}")
         return jsonify({'temporary_password': temp_password})
+    except PasswordHashBusy as e:
+        return password_busy_response(e)
     except Exception as e:
         logger.error(f"Reset manager password error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -782,7 +2220,7 @@ def get_employee_timesheets():
             cursor.execute('''
                 SELECT * FROM timesheets WHERE employee_id = ? ORDER BY year DESC, month DESC, week DESC
             ''', (employee_id,))
-            timesheets = [dict(row) for row in cursor.fetchall()]
+            timesheets = [timesheet_to_dict(row) for row in cursor.fetchall()]
         return jsonify(timesheets)
     except Exception as e:
         logger.error(f"Get timesheets error: {e}")
@@ -802,22 +2240,59 @@ def upload_timesheet():
         
         if not all([year, month, week]):
             return jsonify({'error': 'Missing required fields: year, month, week'}), 400
+        try:
+            year, month, week = int(year), int(month), int(week)
+        except ValueError:
+            return jsonify({'error': 'year, month and week must be integers'}), 400
         
         employee_id = session.get('employee_id')
         filename = secure_filename(f"timesheet_{year}_{month}_{week}_{datetime.now().timestamp()}.pdf")
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(file_path)
+        digest = file_sha256(file_path)
         
+        period = (employee_id, year, month, week)
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO timesheets (employee_id, year, month, week, filename, file_path, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (employee_id, year, month, week, filename, file_path, 'draft'))
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT status FROM timesheets WHERE employee_id = ? AND year = ? AND month = ? AND week = ?', period)
+            existing = cursor.fetchone()
+            status = TIMESHEET_STATUS_NAMES.get(existing[0], existing[0]) if existing else None
+            if status in TIMESHEET_LOCKED_STATUSES:
+                conn.rollback()
+                os.remove(file_path)
+                return jsonify({'error': f'Timesheet for this week is already {status} and cannot be replaced',
+                                'status': status}), 409
+            # Re-uploading a draft or rejected period replaces the live row; the previous upload and its
+            # review move to history (timesheet_versions keeps status names and text timestamps)
+            cursor.execute(f'''
+                INSERT INTO timesheet_versions (timesheet_id, version, filename, file_path, status, submitted_at, created_at,
+                                                reviewed_at, review_note)
+                SELECT id, COALESCE(version, 1), filename, file_path, {sql_enum_name('status', TIMESHEET_STATUSES)},
+                       datetime(submitted_at, 'unixepoch'), datetime(created_at, 'unixepoch'),
+                       datetime(reviewed_at, 'unixepoch'), review_note FROM timesheets
+                WHERE employee_id = ? AND year = ? AND month = ? AND week = ?
+            ''', period)
+            replaced = cursor.rowcount > 0
+            cursor.execute(f'''
+                INSERT INTO timesheets (employee_id, year, month, week, filename, file_path, file_sha256, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, {TIMESHEET_STATUSES['draft']})
+                ON CONFLICT(employee_id, year, month, week) DO UPDATE SET
+                    filename = excluded.filename, file_path = excluded.file_path, file_sha256 = excluded.file_sha256,
+                    status = excluded.status, submitted_at = NULL, created_at = {EPOCH_NOW_SQL},
+                    reviewed_at = NULL, review_note = NULL, submit_note = NULL, version = COALESCE(version, 1) + 1
+            ''', period + (filename, file_path, digest))
+            cursor.execute('SELECT id, version FROM timesheets WHERE employee_id = ? AND year = ? AND month = ? AND week = ?', period)
+            timesheet_id, version = cursor.fetchone()
+            cursor.execute('DELETE FROM timesheet_versions WHERE timesheet_id = ? AND version < ?',
+                           (timesheet_id, version - TIMESHEET_HISTORY_LIMIT))
+            record_event(cursor, 'timesheet_uploaded', 'employee', employee_id, employee_id, timesheet_id,
+                         f'Week {week}, Month {month}, Year {year} (v{version})')
             conn.commit()
-            timesheet_id = cursor.lastrowid
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
         
-        return jsonify({'success': True, 'timesheet_id': timesheet_id}), 201
+        return jsonify({'success': True, 'timesheet_id': timesheet_id, 'version': version, 'replaced': replaced}), 201
     except Exception as e:
         logger.error(f"Upload timesheet error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -829,10 +2304,10 @@ def submit_timesheet(timesheet_id):
         employee_id = session.get('employee_id')
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE timesheets SET status = ?, submitted_at = CURRENT_TIMESTAMP
+            cursor.execute(f'''
+                UPDATE timesheets SET status = ?, submitted_at = {EPOCH_NOW_SQL}
                 WHERE id = ? AND employee_id = ?
-            ''', ('submitted', timesheet_id, employee_id))
+            ''', (TIMESHEET_STATUSES['submitted'], timesheet_id, employee_id))
             conn.commit()
         
         with sqlite3.connect(DB_FILE) as conn:
@@ -843,15 +2318,132 @@ def submit_timesheet(timesheet_id):
             cursor.execute('''
                 INSERT INTO notifications (employee_id, type, title, description, related_id)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (employee_id, 'timesheet', f'Timesheet submitted for Week {ts[2]}, Month {ts[1]}, Year {ts[0]}',
+            ''', (employee_id, NOTIFICATION_TYPES['timesheet'], f'Timesheet submitted for Week {ts[2]}, Month {ts[1]}, Year {ts[0]}',
                   f'Your timesheet for week {ts[2]} of month {ts[1]} in year {ts[0]} has been submitted.', timesheet_id))
+            record_event(cursor, 'timesheet_submitted', 'employee', employee_id, employee_id, timesheet_id,
+                         f'Week {ts[2]}, Month {ts[1]}, Year {ts[0]}')
             conn.commit()
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
         
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Submit timesheet error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def apply_bulk_timesheet_action(action, data, employee_id=None):
+    """Apply submit/approve/reject to timesheets selected by id list or period filter.
+
+    Status updates and their notifications are written with executemany in a
+    single transaction. Returns (per-item results, number updated).
+    """
+    allowed_from, new_status = TIMESHEET_TRANSITIONS[action]
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    raw_ids = data.get('timesheet_ids') or []
+    if not isinstance(raw_ids, list):
+        raise ValueError('timesheet_ids must be a list of integers')
+    try:
+        ids = list(dict.fromkeys(int(ts_id) for ts_id in raw_ids))  # de-duplicated, request order kept
+    except (TypeError, ValueError):
+        raise ValueError('timesheet_ids must be a list of integers')
+    note = data.get('note') or None
+
+    query = 'SELECT id, employee_id, year, month, week, status FROM timesheets'
+    conditions, params = [], []
+    if ids:
+        conditions.append(f"id IN ({','.join('?' for _ in ids)})")
+        params.extend(ids)
+    else:
+        if data.get('year') in (None, ''):
+            raise ValueError('Provide timesheet_ids or a period filter (year, month, week)')
+        for field in ('year', 'month', 'week', 'employee_id'):
+            if data.get(field) not in (None, ''):
+                conditions.append(f'{field} = ?')
+                params.append(int(data[field]))
+    if employee_id is not None:
+        conditions.append('employee_id = ?')
+        params.append(employee_id)
+    query += ' WHERE ' + ' AND '.join(conditions) + ' ORDER BY year, month, week, employee_id'
+
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute(query, params)
+        rows = {row['id']: timesheet_to_dict(row) for row in cursor.fetchall()}
+
+        results, updates, notifications, events = [], [], [], []
+        actor_type, actor_id = current_identity()
+        for ts_id in (ids or list(rows)):
+            row = rows.get(ts_id)
+            if row is None:
+                results.append({'id': ts_id, 'success': False, 'error': 'Timesheet not found'})
+                continue
+            if row['status'] not in allowed_from:
+                results.append({'id': ts_id, 'success': False, 'status': row['status'],
+                                'error': f"Cannot {action} a timesheet that is {row['status']}"})
+                continue
+            updates.append((TIMESHEET_STATUSES[new_status], note, ts_id))
+            period = f"week {row['week']} of month {row['month']} in year {row['year']}"
+            notifications.append((
+                row['employee_id'], NOTIFICATION_TYPES['timesheet'],
+                f"Timesheet {new_status} for Week {row['week']}, Month {row['month']}, Year {row['year']}",
+                f"Your timesheet for {period} has been {new_status}." + (f" Note: {note}" if note else ''),
+                ts_id
+            ))
+            events.append((EVENT_TYPES[f'timesheet_{new_status}'], actor_type, actor_id, row['employee_id'], ts_id,
+                           f"Week {row['week']}, Month {row['month']}, Year {row['year']}"))
+            results.append({'id': ts_id, 'success': True, 'status': new_status})
+
+        if action == 'submit':
+            # The employee's note goes in submit_note so a rejection's review_note stays visible to the reviewer
+            cursor.executemany(f'UPDATE timesheets SET status = ?, submit_note = ?, submitted_at = {EPOCH_NOW_SQL} WHERE id = ?', updates)
+        else:
+            cursor.executemany(f'UPDATE timesheets SET status = ?, review_note = ?, reviewed_at = {EPOCH_NOW_SQL} WHERE id = ?', updates)
+        cursor.executemany('''
+            INSERT INTO notifications (employee_id, type, title, description, related_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', notifications)
+        cursor.executemany('''
+            INSERT INTO events (type, actor_type, actor_id, employee_id, related_id, summary) VALUES (?, ?, ?, ?, ?, ?)
+        ''', events)
+        conn.commit()
+
+    if updates:
+        timesheet_matrix_cache.clear()
+        manager_overview_cache.clear()
+    return results, len(updates)
+
+@app.route('/api/employee/timesheets/bulk-submit', methods=['POST'])
+@employee_login_required
+def bulk_submit_timesheets():
+    try:
+        data = request.get_json(silent=True) or {}
+        results, updated = apply_bulk_timesheet_action('submit', data, employee_id=session.get('employee_id'))
+        return jsonify({'success': True, 'updated': updated, 'results': results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Bulk submit timesheets error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/timesheets/bulk-<action>', methods=['POST'])
+@login_required
+def bulk_review_timesheets(action):
+    if action not in ('approve', 'reject'):
+        return jsonify({'error': 'Not Found', 'path': request.path}), 404
+    try:
+        data = request.get_json(silent=True) or {}
+        results, updated = apply_bulk_timesheet_action(action, data)
+        logger.info(f"Bulk {action}: {updated} timesheets")
+        return jsonify({'success': True, 'updated': updated, 'results': results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Bulk {action} timesheets error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/timesheets', methods=['GET'])
 @login_required
 def get_all_timesheets():
@@ -871,18 +2463,99 @@ def get_all_timesheets():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            timesheets = [dict(row) for row in cursor.fetchall()]
+            timesheets = [timesheet_to_dict(row) for row in cursor.fetchall()]
         return jsonify(timesheets)
     except Exception as e:
         logger.error(f"Get all timesheets error: {e}")
         return jsonify({'error': str(e)}), 500
 
-# ---------- Visa Docs API ----------
-@app.route('/api/employee/visa-docs', methods=['GET'])
-@employee_login_required
-def get_employee_visa_docs():
+def parse_year_month(value):
+    """Parse 'YYYY-MM' into (year, month); raises ValueError."""
+    year, month = (int(part) for part in value.split('-', 1))
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month in {value!r}")
+    return year, month
+
+@app.route('/api/admin/timesheets/completeness', methods=['GET'])
+@login_required
+def get_timesheet_completeness():
+    """Employees x weeks grid of timesheet status ('missing', 'draft', 'submitted', ...) for a month range."""
     try:
-        employee_id = session.get('employee_id')
+        now = datetime.now()
+        try:
+            start = parse_year_month(request.args.get('start', f"{now.year}-{now.month:02d}"))
+            end = parse_year_month(request.args.get('end', f"{start[0]}-{start[1]:02d}"))
+        except ValueError:
+            return jsonify({'error': 'start and end must be formatted as YYYY-MM'}), 400
+        start_key, end_key = start[0] * 12 + start[1] - 1, end[0] * 12 + end[1] - 1
+        if end_key < start_key:
+            return jsonify({'error': 'end must not be before start'}), 400
+        if end_key - start_key >= TIMESHEET_MATRIX_MAX_MONTHS:
+            return jsonify({'error': f'Range is limited to {TIMESHEET_MATRIX_MAX_MONTHS} months'}), 400
+        employee_id = request.args.get('employee_id', type=int)
+
+        cache_key = (start, end, employee_id)
+        matrix = timesheet_matrix_cache.get(cache_key)
+        if matrix is not None:
+            return jsonify(matrix)
+
+        query = '''
+            WITH RECURSIVE months(k) AS (
+                SELECT ? UNION ALL SELECT k + 1 FROM months WHERE k < ?
+            ),
+            weeks(w) AS (
+                SELECT 1 UNION ALL SELECT w + 1 FROM weeks WHERE w < ?
+            )
+            SELECT e.id, e.employee_name, COALESCE(ts.status, 'missing') AS status
+            FROM employees e
+            CROSS JOIN months
+            CROSS JOIN weeks
+            LEFT JOIN timesheets ts
+                ON ts.employee_id = e.id AND ts.year = months.k / 12
+                AND ts.month = months.k % 12 + 1 AND ts.week = weeks.w
+        '''
+        params = [start_key, end_key, TIMESHEET_WEEKS_PER_MONTH]
+        if employee_id:
+            query += ' WHERE e.id = ?'
+            params.append(employee_id)
+        query += ' ORDER BY e.employee_name, e.id, months.k, weeks.w'
+
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        periods = [[k // 12, k % 12 + 1, week]
+                   for k in range(start_key, end_key + 1)
+                   for week in range(1, TIMESHEET_WEEKS_PER_MONTH + 1)]
+        employees = []
+        summary = {}
+        for emp_id, employee_name, status in rows:
+            if not employees or employees[-1]['id'] != emp_id:
+                employees.append({'id': emp_id, 'employee_name': employee_name, 'statuses': []})
+            status = TIMESHEET_STATUS_NAMES.get(status, status)
+            employees[-1]['statuses'].append(status)
+            summary[status] = summary.get(status, 0) + 1
+
+        matrix = {
+            'start': f"{start[0]}-{start[1]:02d}",
+            'end': f"{end[0]}-{end[1]:02d}",
+            'periods': periods,
+            'employees': employees,
+            'summary': summary
+        }
+        timesheet_matrix_cache.set(cache_key, matrix)
+        return jsonify(matrix)
+    except Exception as e:
+        logger.error(f"Timesheet completeness error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ---------- Visa Docs API ----------
+@app.route('/api/employee/visa-docs', methods=['GET'])
+@employee_login_required
+def get_employee_visa_docs():
+    try:
+        employee_id = session.get('employee_id')
         with sqlite3.connect(DB_FILE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
@@ -920,8 +2593,10 @@ def upload_visa_doc():
                 INSERT INTO visa_docs (employee_id, filename, file_path, doc_name, visa_type)
                 VALUES (?, ?, ?, ?, ?)
             ''', (employee_id, filename, file_path, doc_name, visa_type))
-            conn.commit()
             doc_id = cursor.lastrowid
+            record_event(cursor, 'visa_doc_uploaded', 'employee', employee_id, employee_id, doc_id, doc_name)
+            conn.commit()
+        manager_overview_cache.clear()
         
         return jsonify({'success': True, 'doc_id': doc_id}), 201
     except Exception as e:
@@ -1015,6 +2690,42 @@ def download_timesheet(timesheet_id):
         logger.error(f"Download timesheet error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/timesheets/<int:timesheet_id>/versions', methods=['GET'])
+@login_required
+def get_timesheet_versions(timesheet_id):
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, timesheet_id, version, filename, status, submitted_at, created_at, superseded_at,
+                       reviewed_at, review_note
+                FROM timesheet_versions WHERE timesheet_id = ? ORDER BY version DESC
+            ''', (timesheet_id,))
+            versions = [dict(row) for row in cursor.fetchall()]
+        return jsonify(versions)
+    except Exception as e:
+        logger.error(f"Get timesheet versions error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/timesheets/versions/<int:version_id>/download', methods=['GET'])
+@login_required
+def download_timesheet_version(version_id):
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT filename, file_path FROM timesheet_versions WHERE id = ?', (version_id,))
+            ts = cursor.fetchone()
+        
+        path = resolve_upload_path(ts[1]) if ts else None
+        if not path:
+            return jsonify({'error': 'Timesheet version not found'}), 404
+        
+        return send_file(path, as_attachment=True, download_name=ts[0])
+    except Exception as e:
+        logger.error(f"Download timesheet version error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/admin/timesheets/download-multiple', methods=['POST'])
 @login_required
 def download_multiple_timesheets():
@@ -1043,6 +2754,136 @@ def download_multiple_timesheets():
         logger.error(f"Download multiple timesheets error: {e}")
         return jsonify({'error': str(e)}), 500
 
+class BundleSourceError(Exception):
+    """A source timesheet could not be read while merging a bundle."""
+    def __init__(self, timesheet_id, reason):
+        super().__init__(f"Timesheet {timesheet_id} is unreadable: {reason}")
+        self.timesheet_id = timesheet_id
+
+def build_timesheet_bundle(label, entries):
+    """Merge (digest, bookmark title, path, timesheet id) entries into one bookmarked PDF; returns the cached path.
+
+    The result is cached under a key derived from the source digests, so
+    unchanged inputs are never re-merged. Raises BundleSourceError if any
+    source is unreadable; partial bundles are never written to the cache.
+    """
+    key = hashlib.sha256(json.dumps([label, [(digest, title) for digest, title, _, _ in entries]]).encode()).hexdigest()
+    bundle_path = os.path.join(BUNDLE_CACHE_FOLDER, f"{key}.pdf")
+    if os.path.exists(bundle_path):
+        os.utime(bundle_path)
+        return bundle_path
+
+    writer = PdfWriter()
+    try:
+        for _, title, path, timesheet_id in entries:
+            try:
+                writer.append(PdfReader(path), outline_item=title, import_outline=False)
+            except (PdfReadError, OSError, ValueError) as e:
+                raise BundleSourceError(timesheet_id, e)
+        tmp_path = f"{bundle_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as out:
+                writer.write(out)
+            os.replace(tmp_path, bundle_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    finally:
+        writer.close()
+
+    # In-flight .tmp files belong to other writers and are never trimmed
+    cached = sorted((entry for entry in os.scandir(BUNDLE_CACHE_FOLDER) if entry.name.endswith('.pdf')),
+                    key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in cached[BUNDLE_CACHE_MAX_FILES:]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return bundle_path
+
+@app.route('/api/admin/timesheets/bundle', methods=['POST'])
+@login_required
+def download_timesheet_bundle():
+    """Merged, bookmarked PDF per employee or per month for the selected timesheets (zipped if several)."""
+    if PdfWriter is None:
+        return jsonify({'error': 'PDF merging is not available on this server (pypdf is not installed)'}), 503
+    try:
+        data = request.get_json(silent=True) or {}
+        ts_ids = data.get('timesheet_ids', []) if isinstance(data, dict) else None
+        group_by = data.get('group_by', 'employee') if isinstance(data, dict) else None
+        if not isinstance(ts_ids, list) or not all(isinstance(ts_id, int) and not isinstance(ts_id, bool) for ts_id in ts_ids):
+            return jsonify({'error': 'timesheet_ids must be a list of integers'}), 400
+        ts_ids = sorted(set(ts_ids))
+        if not ts_ids:
+            return jsonify({'error': 'No timesheets selected'}), 400
+        if group_by not in ('employee', 'period'):
+            return jsonify({'error': "group_by must be 'employee' or 'period'"}), 400
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT ts.id, ts.employee_id, ts.year, ts.month, ts.week, ts.file_path, ts.file_sha256, e.employee_name
+                FROM timesheets ts JOIN employees e ON ts.employee_id = e.id
+                WHERE ts.id IN ({','.join('?' for _ in ts_ids)})
+                ORDER BY e.employee_name, ts.employee_id, ts.year, ts.month, ts.week
+            ''', ts_ids)
+            rows = cursor.fetchall()
+            
+            groups = {}
+            backfill = []
+            missing = sorted(set(ts_ids) - {row['id'] for row in rows})
+            for row in rows:
+                path = resolve_upload_path(row['file_path'])
+                if not path:
+                    missing.append(row['id'])
+                    continue
+                digest = row['file_sha256']
+                if not digest:
+                    digest = file_sha256(path)
+                    backfill.append((digest, row['id']))
+                period = f"{row['year']}-{row['month']:02d}"
+                if group_by == 'employee':
+                    label = f"{row['employee_name']}_{row['employee_id']}"
+                    title = f"{period} Week {row['week']}"
+                else:
+                    label = f"timesheets_{row['year']}_{row['month']:02d}"
+                    title = f"{row['employee_name']} - Week {row['week']}"
+                groups.setdefault(label, []).append((digest, title, path, row['id']))
+            if backfill:
+                cursor.executemany('UPDATE timesheets SET file_sha256 = ? WHERE id = ?', backfill)
+                conn.commit()
+        
+        if missing:
+            return jsonify({'error': 'Some timesheets or their files were not found', 'timesheet_ids': sorted(missing)}), 404
+        oversized = [label for label, entries in groups.items() if len(entries) > BUNDLE_MAX_DOCUMENTS]
+        if oversized:
+            return jsonify({'error': f'A bundle can hold at most {BUNDLE_MAX_DOCUMENTS} timesheets; select fewer or group by employee',
+                            'bundles': oversized}), 413
+        if group_by == 'period':
+            for entries in groups.values():
+                entries.sort(key=lambda entry: entry[1])
+        
+        try:
+            bundles = [(secure_filename(f"{label}.pdf"), build_timesheet_bundle(label, entries))
+                       for label, entries in groups.items()]
+        except BundleSourceError as e:
+            return jsonify({'error': str(e), 'timesheet_ids': [e.timesheet_id]}), 422
+        if len(bundles) == 1:
+            name, path = bundles[0]
+            return send_file(path, mimetype='application/pdf', as_attachment=True, download_name=name)
+        
+        memory_file = tempfile.SpooledTemporaryFile()
+        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_STORED) as zf:
+            for name, path in bundles:
+                zf.write(path, name)
+        memory_file.seek(0)
+        return send_file(memory_file, mimetype='application/zip', as_attachment=True, download_name='timesheet_bundles.zip')
+    except Exception as e:
+        logger.error(f"Timesheet bundle error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ---------- Activities API ----------
 @app.route('/api/employee/activities', methods=['GET'])
 @employee_login_required
@@ -1055,7 +2896,7 @@ def get_employee_activities():
             cursor.execute('''
                 SELECT * FROM activities WHERE employee_id = ? ORDER BY created_at DESC
             ''', (employee_id,))
-            activities = [dict(row) for row in cursor.fetchall()]
+            activities = [activity_to_dict(row) for row in cursor.fetchall()]
         return jsonify(activities)
     except Exception as e:
         logger.error(f"Get activities error: {e}")
@@ -1077,15 +2918,17 @@ def create_activity():
                 INSERT INTO activities (employee_id, activity_name, activity_description)
                 VALUES (?, ?, ?)
             ''', (employee_id, data['activity_name'], data.get('activity_description', '')))
-            conn.commit()
             activity_id = cursor.lastrowid
+            record_event(cursor, 'activity_posted', 'employee', employee_id, employee_id, activity_id, data['activity_name'])
+            conn.commit()
+        manager_overview_cache.clear()
         
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO notifications (employee_id, type, title, description, related_id)
                 VALUES (?, ?, ?, ?, ?)
-            ''', (employee_id, 'activity', f'Activity: {data["activity_name"]}',
+            ''', (employee_id, NOTIFICATION_TYPES['activity'], f'Activity: {data["activity_name"]}',
                   f'You have posted a new activity: {data["activity_name"]}', activity_id))
             conn.commit()
         
@@ -1106,12 +2949,74 @@ def get_employee_messages():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, (employee_id,))
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
         return jsonify(messages)
     except Exception as e:
         logger.error(f"Get messages error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/employee/sync', methods=['GET'])
+@employee_login_required
+def employee_sync():
+    """Rows inserted or updated since `since` across the employee portal tables, plus a new token.
+
+    Broadcasts reaching the employee come back under `broadcasts`, shaped like
+    messages; one reappears when the employee reads it so is_read stays current.
+    """
+    try:
+        employee_id = session.get('employee_id')
+        try:
+            since = int(request.args.get('since') or 0)
+        except ValueError:
+            return jsonify({'error': 'Invalid sync token'}), 400
+        limit = max(1, min(request.args.get('limit', SYNC_PAGE_SIZE, type=int), SYNC_PAGE_SIZE))
+        
+        queries = {
+            'timesheets': ('SELECT * FROM timesheets WHERE employee_id = ? AND change_seq > ?', [employee_id, since]),
+            'visa_docs': ('SELECT * FROM visa_docs WHERE employee_id = ? AND change_seq > ?', [employee_id, since]),
+            'activities': ('SELECT * FROM activities WHERE employee_id = ? AND change_seq > ?', [employee_id, since]),
+        }
+        visible, visible_params = message_visibility('employee', employee_id, alias='messages')
+        queries['messages'] = (f'SELECT * FROM messages WHERE {visible} AND change_seq > ?', visible_params + [since])
+        # Broadcasts change when sent and when this employee reads one; the later change orders the row
+        audience, audience_params = broadcast_audience('employee', employee_id)
+        queries['broadcasts'] = (f'''
+            SELECT b.id, b.audience, b.audience_role, b.sender, b.sender_name, b.sender_id, b.sender_type,
+                   b.context, b.message, b.created_at, r.read_at, MAX(b.change_seq, COALESCE(r.change_seq, 0)) AS change_seq
+            FROM broadcasts b LEFT JOIN broadcast_receipts r
+                 ON r.recipient_type = 'employee' AND r.recipient_id = ? AND r.broadcast_id = b.id
+            WHERE {audience} AND (b.change_seq > ? OR r.change_seq > ?)
+        ''', [employee_id] + audience_params + [since, since])
+        
+        changes = {}
+        truncated_at = []
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('BEGIN')  # one snapshot for the token and every table
+            cursor.execute('SELECT seq FROM sync_sequence WHERE id = 1')
+            current = cursor.fetchone()[0]
+            for name, (query, params) in queries.items():
+                cursor.execute(query + ' ORDER BY change_seq LIMIT ?', params + [limit + 1])
+                rows = [dict(row) for row in cursor.fetchall()]
+                if len(rows) > limit:
+                    rows = rows[:limit]
+                    truncated_at.append(rows[-1]['change_seq'])
+                changes[name] = rows
+            conn.rollback()
+        
+        changes['timesheets'] = [timesheet_to_dict(row) for row in changes['timesheets']]
+        changes['activities'] = [activity_to_dict(row) for row in changes['activities']]
+        changes['messages'] = populate_sender_names([message_to_dict(row) for row in changes['messages']])
+        changes['broadcasts'] = [dict(broadcast_to_message(row, 'employee', employee_id), change_seq=row['change_seq'])
+                                 for row in changes['broadcasts']]
+        # When a table was cut short, resume from the earliest cut; clients upsert by id
+        token = min(truncated_at) if truncated_at else current
+        return jsonify({'token': str(token), 'has_more': bool(truncated_at), 'changes': changes})
+    except Exception as e:
+        logger.error(f"Employee sync error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/employee/managers', methods=['GET'])
 @employee_login_required
 def get_employee_managers():
@@ -1145,7 +3050,7 @@ def get_all_activities():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            activities = [dict(row) for row in cursor.fetchall()]
+            activities = [activity_to_dict(row) for row in cursor.fetchall()]
         return jsonify(activities)
     except Exception as e:
         logger.error(f"Get all activities error: {e}")
@@ -1162,16 +3067,25 @@ def get_all_notifications():
             JOIN employees e ON n.employee_id = e.id
         '''
         params = []
+        conditions = []
         if employee_id:
-            query += ' WHERE n.employee_id = ?'
+            conditions.append('n.employee_id = ?')
             params.append(employee_id)
-        query += ' ORDER BY n.created_at DESC'
+        if request.args.get('before'):
+            conditions.append('n.id < ?')
+            params.append(request.args.get('before', type=int))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY n.created_at DESC, n.id DESC'
+        if request.args.get('limit'):
+            query += ' LIMIT ?'
+            params.append(request.args.get('limit', type=int))
         
         with sqlite3.connect(DB_FILE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            notifications = [dict(row) for row in cursor.fetchall()]
+            notifications = [notification_to_dict(row) for row in cursor.fetchall()]
         return jsonify(notifications)
     except Exception as e:
         logger.error(f"Get all notifications error: {e}")
@@ -1183,13 +3097,108 @@ def mark_notification_read(notif_id):
     try:
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
-            cursor.execute('UPDATE notifications SET status = ? WHERE id = ?', ('read', notif_id))
+            cursor.execute('UPDATE notifications SET status = ? WHERE id = ?', (NOTIFICATION_STATUSES['read'], notif_id))
             conn.commit()
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Mark notification read error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/notifications/mark-read', methods=['POST'])
+@login_required
+def bulk_mark_notifications_read():
+    """Mark many notifications read in one UPDATE: by {"ids": [...]}, {"employee_id": n} and/or {"before": id}."""
+    try:
+        data = request.get_json() or {}
+        conditions, params = ['status = ?'], [NOTIFICATION_STATUSES['new']]
+        if 'ids' in data:
+            try:
+                ids = parse_id_list(data['ids'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('id IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(ids))
+        if data.get('employee_id') is not None:
+            conditions.append('employee_id = ?')
+            params.append(int(data['employee_id']))
+        if data.get('before') is not None:
+            conditions.append('id < ?')
+            params.append(int(data['before']))
+        if len(conditions) == 1:
+            return jsonify({'error': 'Provide ids, employee_id or before'}), 400
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"UPDATE notifications SET status = ? WHERE {' AND '.join(conditions)}",
+                           [NOTIFICATION_STATUSES['read']] + params)
+            marked = cursor.rowcount
+            if data.get('employee_id') is not None:
+                cursor.execute('SELECT COUNT(*) FROM notifications WHERE status = ? AND employee_id = ?',
+                               (NOTIFICATION_STATUSES['new'], int(data['employee_id'])))
+            else:
+                cursor.execute('SELECT COUNT(*) FROM notifications WHERE status = ?', (NOTIFICATION_STATUSES['new'],))
+            new_count = cursor.fetchone()[0]
+            conn.commit()
+        return jsonify({'success': True, 'marked': marked, 'new_count': new_count})
+    except (TypeError, ValueError):
+        return jsonify({'error': 'employee_id and before must be integers'}), 400
+    except Exception as e:
+        logger.error(f"Bulk mark notifications read error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ---------- Events Feed ----------
+@app.route('/api/admin/events', methods=['GET'])
+@login_required
+def get_events():
+    """Unified timeline, newest first. Filters: type (comma-separated), actor_type + actor_id, employee_id."""
+    try:
+        limit = max(1, min(request.args.get('limit', EVENT_PAGE_SIZE, type=int), EVENT_PAGE_SIZE))
+        conditions, params = [], []
+        if request.args.get('type'):
+            names = [name.strip() for name in request.args['type'].split(',') if name.strip()]
+            unknown = [name for name in names if name not in EVENT_TYPES]
+            if unknown:
+                return jsonify({'error': f"Unknown event type: {', '.join(unknown)}"}), 400
+            conditions.append(f"type IN ({','.join('?' for _ in names)})")
+            params.extend(EVENT_TYPES[name] for name in names)
+        if request.args.get('actor_type'):
+            conditions.append('actor_type = ?')
+            params.append(request.args['actor_type'])
+            if request.args.get('actor_id'):
+                conditions.append('actor_id = ?')
+                params.append(request.args.get('actor_id', type=int))
+        if request.args.get('employee_id'):
+            conditions.append('employee_id = ?')
+            params.append(request.args.get('employee_id', type=int))
+        if request.args.get('cursor'):
+            try:
+                created_at, event_id = decode_cursor(request.args['cursor'])
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            conditions.append('(created_at < ? OR (created_at = ? AND id < ?))')
+            params.extend([created_at, created_at, event_id])
+        
+        query = 'SELECT * FROM events'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1]['created_at'], rows[-1]['id']])
+        return jsonify({'events': [event_to_dict(row) for row in rows], 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Get events error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ---------- Messages API ----------
 @app.route('/api/messages', methods=['POST'])
 def create_message():
@@ -1216,43 +3225,122 @@ def create_message():
         if not employee_id and receiver_type == 'employee':
             employee_id = receiver_id
         
+        if sender_name in ['Admin', 'Manager', 'Employee', 'Unknown'] and sender_id:
+            profile = get_profile(sender_type, sender_id)
+            if profile:
+                sender_name = profile['name']
+        
         with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            
-            if sender_name in ['Admin', 'Manager', 'Employee', 'Unknown'] and sender_id:
-                if sender_type == 'employee':
-                    cursor.execute('SELECT employee_name FROM employees WHERE id = ?', (sender_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        sender_name = result['employee_name']
-                elif sender_type == 'manager':
-                    cursor.execute('SELECT employee_name FROM managers WHERE id = ?', (sender_id,))
-                    result = cursor.fetchone()
-                    if result:
-                        sender_name = result['employee_name']
-                elif sender_type == 'admin':
-                    sender_name = 'BrainHR Admin'
-            
             cursor.execute('''
                 INSERT INTO messages (sender, sender_name, sender_id, sender_type, employee_id, receiver_id, receiver_type, context, context_id, message, is_read)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (sender, sender_name, sender_id, sender_type, employee_id, receiver_id, receiver_type, data['context'], data.get('context_id'), data['message'], 0))
-            conn.commit()
+            ''', (MESSAGE_PARTY_TYPES.get(sender, sender), sender_name, sender_id, MESSAGE_PARTY_TYPES.get(sender_type, sender_type),
+                  employee_id, receiver_id, MESSAGE_PARTY_TYPES.get(receiver_type, receiver_type),
+                  MESSAGE_CONTEXTS.get(data['context'], data['context']), data.get('context_id'), data['message'], 0))
             message_id = cursor.lastrowid
+            record_conversation_message(cursor, message_id, {
+                'sender_type': sender_type, 'sender_id': sender_id, 'receiver_type': receiver_type,
+                'receiver_id': receiver_id, 'employee_id': employee_id, 'context': data['context'],
+                'message': data['message']
+            })
+            record_event(cursor, 'message_sent', sender_type, sender_id,
+                         employee_id if receiver_type == 'employee' else (sender_id if sender_type == 'employee' else None),
+                         message_id, data['context'])
+            conn.commit()
+        manager_overview_cache.clear()
         
         return jsonify({'success': True, 'message_id': message_id}), 201
     except Exception as e:
         logger.error(f"Create message error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/messages/mark-read/<int:msg_id>', methods=['POST'])
+@app.route('/api/messages/mark-read', methods=['POST'])
+def bulk_mark_messages_read():
+    """Mark the caller's received messages read in one transaction.
+
+    Body selects the messages by any combination of {"ids": [...]},
+    {"counterparty_type", "counterparty_id", "context"} (one conversation) and
+    {"before": id} (everything older than a message id). Returns the number
+    marked, the caller's remaining unread count and the affected conversations'
+    unread counts.
+    """
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        data = request.get_json() or {}
+        to_me, params = party_clause('receiver', user_type, user_id)
+        conditions = ['m.is_read = 0', to_me]
+        if 'ids' in data:
+            try:
+                ids = parse_id_list(data['ids'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            conditions.append('m.id IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(ids))
+        if data.get('counterparty_type'):
+            if data.get('counterparty_id') is None or not data.get('context'):
+                return jsonify({'error': 'counterparty_id and context are required with counterparty_type'}), 400
+            from_them, from_them_params = party_clause('sender', data['counterparty_type'], int(data['counterparty_id']))
+            conditions.extend([from_them, 'm.context = ?'])
+            params.extend(from_them_params + [MESSAGE_CONTEXTS.get(data['context'], data['context'])])
+        if data.get('before') is not None:
+            conditions.append('m.id < ?')
+            params.append(int(data['before']))
+        if len(conditions) == 2:
+            return jsonify({'error': 'Provide ids, a conversation or before'}), 400
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT m.id, m.sender_type, m.sender_id, m.receiver_type, m.receiver_id, m.employee_id, m.context
+                FROM messages m WHERE {' AND '.join(conditions)}
+            ''', params)
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+            conversations = []
+            if messages:
+                cursor.execute('UPDATE messages SET is_read = 1 WHERE id IN (SELECT value FROM json_each(?))',
+                               (json.dumps([message['id'] for message in messages]),))
+                release_conversation_unread(cursor, messages)
+                keys = {message_parties(message)[0] + (message['context'],) for message in messages}
+                for counterparty_type, counterparty_id, context in sorted(keys):
+                    cursor.execute('''
+                        SELECT counterparty_type, counterparty_id, context, unread_count FROM conversations
+                        WHERE owner_type = ? AND owner_id = ? AND counterparty_type = ? AND counterparty_id = ? AND context = ?
+                    ''', (user_type, user_id, counterparty_type, counterparty_id, context))
+                    conversations.extend(dict(row) for row in cursor.fetchall())
+            unread_count = count_unread_messages(cursor, user_type, user_id)
+            conn.commit()
+        manager_overview_cache.clear()
+        return jsonify({'success': True, 'marked': len(messages), 'unread_count': unread_count,
+                        'conversations': conversations})
+    except (TypeError, ValueError):
+        return jsonify({'error': 'counterparty_id and before must be integers'}), 400
+    except Exception as e:
+        logger.error(f"Bulk mark messages read error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/messages/mark-read/<int(signed=True):msg_id>', methods=['POST'])
 def mark_message_read(msg_id):
     try:
+        if msg_id < 0:
+            return mark_broadcast_read_route(-msg_id)
         with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute('UPDATE messages SET is_read = 1 WHERE id = ?', (msg_id,))
+            cursor.execute('''
+                SELECT id, sender_type, sender_id, receiver_type, receiver_id, employee_id, context
+                FROM messages WHERE id = ? AND is_read = 0
+            ''', (msg_id,))
+            message = cursor.fetchone()
+            if message:
+                cursor.execute('UPDATE messages SET is_read = 1 WHERE id = ?', (msg_id,))
+                release_conversation_unread(cursor, [message_to_dict(message)])
             conn.commit()
+        manager_overview_cache.clear()
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Mark read error: {e}")
@@ -1265,16 +3353,12 @@ def employee_get_messages():
         employee_id = session.get('employee_id')
         context = request.args.get('context')
         
-        query = '''SELECT * FROM messages 
-                   WHERE (employee_id = ? AND receiver_type = 'employee') 
-                   OR (sender_id = ? AND sender_type = 'employee')'''
-        params = [employee_id, employee_id]
+        visible, params = message_visibility('employee', employee_id, alias='messages')
+        query = f'SELECT * FROM messages WHERE {visible}'
         
         if context:
-            query = '''SELECT * FROM messages 
-                       WHERE context = ? AND ((employee_id = ? AND receiver_type = 'employee') 
-                       OR (sender_id = ? AND sender_type = 'employee'))'''
-            params = [context, employee_id, employee_id]
+            query += ' AND context = ?'
+            params.append(MESSAGE_CONTEXTS.get(context, context))
         
         query += ' ORDER BY created_at DESC'
         
@@ -1282,8 +3366,10 @@ def employee_get_messages():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+            messages.extend(get_user_broadcasts(cursor, 'employee', employee_id, context))
         
+        messages.sort(key=lambda message: message['created_at'] or '', reverse=True)
         messages = populate_sender_names(messages)
         return jsonify(messages)
     except Exception as e:
@@ -1297,16 +3383,12 @@ def manager_get_messages():
         manager_id = session.get('manager_id')
         context = request.args.get('context')
         
-        query = '''SELECT * FROM messages 
-                   WHERE (receiver_id = ? AND receiver_type = 'manager') 
-                   OR (sender_id = ? AND sender_type = 'manager')'''
-        params = [manager_id, manager_id]
+        visible, params = message_visibility('manager', manager_id, alias='messages')
+        query = f'SELECT * FROM messages WHERE {visible}'
         
         if context:
-            query = '''SELECT * FROM messages 
-                       WHERE context = ? AND ((receiver_id = ? AND receiver_type = 'manager') 
-                       OR (sender_id = ? AND sender_type = 'manager'))'''
-            params = [context, manager_id, manager_id]
+            query += ' AND context = ?'
+            params.append(MESSAGE_CONTEXTS.get(context, context))
         
         query += ' ORDER BY created_at DESC'
         
@@ -1314,8 +3396,10 @@ def manager_get_messages():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+            messages.extend(get_user_broadcasts(cursor, 'manager', manager_id, context))
         
+        messages.sort(key=lambda message: message['created_at'] or '', reverse=True)
         messages = populate_sender_names(messages)
         return jsonify(messages)
     except Exception as e:
@@ -1329,16 +3413,12 @@ def admin_get_messages():
         admin_id = session.get('admin_id')
         context = request.args.get('context')
         
-        query = '''SELECT * FROM messages 
-                   WHERE (receiver_id = ? AND receiver_type = 'admin') 
-                   OR (sender_id = ? AND sender_type = 'admin')'''
-        params = [admin_id, admin_id]
+        visible, params = message_visibility('admin', admin_id, alias='messages')
+        query = f'SELECT * FROM messages WHERE {visible}'
         
         if context:
-            query = '''SELECT * FROM messages 
-                       WHERE context = ? AND ((receiver_id = ? AND receiver_type = 'admin') 
-                       OR (sender_id = ? AND sender_type = 'admin'))'''
-            params = [context, admin_id, admin_id]
+            query += ' AND context = ?'
+            params.append(MESSAGE_CONTEXTS.get(context, context))
         
         query += ' ORDER BY created_at DESC'
         
@@ -1346,7 +3426,7 @@ def admin_get_messages():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
         
         messages = populate_sender_names(messages)
         return jsonify(messages)
@@ -1354,6 +3434,212 @@ def admin_get_messages():
         logger.error(f"Get admin messages error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/broadcasts', methods=['POST'])
+@admin_only_login_required
+def create_broadcast():
+    """Send one message to all employees, all managers or every employee with a role; stored as a single row."""
+    try:
+        data = request.get_json() or {}
+        audience = data.get('audience')
+        if audience not in BROADCAST_AUDIENCES:
+            return jsonify({'error': f"audience must be one of {', '.join(BROADCAST_AUDIENCES)}"}), 400
+        if audience == 'role' and not data.get('role'):
+            return jsonify({'error': 'role is required for a role broadcast'}), 400
+        if not data.get('message'):
+            return jsonify({'error': 'Missing required field: message'}), 400
+        
+        admin_id = session.get('admin_id')
+        profile = get_profile('admin', admin_id)
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO broadcasts (audience, audience_role, sender, sender_name, sender_id, sender_type, context, message)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (audience, data['role'] if audience == 'role' else None, 'admin', profile['name'] if profile else 'Admin',
+                  admin_id, 'admin', data.get('context') or 'general', data['message']))
+            conn.commit()
+            broadcast_id = cursor.lastrowid
+        return jsonify({'success': True, 'broadcast_id': broadcast_id})
+    except Exception as e:
+        logger.error(f"Create broadcast error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/broadcasts', methods=['GET'])
+@admin_only_login_required
+def get_broadcasts():
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT b.*, (SELECT COUNT(*) FROM broadcast_receipts r WHERE r.broadcast_id = b.id) AS read_count
+                FROM broadcasts b ORDER BY b.id DESC
+            ''')
+            broadcasts = [dict(row) for row in cursor.fetchall()]
+        return jsonify(broadcasts)
+    except Exception as e:
+        logger.error(f"Get broadcasts error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/broadcasts/<int:broadcast_id>/mark-read', methods=['POST'])
+def mark_broadcast_read_route(broadcast_id):
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            if not mark_broadcast_read(cursor, user_type, user_id, broadcast_id):
+                return jsonify({'error': 'Broadcast not found'}), 404
+            conn.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Mark broadcast read error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/conversations', methods=['GET'])
+def get_conversations():
+    """Inbox summary: one row per counterparty and context with the last message and unread count."""
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        limit = max(1, min(request.args.get('limit', CONVERSATION_PAGE_SIZE, type=int), CONVERSATION_PAGE_SIZE))
+        query = '''
+            SELECT counterparty_type, counterparty_id, context, last_message_id, last_message,
+                   last_sender_type, last_at, unread_count
+            FROM conversations WHERE owner_type = ? AND owner_id = ?
+        '''
+        params = [user_type, user_id]
+        if request.args.get('cursor'):
+            try:
+                last_at, last_message_id = decode_cursor(request.args['cursor'])
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query += ' AND (last_at < ? OR (last_at = ? AND last_message_id < ?))'
+            params.extend([last_at, last_at, last_message_id])
+        query += ' ORDER BY last_at DESC, last_message_id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            conversations = [dict(row) for row in cursor.fetchall()]
+        
+        next_cursor = None
+        if len(conversations) > limit:
+            conversations = conversations[:limit]
+            next_cursor = encode_cursor([conversations[-1]['last_at'], conversations[-1]['last_message_id']])
+        for conversation in conversations:
+            profile = get_profile(conversation['counterparty_type'], conversation['counterparty_id'])
+            conversation['counterparty_name'] = profile['name'] if profile else None
+        return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
+    except Exception as e:
+        logger.error(f"Get conversations error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/conversations/messages', methods=['GET'])
+def get_conversation_messages():
+    """One conversation's messages, newest first, paginated with ?before=<message id>."""
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        counterparty_type = request.args.get('counterparty_type')
+        counterparty_id = request.args.get('counterparty_id', type=int)
+        context = request.args.get('context')
+        if not counterparty_type or counterparty_id is None or not context:
+            return jsonify({'error': 'counterparty_type, counterparty_id and context are required'}), 400
+        limit = max(1, min(request.args.get('limit', CONVERSATION_PAGE_SIZE, type=int), CONVERSATION_PAGE_SIZE))
+        
+        sent, sent_params = party_clause('sender', user_type, user_id)
+        to_them, to_them_params = party_clause('receiver', counterparty_type, counterparty_id)
+        from_them, from_them_params = party_clause('sender', counterparty_type, counterparty_id)
+        to_me, to_me_params = party_clause('receiver', user_type, user_id)
+        query = f'''
+            SELECT * FROM messages m
+            WHERE m.context = ? AND (({sent} AND {to_them}) OR ({from_them} AND {to_me}))
+        '''
+        params = [MESSAGE_CONTEXTS.get(context, context)] + sent_params + to_them_params + from_them_params + to_me_params
+        before = request.args.get('before', type=int)
+        if before:
+            query += ' AND m.id < ?'
+            params.append(before)
+        query += ' ORDER BY m.id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+        
+        next_before = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_before = messages[-1]['id']
+        return jsonify({'messages': populate_sender_names(messages), 'next_before': next_before})
+    except Exception as e:
+        logger.error(f"Get conversation messages error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/messages/search', methods=['GET'])
+def search_messages():
+    """Ranked full-text search over the caller's visible messages with snippets and cursor pagination."""
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        match = fts_match_query(request.args.get('q', ''), user_type, int(user_id))
+        if not match:
+            return jsonify({'error': 'q is required'}), 400
+        limit = max(1, min(request.args.get('limit', MESSAGE_SEARCH_PAGE_SIZE, type=int), MESSAGE_SEARCH_MAX_PAGE_SIZE))
+        context = request.args.get('context')
+        
+        rank = 'bm25(messages_fts, 1.0, 0.5, 0.0)'
+        visibility, params = message_visibility(user_type, user_id)
+        query = f'''
+            SELECT m.*, {rank} AS score,
+                   snippet(messages_fts, 0, '<mark>', '</mark>', '…', 12) AS snippet
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND {visibility}
+        '''
+        params = [match] + params
+        if context:
+            query += ' AND m.context = ?'
+            params.append(MESSAGE_CONTEXTS.get(context, context))
+        if request.args.get('cursor'):
+            try:
+                after_score, after_id = decode_cursor(request.args['cursor'])
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query += f' AND ({rank} > ? OR ({rank} = ? AND m.id > ?))'
+            params.extend([after_score, after_score, after_id])
+        query += f' ORDER BY {rank}, m.id LIMIT ?'
+        params.append(limit + 1)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            results = [message_to_dict(row) for row in cursor.fetchall()]
+        
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor([results[-1]['score'], results[-1]['id']])
+        results = populate_sender_names(results)
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+    except sqlite3.OperationalError as e:
+        if 'messages_fts' in str(e):
+            return jsonify({'error': 'Message search is not available on this server'}), 503
+        logger.error(f"Search messages error: {e}")
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Search messages error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/unread-count', methods=['GET'])
 def get_unread_count():
     try:
@@ -1367,17 +3653,11 @@ def get_unread_count():
             cursor = conn.cursor()
             
             if employee_id:
-                cursor.execute('''SELECT COUNT(*) FROM messages 
-                               WHERE is_read = 0 AND employee_id = ? AND receiver_type = 'employee' ''', (employee_id,))
-                unread_count = cursor.fetchone()[0]
+                unread_count = count_unread_messages(cursor, 'employee', employee_id)
             elif manager_id:
-                cursor.execute('''SELECT COUNT(*) FROM messages 
-                               WHERE is_read = 0 AND receiver_id = ? AND receiver_type = 'manager' ''', (manager_id,))
-                unread_count = cursor.fetchone()[0]
+                unread_count = count_unread_messages(cursor, 'manager', manager_id)
             elif admin_id:
-                cursor.execute('''SELECT COUNT(*) FROM messages 
-                               WHERE is_read = 0 AND receiver_id = ? AND receiver_type = 'admin' ''', (admin_id,))
-                unread_count = cursor.fetchone()[0]
+                unread_count = count_unread_messages(cursor, 'admin', admin_id)
         
         return jsonify({'unread_count': unread_count})
     except Exception as e:
@@ -1392,6 +3672,7 @@ def get_messages():
         context = request.args.get('context')
         context_id = request.args.get('context_id')
         
+        context = MESSAGE_CONTEXTS.get(context, context)
         query = 'SELECT * FROM messages WHERE context = ? AND (employee_id = ? OR context_id = ?)'
         params = [context, employee_id, employee_id]
         
@@ -1405,7 +3686,7 @@ def get_messages():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
         
         messages = populate_sender_names(messages)
         return jsonify(messages)
@@ -1417,6 +3698,8 @@ def get_messages():
 @login_required
 def manager_get_employee_messages(emp_id):
     try:
+        if 'admin_logged_in' not in session and not is_team_member(session.get('manager_id'), emp_id):
+            return jsonify({'error': 'Employee is not in your team'}), 403
         context = request.args.get('context')
         
         query = 'SELECT * FROM messages WHERE employee_id = ?'
@@ -1424,7 +3707,7 @@ def manager_get_employee_messages(emp_id):
         
         if context:
             query = 'SELECT * FROM messages WHERE employee_id = ? AND context = ?'
-            params = [emp_id, context]
+            params = [emp_id, MESSAGE_CONTEXTS.get(context, context)]
         
         query += ' ORDER BY created_at DESC'
         
@@ -1432,14 +3715,235 @@ def manager_get_employee_messages(emp_id):
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(query, params)
-            messages = [dict(row) for row in cursor.fetchall()]
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+            messages.extend(get_user_broadcasts(cursor, 'employee', emp_id, context))
         
+        messages.sort(key=lambda message: message['created_at'] or '', reverse=True)
         messages = populate_sender_names(messages)
         return jsonify(messages)
     except Exception as e:
         logger.error(f"Get employee messages error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ---------- Manager Teams ----------
+def is_team_member(manager_id, employee_id):
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM manager_team WHERE manager_id = ? AND employee_id = ?', (manager_id, employee_id))
+        return cursor.fetchone() is not None
+
+def fetch_team_rows(query, params, manager_id, alias, order_by, row_to_dict=dict):
+    """Run a listing query restricted to a manager's team through manager_team (optionally ?employee_id=)."""
+    query += f' JOIN manager_team mt ON mt.employee_id = {alias}.employee_id AND mt.manager_id = ?'
+    params = list(params) + [manager_id]
+    if request.args.get('employee_id'):
+        query += f' WHERE {alias}.employee_id = ?'
+        params.append(request.args.get('employee_id', type=int))
+    query += f' ORDER BY {order_by}'
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        return [row_to_dict(row) for row in cursor.fetchall()]
+
+def team_members(manager_id):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.id, e.username, e.employee_name, e.email, e.employee_id_field, e.role
+            FROM manager_team mt JOIN employees e ON e.id = mt.employee_id
+            WHERE mt.manager_id = ? ORDER BY e.employee_name
+        ''', (manager_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+@app.route('/api/admin/managers/<int:manager_id>/team', methods=['GET'])
+@admin_only_login_required
+def get_manager_team(manager_id):
+    try:
+        return jsonify(team_members(manager_id))
+    except Exception as e:
+        logger.error(f"Get manager team error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/managers/<int:manager_id>/team', methods=['PUT', 'POST'])
+@admin_only_login_required
+def set_manager_team(manager_id):
+    """PUT replaces the manager's team with {"employee_ids": [...]}; POST adds to it."""
+    try:
+        data = request.get_json() or {}
+        employee_ids = data.get('employee_ids')
+        if not isinstance(employee_ids, list):
+            return jsonify({'error': 'employee_ids must be a list'}), 400
+        try:
+            employee_ids = sorted({int(emp_id) for emp_id in employee_ids})
+        except (TypeError, ValueError):
+            return jsonify({'error': 'employee_ids must be integers'}), 400
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM managers WHERE id = ?', (manager_id,))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Manager not found'}), 404
+            cursor.execute('SELECT id FROM employees WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(employee_ids),))
+            known = {row[0] for row in cursor.fetchall()}
+            unknown = [emp_id for emp_id in employee_ids if emp_id not in known]
+            if unknown:
+                return jsonify({'error': f"Unknown employee ids: {unknown}"}), 400
+            if request.method == 'PUT':
+                cursor.execute('DELETE FROM manager_team WHERE manager_id = ?', (manager_id,))
+            cursor.executemany('INSERT OR IGNORE INTO manager_team (manager_id, employee_id) VALUES (?, ?)',
+                               [(manager_id, emp_id) for emp_id in employee_ids])
+            conn.commit()
+        manager_overview_cache.pop(manager_id)
+        return jsonify({'success': True, 'manager_id': manager_id, 'employee_ids': employee_ids})
+    except Exception as e:
+        logger.error(f"Set manager team error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/managers/<int:manager_id>/team/<int:employee_id>', methods=['DELETE'])
+@admin_only_login_required
+def remove_team_member(manager_id, employee_id):
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM manager_team WHERE manager_id = ? AND employee_id = ?', (manager_id, employee_id))
+            conn.commit()
+        manager_overview_cache.pop(manager_id)
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Remove team member error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/team', methods=['GET'])
+@manager_login_required
+def manager_get_team():
+    try:
+        return jsonify(team_members(session.get('manager_id')))
+    except Exception as e:
+        logger.error(f"Get team error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/team/timesheets', methods=['GET'])
+@manager_login_required
+def manager_get_team_timesheets():
+    try:
+        return jsonify(fetch_team_rows('''
+            SELECT ts.*, e.employee_name, e.username FROM timesheets ts
+            JOIN employees e ON ts.employee_id = e.id
+        ''', [], session.get('manager_id'), 'ts', 'ts.year DESC, ts.month DESC, ts.week DESC', timesheet_to_dict))
+    except Exception as e:
+        logger.error(f"Get team timesheets error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/team/visa-docs', methods=['GET'])
+@manager_login_required
+def manager_get_team_visa_docs():
+    try:
+        return jsonify(fetch_team_rows('''
+            SELECT vd.*, e.employee_name, e.username FROM visa_docs vd
+            JOIN employees e ON vd.employee_id = e.id
+        ''', [], session.get('manager_id'), 'vd', 'vd.created_at DESC'))
+    except Exception as e:
+        logger.error(f"Get team visa docs error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/team/activities', methods=['GET'])
+@manager_login_required
+def manager_get_team_activities():
+    try:
+        return jsonify(fetch_team_rows('''
+            SELECT a.*, e.employee_name, e.username FROM activities a
+            JOIN employees e ON a.employee_id = e.id
+        ''', [], session.get('manager_id'), 'a', 'a.created_at DESC', activity_to_dict))
+    except Exception as e:
+        logger.error(f"Get team activities error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/team/messages', methods=['GET'])
+@manager_login_required
+def manager_get_team_messages():
+    """Messages addressed to team members (employee inboxes), newest first."""
+    try:
+        messages = fetch_team_rows('''
+            SELECT m.*, e.employee_name FROM messages m
+            JOIN employees e ON m.employee_id = e.id
+        ''', [], session.get('manager_id'), 'm', 'm.id DESC', message_to_dict)
+        return jsonify(populate_sender_names(messages))
+    except Exception as e:
+        logger.error(f"Get team messages error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manager/overview', methods=['GET'])
+@manager_login_required
+def manager_overview():
+    """Per-report pending work for the manager landing page, built in one query and cached briefly."""
+    try:
+        manager_id = session.get('manager_id')
+        overview = manager_overview_cache.get(manager_id)
+        if overview is not None:
+            return jsonify(overview)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                WITH team AS (SELECT employee_id FROM manager_team WHERE manager_id = ?),
+                ts AS (
+                    SELECT employee_id, SUM(status = {TIMESHEET_STATUSES['submitted']}) AS pending,
+                           SUM(status IN ({TIMESHEET_STATUSES['draft']}, {TIMESHEET_STATUSES['rejected']})) AS open
+                    FROM timesheets WHERE employee_id IN team GROUP BY employee_id
+                ),
+                vd AS (SELECT employee_id, MAX(id) AS id FROM visa_docs WHERE employee_id IN team GROUP BY employee_id),
+                ac AS (SELECT employee_id, MAX(id) AS id FROM activities WHERE employee_id IN team GROUP BY employee_id),
+                cv AS (
+                    SELECT counterparty_id AS employee_id, SUM(unread_count) AS unread FROM conversations
+                    WHERE owner_type = 'manager' AND owner_id = ? AND counterparty_type = 'employee'
+                    GROUP BY counterparty_id
+                )
+                SELECT e.id, e.employee_name, e.username, e.employee_id_field,
+                       COALESCE(ts.pending, 0) AS pending_timesheets, COALESCE(ts.open, 0) AS open_timesheets,
+                       v.id AS visa_doc_id, v.doc_name AS visa_doc_name, v.visa_type, v.created_at AS visa_doc_at,
+                       a.id AS activity_id, a.activity_name, a.created_at AS activity_at,
+                       COALESCE(cv.unread, 0) AS unread_messages
+                FROM team JOIN employees e ON e.id = team.employee_id
+                LEFT JOIN ts ON ts.employee_id = e.id
+                LEFT JOIN vd ON vd.employee_id = e.id LEFT JOIN visa_docs v ON v.id = vd.id
+                LEFT JOIN ac ON ac.employee_id = e.id LEFT JOIN activities a ON a.id = ac.id
+                LEFT JOIN cv ON cv.employee_id = e.id
+                ORDER BY e.employee_name
+            ''', (manager_id, manager_id))
+            rows = cursor.fetchall()
+        
+        employees = []
+        for row in rows:
+            employees.append({
+                'id': row['id'], 'employee_name': row['employee_name'], 'username': row['username'],
+                'employee_id_field': row['employee_id_field'],
+                'pending_timesheets': row['pending_timesheets'], 'open_timesheets': row['open_timesheets'],
+                'latest_visa_doc': {
+                    'id': row['visa_doc_id'], 'doc_name': row['visa_doc_name'],
+                    'visa_type': row['visa_type'], 'created_at': row['visa_doc_at']
+                } if row['visa_doc_id'] else None,
+                'last_activity': {
+                    'id': row['activity_id'], 'activity_name': row['activity_name'],
+                    'created_at': format_epoch(row['activity_at'])
+                } if row['activity_id'] else None,
+                'unread_messages': row['unread_messages']
+            })
+        overview = {
+            'employees': employees,
+            'totals': {
+                'pending_timesheets': sum(emp['pending_timesheets'] for emp in employees),
+                'unread_messages': sum(emp['unread_messages'] for emp in employees)
+            }
+        }
+        manager_overview_cache.set(manager_id, overview)
+        return jsonify(overview)
+    except Exception as e:
+        logger.error(f"Manager overview error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # ---------- Public Jobs ----------
 @app.route('/api/jobs', methods=['GET'])
 def get_jobs():
@@ -1483,7 +3987,20 @@ def apply_job():
                 form_data.get('relocation'), form_data.get('experience_years'),
                 form_data.get('job_id'), form_data.get('job_title'), filename
             ))
+            application_id = cursor.lastrowid
+            record_event(cursor, 'application_submitted', 'applicant', None, related_id=application_id,
+                         summary=f"{form_data.get('name')} applied for {form_data.get('job_title')}")
+            # queued_at stays NULL when there is no background pool, so the CLI claims it at once
+            cursor.execute('''
+                INSERT INTO resume_texts (application_id, queued_at)
+                VALUES (?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+            ''', (application_id, RESUME_EXTRACT_WORKERS > 0))
+            signature = minhash_signature(identity_shingles(
+                form_data.get('name'), form_data.get('email'), form_data.get('contact_no')))
+            if index_applicant(cursor, application_id, 'identity', signature, form_data.get('email')):
+                logger.info(f"Application {application_id} looks like a duplicate of an earlier application")
             conn.commit()
+        queue_resume_extraction(application_id, resume_path)
         
         # Send email notification
         send_application_email(form_data, resume_path)
@@ -1542,8 +4059,11 @@ def create_job():
             'INSERT INTO jobs (title, location, description, visa_constraints, assessment_url, job_category) VALUES (?, ?, ?, ?, ?, ?)',
             (data['title'], data['location'], data['description'], data.get('visa_constraints', ''), data.get('assessment_url', ''), data.get('job_category', ''))
         )
-        conn.commit()
         job_id = cursor.lastrowid
+        if sparse is not None:
+            store_match_vector(cursor, 'job', job_id, f"{data['title']} {data['description']}")
+        refresh_job_courses(cursor, [job_id])
+        conn.commit()
     return jsonify({'success': True, 'job_id': job_id}), 201
 
 @app.route('/api/admin/jobs/<int:job_id>', methods=['DELETE'])
@@ -1574,6 +4094,7 @@ def delete_jobs_bulk():
 def delete_application(app_id):
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
+        forget_applications(cursor, [app_id])
         cursor.execute('DELETE FROM applications WHERE id = ?', (app_id,))
         conn.commit()
     return jsonify({'success': True, 'message': 'Application deleted.'})
@@ -1588,28 +4109,117 @@ def delete_applications_bulk():
     
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
+        forget_applications(cursor, app_ids)
         cursor.execute(f"DELETE FROM applications WHERE id IN ({','.join('?' for _ in app_ids)})", app_ids)
         conn.commit()
     return jsonify({'success': True, 'message': f'{len(app_ids)} applications deleted.'})
 
 # ---------- Admin Applications ----------
+def application_filters(args):
+    """Map query args to {filter name: (SQL condition, params)}; raises ValueError on bad input."""
+    filters = {}
+    def values(name):
+        return [value.strip() for value in args.get(name, '').split(',') if value.strip()]
+    job_ids = [value for value in values('job_id') if value != 'all']
+    if job_ids:
+        filters['job'] = (f"job_id IN ({','.join('?' for _ in job_ids)})", [int(value) for value in job_ids])
+    for field in ('visa_status', 'location', 'relocation'):
+        selected = values(field)
+        if selected:
+            filters[field] = (f"{field} IN ({','.join('?' for _ in selected)})", selected)
+    if args.get('min_experience'):
+        filters['min_experience'] = ('experience_years >= ?', [float(args['min_experience'])])
+    if args.get('max_experience'):
+        filters['max_experience'] = ('experience_years <= ?', [float(args['max_experience'])])
+    if args.get('viewed') in ('0', '1'):
+        filters['viewed'] = ('viewed = ?', [int(args['viewed'])])
+    if args.get('applied_after'):
+        filters['applied_after'] = ('applied_at >= ?', [args['applied_after']])
+    if args.get('applied_before'):
+        filters['applied_before'] = ('applied_at < ?', [args['applied_before']])
+    if args.get('duplicate_group'):
+        filters['duplicate_group'] = ('duplicate_group = ?', [int(args['duplicate_group'])])
+    elif args.get('duplicates') in ('0', '1'):
+        filters['duplicates'] = (f"duplicate_group IS {'NOT ' if args['duplicates'] == '1' else ''}NULL", [])
+    if args.get('q'):
+        pattern = f"%{args['q'].strip()}%"
+        filters['q'] = ('(name LIKE ? OR email LIKE ? OR job_title LIKE ?)', [pattern, pattern, pattern])
+    return filters
+
+def where_clause(filters, exclude=None):
+    conditions = [condition for name, (condition, _) in filters.items() if name != exclude]
+    params = [param for name, (_, values) in filters.items() if name != exclude for param in values]
+    return (' WHERE ' + ' AND '.join(conditions) if conditions else ''), params
+
+def application_order_by(sort):
+    """'-applied_at,name' -> 'applied_at DESC, name ASC, id DESC'; raises ValueError on unknown fields.
+
+    match_score and duplicate_group sort missing values last in either direction.
+    """
+    terms = []
+    for term in (sort or '-applied_at').split(','):
+        term = term.strip()
+        field = term.lstrip('-+')
+        if field not in APPLICATION_SORT_FIELDS:
+            raise ValueError(f"Cannot sort by {field!r}")
+        if field in ('match_score', 'duplicate_group'):
+            terms.append(f'{field} IS NULL')
+        terms.append(f"{field} {'DESC' if term.startswith('-') else 'ASC'}")
+    if not any(term.startswith('id ') for term in terms):
+        terms.append('id DESC')
+    return ', '.join(terms)
+
 @app.route('/api/admin/applications', methods=['GET'])
 @login_required
 def get_applications():
-    job_id_filter = request.args.get('job_id')
-    query = 'SELECT * FROM applications'
-    params = []
-    if job_id_filter and job_id_filter != 'all':
-        query += ' WHERE job_id = ?'
-        params.append(job_id_filter)
-    query += ' ORDER BY applied_at DESC'
+    """Applications with filters and ?sort=. Passing page or limit returns a page with total and facets."""
+    try:
+        filters = application_filters(request.args)
+        order_by = application_order_by(request.args.get('sort'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    paginated = 'page' in request.args or 'limit' in request.args
+    where, params = where_clause(filters)
+    query = f'''
+        SELECT applications.*, (SELECT score FROM match_scores ms
+                                WHERE ms.job_id = applications.job_id AND ms.application_id = applications.id) AS match_score
+        FROM applications{where} ORDER BY {order_by}
+    '''
 
     with sqlite3.connect(DB_FILE) as conn:
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
-        cursor.execute(query, params)
+        # Scores are computed per job in one pass, so every listed applicant of a job shares one scale
+        if refresh_match_scores(cursor, where, params):
+            conn.commit()
+        if not paginated:
+            cursor.execute(query, params)
+            return jsonify([dict(row) for row in cursor.fetchall()])
+
+        limit = max(1, min(request.args.get('limit', APPLICATION_PAGE_SIZE, type=int), APPLICATION_MAX_PAGE_SIZE))
+        page = max(1, request.args.get('page', 1, type=int))
+        cursor.execute(query + ' LIMIT ? OFFSET ?', params + [limit, (page - 1) * limit])
         applications = [dict(row) for row in cursor.fetchall()]
-    return jsonify(applications)
+        cursor.execute(f'SELECT COUNT(*) FROM applications{where}', params)
+        total = cursor.fetchone()[0]
+
+        # Each facet counts under every filter except its own, so the UI can offer alternatives
+        facets = {}
+        for facet, column in APPLICATION_FACETS.items():
+            facet_where, facet_params = where_clause(filters, exclude=facet)
+            cursor.execute(f'''
+                SELECT {column} AS value, COUNT(*) AS count FROM applications{facet_where}
+                GROUP BY {column} ORDER BY count DESC, value
+            ''', facet_params)
+            facets[facet] = [dict(row) for row in cursor.fetchall()]
+
+    return jsonify({
+        'applications': applications,
+        'total': total,
+        'page': page,
+        'limit': limit,
+        'facets': facets
+    })
 
 @app.route('/api/admin/applications/<int:app_id>/view', methods=['POST'])
 @login_required
@@ -1620,6 +4230,439 @@ def mark_application_viewed(app_id):
         conn.commit()
     return jsonify({'success': True})
 
+@app.route('/api/admin/applications/search', methods=['GET'])
+@login_required
+def search_applications():
+    """Ranked full-text search over extracted resume text, combined with the application filters."""
+    try:
+        phrases = fts_phrases(request.args.get('q', ''))
+        if not phrases:
+            return jsonify({'error': 'q is required'}), 400
+        try:
+            filters = application_filters({key: value for key, value in request.args.items() if key != 'q'})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        limit = max(1, min(request.args.get('limit', RESUME_SEARCH_PAGE_SIZE, type=int), APPLICATION_PAGE_SIZE))
+        
+        rank = 'bm25(resumes_fts)'
+        where, params = where_clause(filters)
+        query = f'''
+            SELECT a.*, {rank} AS score, snippet(resumes_fts, 0, '<mark>', '</mark>', '…', 16) AS snippet
+            FROM resumes_fts JOIN applications a ON a.id = resumes_fts.rowid
+            WHERE resumes_fts MATCH ?{where.replace(' WHERE ', ' AND ', 1)}
+        '''
+        params = [phrases] + params
+        if request.args.get('cursor'):
+            try:
+                after_score, after_id = decode_cursor(request.args['cursor'])
+            except (ValueError, TypeError):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query += f' AND ({rank} > ? OR ({rank} = ? AND a.id > ?))'
+            params.extend([after_score, after_score, after_id])
+        query += f' ORDER BY {rank}, a.id LIMIT ?'
+        params.append(limit + 1)
+        
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            results = [dict(row) for row in cursor.fetchall()]
+        
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor([results[-1]['score'], results[-1]['id']])
+        return jsonify({'results': results, 'next_cursor': next_cursor})
+    except sqlite3.OperationalError as e:
+        if 'resumes_fts' in str(e):
+            return jsonify({'error': 'Resume search is not available on this server'}), 503
+        logger.error(f"Search applications error: {e}")
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        logger.error(f"Search applications error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('extract-resumes')
+@click.option('--retry-failed', is_flag=True, help='Also retry resumes whose extraction failed.')
+def extract_resumes_command(retry_failed):
+    """Extract and index text for resumes that have not been processed yet.
+
+    Also queues again the 'pending' resumes whose background job was lost, so run
+    it periodically (e.g. from cron) alongside the web workers.
+    """
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO resume_texts (application_id)
+            SELECT id FROM applications WHERE resume_filename IS NOT NULL
+        ''')
+        conn.commit()
+    pending = claim_resume_extractions(retry_failed)
+    paths = [os.path.join(app.config['UPLOAD_FOLDER'], upload_basename(name)) for _, name in pending]
+    with ProcessPoolExecutor(max_workers=max(1, RESUME_EXTRACT_WORKERS), mp_context=POOL_MP_CONTEXT) as pool:
+        futures = [pool.submit(extract_resume_text, path) for path in paths]
+    for (application_id, _), future in zip(pending, futures):
+        store_resume_text(application_id, future)
+    failed = sum(1 for future in futures if future.exception())
+    click.echo(f"Extracted {len(pending) - failed} resumes, {failed} failed.")
+
+# ---------- Match Scoring ----------
+def match_term_counts(text):
+    """Hashed term counts of a document as (sorted int32 feature indices, float32 counts)."""
+    counts = Counter()
+    for token in re.findall(r'[a-z0-9+#]+(?:\.[a-z0-9]+)*', (text or '').lower()):
+        if len(token) > 1 and token not in MATCH_STOPWORDS:
+            counts[zlib.crc32(token.encode()) % MATCH_FEATURES] += 1
+    indices = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+    return indices, np.array([counts[index] for index in indices.tolist()], dtype=np.float32)
+
+def store_match_vector(cursor, kind, ref_id, text):
+    """Save a job/resume vector and keep the document frequencies in step (replacing any previous vector)."""
+    indices, counts = match_term_counts(text)
+    cursor.execute('SELECT indices FROM match_vectors WHERE kind = ? AND ref_id = ?', (kind, ref_id))
+    previous = cursor.fetchone()
+    if previous:
+        cursor.executemany('UPDATE match_df SET df = df - 1 WHERE feature = ?',
+                           [(int(index),) for index in np.frombuffer(previous[0], dtype=np.int32)])
+    cursor.executemany('''
+        INSERT INTO match_df (feature, df) VALUES (?, 1) ON CONFLICT (feature) DO UPDATE SET df = df + 1
+    ''', [(int(index),) for index in indices])
+    cursor.execute('INSERT OR REPLACE INTO match_vectors (kind, ref_id, indices, counts) VALUES (?, ?, ?, ?)',
+                   (kind, ref_id, indices.tobytes(), counts.tobytes()))
+
+_match_idf = {'vector': None, 'generation': None}
+_match_idf_lock = threading.Lock()
+
+def match_generation(cursor):
+    cursor.execute('SELECT generation FROM match_generation WHERE id = 1')
+    return cursor.fetchone()[0]
+
+def match_idf(cursor, generation):
+    """Dense smoothed IDF over all stored vectors, reloaded when the vector generation changes.
+
+    The lock covers check, load and swap, so concurrent requests share one reload.
+    """
+    with _match_idf_lock:
+        if _match_idf['vector'] is None or _match_idf['generation'] != generation:
+            cursor.execute('SELECT COUNT(*) FROM match_vectors')
+            total = cursor.fetchone()[0]
+            df = np.zeros(MATCH_FEATURES, dtype=np.float32)
+            cursor.execute('SELECT feature, df FROM match_df WHERE df > 0')
+            rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+            df[rows[:, 0]] = rows[:, 1]
+            _match_idf.update(vector=np.log((1 + total) / (1 + df)) + 1, generation=generation)
+        return _match_idf['vector']
+
+def score_job_applications(cursor, job_id):
+    """Cosine similarity of TF-IDF vectors between a job and all its applications' resumes, in one sparse pass.
+
+    Every application of the job is scored against the same IDF, so scores within a job
+    are comparable. Scores are written to match_scores with the current vector generation.
+    Returns the number of applications scored.
+    """
+    cursor.execute("SELECT indices, counts FROM match_vectors WHERE kind = 'job' AND ref_id = ?", (job_id,))
+    job = cursor.fetchone()
+    if not job:
+        return 0
+    cursor.execute('''
+        SELECT v.ref_id, v.indices, v.counts FROM applications a
+        JOIN match_vectors v ON v.kind = 'resume' AND v.ref_id = a.id
+        WHERE a.job_id = ?
+    ''', (job_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return 0
+
+    generation = match_generation(cursor)
+    idf = match_idf(cursor, generation)
+    job_vector = np.zeros(MATCH_FEATURES, dtype=np.float32)
+    job_indices = np.frombuffer(job[0], dtype=np.int32)
+    job_vector[job_indices] = (1 + np.log(np.frombuffer(job[1], dtype=np.float32))) * idf[job_indices]
+    job_norm = np.linalg.norm(job_vector)
+
+    indices = [np.frombuffer(row[1], dtype=np.int32) for row in rows]
+    counts = [np.frombuffer(row[2], dtype=np.float32) for row in rows]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(part) for part in indices], out=indptr[1:])
+    columns = np.concatenate(indices)
+    weights = (1 + np.log(np.concatenate(counts))) * idf[columns]
+    matrix = sparse.csr_matrix((weights, columns, indptr), shape=(len(rows), MATCH_FEATURES))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    scores = (matrix @ job_vector) / np.maximum(norms * job_norm, 1e-12)
+
+    cursor.executemany('''
+        INSERT OR REPLACE INTO match_scores (job_id, application_id, score, generation) VALUES (?, ?, ?, ?)
+    ''', [(job_id, row[0], round(float(score), 6), generation) for row, score in zip(rows, scores)])
+    return len(rows)
+
+def refresh_match_scores(cursor, where='', params=()):
+    """Rescore the jobs of the matching applications (`where` on `applications`) whose scores
+    are missing or predate the current vector generation; returns the number of jobs rescored.
+    """
+    if sparse is None:
+        return 0
+    cursor.execute(f'''
+        SELECT DISTINCT a.job_id FROM applications a
+        JOIN match_vectors v ON v.kind = 'resume' AND v.ref_id = a.id
+        LEFT JOIN match_scores ms ON ms.job_id = a.job_id AND ms.application_id = a.id
+        WHERE a.id IN (SELECT applications.id FROM applications{where})
+          AND (ms.generation IS NULL OR ms.generation < (SELECT generation FROM match_generation WHERE id = 1))
+    ''', list(params))
+    job_ids = [row[0] for row in cursor.fetchall() if row[0] is not None]
+    for job_id in job_ids:
+        score_job_applications(cursor, job_id)
+    return len(job_ids)
+
+def rebuild_match_vectors(cursor):
+    """Vectorize jobs and extracted resumes that have no vector yet; returns how many were added."""
+    cursor.execute('''
+        SELECT id, title || ' ' || description FROM jobs
+        WHERE id NOT IN (SELECT ref_id FROM match_vectors WHERE kind = 'job')
+    ''')
+    jobs = cursor.fetchall()
+    cursor.execute('''
+        SELECT application_id, content FROM resume_texts
+        WHERE status = 'done' AND application_id NOT IN (SELECT ref_id FROM match_vectors WHERE kind = 'resume')
+    ''')
+    resumes = cursor.fetchall()
+    for job_id, text in jobs:
+        store_match_vector(cursor, 'job', job_id, text)
+    for application_id, text in resumes:
+        store_match_vector(cursor, 'resume', application_id, text)
+    return len(jobs) + len(resumes)
+
+def forget_applications(cursor, application_ids):
+    """Drop derived resume text, vectors, scores and duplicate index entries; call before deleting the rows."""
+    params = [(int(application_id),) for application_id in application_ids]
+    forget_applicants(cursor, [application_id for (application_id,) in params])
+    cursor.executemany('DELETE FROM resume_texts WHERE application_id = ?', params)
+    cursor.executemany('DELETE FROM match_scores WHERE application_id = ?', params)
+    for (application_id,) in params:
+        cursor.execute("SELECT indices FROM match_vectors WHERE kind = 'resume' AND ref_id = ?", (application_id,))
+        row = cursor.fetchone()
+        if row:
+            cursor.executemany('UPDATE match_df SET df = df - 1 WHERE feature = ?',
+                               [(int(index),) for index in np.frombuffer(row[0], dtype=np.int32)])
+    cursor.executemany("DELETE FROM match_vectors WHERE kind = 'resume' AND ref_id = ?", params)
+
+@app.route('/api/admin/jobs/<int:job_id>/rescore', methods=['POST'])
+@login_required
+def rescore_job(job_id):
+    """Recompute every application's match score for a job with the current IDF."""
+    if sparse is None:
+        return jsonify({'error': 'Match scoring requires numpy and scipy'}), 503
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            rebuild_match_vectors(cursor)
+            started = time.perf_counter()
+            scored = score_job_applications(cursor, job_id)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            conn.commit()
+        return jsonify({'success': True, 'job_id': job_id, 'scored': scored, 'elapsed_ms': elapsed_ms})
+    except Exception as e:
+        logger.error(f"Rescore job error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('rescore-matches')
+def rescore_matches_command():
+    """Vectorize missing jobs/resumes and recompute match scores for every job."""
+    if sparse is None:
+        click.echo('numpy and scipy are not installed; nothing to do.')
+        return
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        added = rebuild_match_vectors(cursor)
+        cursor.execute('SELECT id FROM jobs')
+        scored = sum(score_job_applications(cursor, job_id) for (job_id,) in cursor.fetchall())
+        conn.commit()
+    click.echo(f"Added {added} vectors, scored {scored} applications.")
+
+# ---------- Duplicate Detection ----------
+_minhash_rng = np.random.default_rng(20240917)
+MINHASH_A = _minhash_rng.integers(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+MINHASH_B = _minhash_rng.integers(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+# First band number of each section. The identity section has one extra band keyed on the
+# normalized email address, whose bucket-mates count as duplicates without a signature check.
+MINHASH_SECTIONS = {'identity': 0, 'resume': LSH_BANDS + 1}
+EMAIL_BAND = LSH_BANDS
+
+def normalize_text(value):
+    """Lowercase ASCII words: 'José  O'Neil' -> ['jose', 'o', 'neil']."""
+    value = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode().lower()
+    return re.findall(r'[a-z0-9]+', value)
+
+def normalize_email(email):
+    """'John.Smith+jobs@Gmail.com' -> 'johnsmith@gmail.com'; None without a local part and domain."""
+    local, _, domain = (email or '').strip().lower().partition('@')
+    local = local.split('+', 1)[0].replace('.', '')
+    return f'{local}@{domain}' if local and domain else None
+
+def identity_shingles(name, email, phone):
+    """Character trigrams of the name and email local part, plus the exact email and phone.
+
+    Exact email/phone shingles are repeated so a matching address or number weighs
+    about as much as a matching name.
+    """
+    shingles = set()
+    name = ' '.join(sorted(normalize_text(name)))
+    shingles.update(f'n:{name[i:i + 3]}' for i in range(max(len(name) - 2, 0)))
+    email = normalize_email(email)
+    if email:
+        local = email.split('@', 1)[0]
+        shingles.update(f'l:{local[i:i + 3]}' for i in range(max(len(local) - 2, 1)))
+        shingles.update(f'e{copy}:{email}' for copy in range(4))
+    digits = re.sub(r'\D', '', phone or '')[-10:]
+    if len(digits) >= 7:
+        shingles.update(f'p{copy}:{digits}' for copy in range(4))
+    return shingles
+
+def resume_shingles(text):
+    """Word trigrams of the resume text."""
+    words = normalize_text((text or '')[:RESUME_TEXT_MAX_CHARS])
+    return {' '.join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def minhash_signature(shingles):
+    """MINHASH_PERMUTATIONS uint32 minima of (a*x + b) mod p over the hashed shingles, or None if empty."""
+    if not shingles:
+        return None
+    hashed = np.fromiter((zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    hashed %= MINHASH_PRIME
+    return ((MINHASH_A[:, None] * hashed[None, :] + MINHASH_B[:, None]) % MINHASH_PRIME).min(axis=1).astype(np.uint32)
+
+def lsh_buckets(section, signature, email=None):
+    """[(band, bucket)] for a signature; bands are numbered per section so sections never collide."""
+    first = MINHASH_SECTIONS[section]
+    buckets = [(first + band, zlib.crc32(rows.tobytes()))
+               for band, rows in enumerate(signature.reshape(LSH_BANDS, -1))]
+    if section == 'identity' and normalize_email(email):
+        buckets.append((EMAIL_BAND, zlib.crc32(normalize_email(email).encode())))
+    return buckets
+
+def merge_duplicate_groups(cursor, application_ids):
+    """Put the applications (and everyone already grouped with them) in one group labelled by its lowest id."""
+    cursor.execute('''
+        SELECT id FROM applications WHERE duplicate_group IN (
+            SELECT duplicate_group FROM applications WHERE id IN (SELECT value FROM json_each(?))
+        )
+    ''', (json.dumps(list(application_ids)),))
+    members = set(application_ids) | {row[0] for row in cursor.fetchall()}
+    cursor.execute('UPDATE applications SET duplicate_group = ? WHERE id IN (SELECT value FROM json_each(?))',
+                   (min(members), json.dumps(sorted(members))))
+
+def index_applicant(cursor, application_id, section, signature, email=None):
+    """Store one section's signature and LSH buckets, then group the application with confirmed duplicates.
+
+    Candidates come only from shared buckets, so the cost depends on bucket sizes, not
+    on the number of applications. Returns the ids confirmed as duplicates.
+    """
+    first = MINHASH_SECTIONS[section]
+    cursor.execute('DELETE FROM applicant_buckets WHERE application_id = ? AND band BETWEEN ? AND ?',
+                   (application_id, first, first + LSH_BANDS))
+    cursor.execute(f'''
+        INSERT INTO applicant_signatures (application_id, {section}) VALUES (?, ?)
+        ON CONFLICT (application_id) DO UPDATE SET {section} = excluded.{section}
+    ''', (application_id, signature.tobytes() if signature is not None else None))
+    if signature is None:
+        return []
+    buckets = lsh_buckets(section, signature, email)
+    cursor.executemany('INSERT INTO applicant_buckets (band, bucket, application_id) VALUES (?, ?, ?)',
+                       [(band, bucket, application_id) for band, bucket in buckets])
+    cursor.execute(f'''
+        SELECT b.application_id, MAX(b.band = ?), s.{section} FROM applicant_buckets b
+        JOIN json_each(?) j ON b.band = json_extract(j.value, '$[0]') AND b.bucket = json_extract(j.value, '$[1]')
+        JOIN applicant_signatures s ON s.application_id = b.application_id
+        WHERE b.application_id != ?
+        GROUP BY b.application_id
+    ''', (EMAIL_BAND, json.dumps(buckets), application_id))
+    duplicates = [candidate for candidate, same_email, other in cursor.fetchall()
+                  if same_email or (other is not None and
+                                    np.mean(np.frombuffer(other, dtype=np.uint32) == signature) >= DUPLICATE_THRESHOLD)]
+    if duplicates:
+        merge_duplicate_groups(cursor, [application_id] + duplicates)
+    return duplicates
+
+def forget_applicants(cursor, application_ids):
+    """Remove applications from the duplicate index and relabel or dissolve the groups they were in."""
+    ids = json.dumps(application_ids)
+    cursor.execute('''
+        SELECT DISTINCT duplicate_group FROM applications
+        WHERE id IN (SELECT value FROM json_each(?)) AND duplicate_group IS NOT NULL
+    ''', (ids,))
+    groups = [row[0] for row in cursor.fetchall()]
+    cursor.execute('DELETE FROM applicant_buckets WHERE application_id IN (SELECT value FROM json_each(?))', (ids,))
+    cursor.execute('DELETE FROM applicant_signatures WHERE application_id IN (SELECT value FROM json_each(?))', (ids,))
+    cursor.execute('UPDATE applications SET duplicate_group = NULL WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+    for group in groups:
+        cursor.execute('SELECT MIN(id), COUNT(*) FROM applications WHERE duplicate_group = ?', (group,))
+        label, members = cursor.fetchone()
+        cursor.execute('UPDATE applications SET duplicate_group = ? WHERE duplicate_group = ?',
+                       (label if members > 1 else None, group))
+
+@app.cli.command('index-duplicates')
+def index_duplicates_command():
+    """Rebuild MinHash signatures, LSH buckets and duplicate groups for all applications."""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT a.id, a.name, a.email, a.contact_no, r.content FROM applications a
+            LEFT JOIN resume_texts r ON r.application_id = a.id AND r.status = 'done'
+        ''')
+        applications = cursor.fetchall()
+        signatures, buckets = {}, []
+        for application_id, name, email, phone, content in applications:
+            for section, shingles in (('identity', identity_shingles(name, email, phone)),
+                                      ('resume', resume_shingles(content))):
+                signature = minhash_signature(shingles)
+                signatures[application_id, section] = signature
+                if signature is not None:
+                    buckets.extend((band, bucket, application_id)
+                                   for band, bucket in lsh_buckets(section, signature, email))
+
+        cursor.execute('DELETE FROM applicant_buckets')
+        cursor.execute('DELETE FROM applicant_signatures')
+        cursor.execute('UPDATE applications SET duplicate_group = NULL WHERE duplicate_group IS NOT NULL')
+        cursor.executemany('INSERT INTO applicant_signatures (application_id, identity, resume) VALUES (?, ?, ?)', [
+            (application_id,) + tuple(None if signatures[application_id, section] is None
+                                      else signatures[application_id, section].tobytes()
+                                      for section in ('identity', 'resume'))
+            for application_id, *_ in applications
+        ])
+        cursor.executemany('INSERT INTO applicant_buckets (band, bucket, application_id) VALUES (?, ?, ?)', buckets)
+
+        # Union-find over bucket-mates that pass the signature check; roots are the lowest ids.
+        # Every pair in a bucket is checked, as index_applicant checks a new application against
+        # all its bucket-mates: similarity isn't transitive, so B ~ A and B ~ C doesn't give C ~ A.
+        parent = {}
+        def find(node):
+            while parent.get(node, node) != node:
+                parent[node] = parent.get(parent[node], parent[node])
+                node = parent[node]
+            return node
+        def union(first, second):
+            roots = find(first), find(second)
+            if roots[0] != roots[1]:
+                parent[max(roots)] = min(roots)
+        cursor.execute('''
+            SELECT band, json_group_array(application_id) FROM applicant_buckets
+            GROUP BY band, bucket HAVING COUNT(*) > 1
+        ''')
+        for band, members in cursor.fetchall():
+            members = sorted(json.loads(members))
+            if band == EMAIL_BAND:
+                for member in members[1:]:
+                    union(members[0], member)
+                continue
+            section = 'identity' if band < MINHASH_SECTIONS['resume'] else 'resume'
+            stacked = np.stack([signatures[member, section] for member in members])
+            agreement = (stacked[:, None, :] == stacked[None, :, :]).mean(axis=2)
+            for first, second in zip(*np.nonzero(np.triu(agreement >= DUPLICATE_THRESHOLD, 1))):
+                union(members[first], members[second])
+        grouped = set(parent) | set(parent.values())
+        cursor.executemany('UPDATE applications SET duplicate_group = ? WHERE id = ?',
+                           [(find(member), member) for member in grouped])
+        conn.commit()
+    click.echo(f"Indexed {len(applications)} applications into {len({find(m) for m in grouped})} duplicate groups.")
+
 # ---------- File & Data Export ----------
 @app.route('/api/admin/download/resume/<path:filename>')
 @login_required
@@ -1721,21 +4764,13 @@ def export_applications_excel():
 def get_courses():
     category = request.args.get('category')
     with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         if category:
             cursor.execute('SELECT * FROM courses WHERE category = ? AND archived = 0 ORDER BY created_at DESC', (category,))
         else:
             cursor.execute('SELECT * FROM courses WHERE archived = 0 ORDER BY created_at DESC')
-        courses = cursor.fetchall()
-    courses_list = []
-    for c in courses:
-        courses_list.append({
-            'id': c[0], 'title': c[1], 'category': c[2], 'description': c[3],
-            'thumbnail_url': c[4], 'video_url': c[5], 'key_skills': c[6],
-            'programming_languages': c[7], 'course_duration': c[8], 'total_sessions': c[9],
-            'session_duration': c[10], 'level': c[11], 'target_audience': c[12],
-            'mode': c[13], 'course_contents': c[14], 'what_you_will_learn': c[15]
-        })
+        courses_list = [course_to_dict(row) for row in cursor.fetchall()]
     return jsonify(courses_list)
 
 @app.route('/api/admin/courses', methods=['POST'])
@@ -1752,29 +4787,28 @@ def create_course():
     
     # Handle file upload
     thumbnail_url = data.get('thumbnail_url', '')
+    thumbnail_variants = None
     if 'thumbnail' in request.files:
         file = request.files['thumbnail']
         if file and file.filename:
-            filename = secure_filename(f"{datetime.now().timestamp()}_{file.filename}")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            thumbnail_url = f"/uploads/{filename}"
+            thumbnail_url, thumbnail_variants = save_course_thumbnail(file)
     
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute(
             '''INSERT INTO courses (title, category, description, thumbnail_url, video_url, key_skills, 
                programming_languages, course_duration, total_sessions, session_duration, level, 
-               target_audience, mode, course_contents, what_you_will_learn) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+               target_audience, mode, course_contents, what_you_will_learn, thumbnail_variants) 
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
             (data['title'], data['category'], data.get('description', ''), thumbnail_url, 
              data.get('video_url', ''), data.get('key_skills', ''), data.get('programming_languages', ''),
              data.get('course_duration', ''), data.get('total_sessions', ''), data.get('session_duration', ''),
              data.get('level', 'Beginner'), data.get('target_audience', ''), data.get('mode', 'Virtual'),
-             data.get('course_contents', ''), data.get('what_you_will_learn', ''))
+             data.get('course_contents', ''), data.get('what_you_will_learn', ''), thumbnail_variants)
         )
-        conn.commit()
         course_id = cursor.lastrowid
+        refresh_course_recommendations(cursor)
+        conn.commit()
     return jsonify({'success': True, 'course_id': course_id}), 201
 
 @app.route('/api/admin/courses/<int:course_id>', methods=['PUT'])
@@ -1790,34 +4824,33 @@ def update_course(course_id):
     
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT thumbnail_url FROM courses WHERE id = ?', (course_id,))
+        cursor.execute('SELECT thumbnail_url, thumbnail_variants FROM courses WHERE id = ?', (course_id,))
         result = cursor.fetchone()
         if not result:
             return jsonify({'error': 'Course not found'}), 404
         
-        thumbnail_url = result[0]
+        thumbnail_url, thumbnail_variants = result
         
         if 'thumbnail' in request.files:
             file = request.files['thumbnail']
             if file and file.filename:
-                filename = secure_filename(f"{datetime.now().timestamp()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                thumbnail_url = f"/uploads/{filename}"
-        elif 'thumbnail_url' in data and data['thumbnail_url']:
+                thumbnail_url, thumbnail_variants = save_course_thumbnail(file)
+        elif 'thumbnail_url' in data and data['thumbnail_url'] and data['thumbnail_url'] != thumbnail_url:
             thumbnail_url = data['thumbnail_url']
+            thumbnail_variants = None
         
         cursor.execute(
             '''UPDATE courses SET title=?, category=?, description=?, thumbnail_url=?, video_url=?, 
                key_skills=?, programming_languages=?, course_duration=?, total_sessions=?, 
                session_duration=?, level=?, target_audience=?, mode=?, course_contents=?, 
-               what_you_will_learn=? WHERE id=?''',
+               what_you_will_learn=?, thumbnail_variants=? WHERE id=?''',
             (data['title'], data['category'], data.get('description', ''), thumbnail_url,
              data.get('video_url', ''), data.get('key_skills', ''), data.get('programming_languages', ''),
              data.get('course_duration', ''), data.get('total_sessions', ''), data.get('session_duration', ''),
              data.get('level', 'Beginner'), data.get('target_audience', ''), data.get('mode', 'Virtual'),
-             data.get('course_contents', ''), data.get('what_you_will_learn', ''), course_id)
+             data.get('course_contents', ''), data.get('what_you_will_learn', ''), thumbnail_variants, course_id)
         )
+        refresh_course_recommendations(cursor)
         conn.commit()
     
     return jsonify({'success': True, 'message': 'Course updated.', 'course_id': course_id})
@@ -1828,6 +4861,7 @@ def archive_course(course_id):
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute('UPDATE courses SET archived = 1 WHERE id = ?', (course_id,))
+        refresh_course_recommendations(cursor)
         conn.commit()
     return jsonify({'success': True, 'message': 'Course archived.'})
 
@@ -1837,6 +4871,7 @@ def delete_course(course_id):
     with sqlite3.connect(DB_FILE) as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM courses WHERE id = ?', (course_id,))
+        refresh_course_recommendations(cursor)
         conn.commit()
     return jsonify({'success': True, 'message': 'Course deleted.'})
 
@@ -1845,22 +4880,13 @@ def get_public_courses():
     category = request.args.get('category')
     search = request.args.get('search', '').lower()
     with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         if category:
             cursor.execute('SELECT * FROM courses WHERE category = ? ORDER BY created_at DESC', (category,))
         else:
             cursor.execute('SELECT * FROM courses ORDER BY created_at DESC')
-        courses = cursor.fetchall()
-    
-    result = []
-    for c in courses:
-        result.append({
-            'id': c[0], 'title': c[1], 'category': c[2], 'description': c[3],
-            'thumbnail_url': c[4], 'video_url': c[5], 'key_skills': c[6],
-            'programming_languages': c[7], 'course_duration': c[8], 'total_sessions': c[9],
-            'session_duration': c[10], 'level': c[11], 'target_audience': c[12],
-            'mode': c[13], 'course_contents': c[14], 'what_you_will_learn': c[15]
-        })
+        result = [course_to_dict(row) for row in cursor.fetchall()]
     result_final = result
     
     if search:
@@ -1868,6 +4894,116 @@ def get_public_courses():
     
     return jsonify(result_final)
 
+@app.route('/api/public/courses/<int:course_id>', methods=['GET'])
+def get_public_course(course_id):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM courses WHERE id = ?', (course_id,))
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({'error': 'Course not found'}), 404
+        course = course_to_dict(row)
+        cursor.execute('''
+            SELECT c.id, c.title, c.category, c.level, c.thumbnail_url, r.score FROM course_related r
+            JOIN courses c ON c.id = r.related_id
+            WHERE r.course_id = ? ORDER BY r.score DESC, c.id
+        ''', (course_id,))
+        course['related_courses'] = [dict(related) for related in cursor.fetchall()]
+    return jsonify(course)
+
+@app.route('/api/jobs/<int:job_id>/courses', methods=['GET'])
+def get_job_courses(job_id):
+    with sqlite3.connect(DB_FILE) as conn:
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM jobs WHERE id = ? AND active = 1', (job_id,))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Job not found'}), 404
+        cursor.execute('''
+            SELECT c.id, c.title, c.category, c.level, c.thumbnail_url, jc.score FROM job_courses jc
+            JOIN courses c ON c.id = jc.course_id
+            WHERE jc.job_id = ? ORDER BY jc.score DESC, c.id
+        ''', (job_id,))
+        courses_list = [dict(row) for row in cursor.fetchall()]
+    return jsonify(courses_list)
+
+# ---------- Course Recommendations ----------
+def split_skills(*fields):
+    """'Python, SQL / Pandas and NumPy' -> {'python', 'sql', 'pandas', 'numpy'}."""
+    skills = set()
+    for field in fields:
+        for part in re.split(r'[,;/|\n\u2022]+|\band\b|&', (field or '').lower()):
+            skill = ' '.join(re.findall(r'[a-z0-9+#.]+', part)).strip('.')
+            if skill and len(skill) <= 40:
+                skills.add(skill)
+    return skills
+
+def course_skill_matrix(cursor):
+    """(course ids, skill vocabulary, skill IDF, L2-normalized IDF-weighted course x skill matrix) over active courses."""
+    cursor.execute('SELECT id, key_skills, programming_languages FROM courses WHERE archived = 0 ORDER BY id')
+    courses = [(row[0], split_skills(row[1], row[2])) for row in cursor.fetchall()]
+    vocabulary = sorted(set().union(*(skills for _, skills in courses)))
+    position = {skill: index for index, skill in enumerate(vocabulary)}
+    matrix = np.zeros((len(courses), len(vocabulary)), dtype=np.float32)
+    for row, (_, skills) in enumerate(courses):
+        matrix[row, [position[skill] for skill in skills]] = 1
+    idf = np.log((1 + len(courses)) / (1 + matrix.sum(axis=0))) + 1
+    matrix *= idf
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return [course_id for course_id, _ in courses], vocabulary, idf, matrix
+
+def top_scores(ids, scores):
+    """Best COURSE_RECOMMENDATION_LIMIT (id, score) pairs with a positive score."""
+    order = np.argsort(-scores, kind='stable')[:COURSE_RECOMMENDATION_LIMIT]
+    return [(ids[index], round(float(scores[index]), 6)) for index in order if scores[index] > 0]
+
+def refresh_job_courses(cursor, job_ids=None, skill_matrix=None):
+    """Rewrite recommended courses for the given jobs (all jobs when None) by matching skills in their text."""
+    course_ids, vocabulary, idf, matrix = skill_matrix or course_skill_matrix(cursor)
+    if job_ids is None:
+        cursor.execute('SELECT id, title, description FROM jobs')
+    else:
+        cursor.execute('SELECT id, title, description FROM jobs WHERE id IN (SELECT value FROM json_each(?))',
+                       (json.dumps(list(job_ids)),))
+    jobs = cursor.fetchall()
+    cursor.executemany('DELETE FROM job_courses WHERE job_id = ?', [(job_id,) for job_id, _, _ in jobs])
+    if not vocabulary:
+        return
+    rows = []
+    for job_id, title, description in jobs:
+        text = f" {' '.join(re.findall(r'[a-z0-9+#.]+', html.unescape(f'{title} {description}').lower()))} "
+        query = np.array([f' {skill} ' in text for skill in vocabulary], dtype=np.float32) * idf
+        if query.any():
+            scores = matrix @ (query / np.linalg.norm(query))
+            rows.extend((job_id, course_id, score) for course_id, score in top_scores(course_ids, scores))
+    cursor.executemany('INSERT INTO job_courses (job_id, course_id, score) VALUES (?, ?, ?)', rows)
+
+def refresh_course_recommendations(cursor):
+    """Recompute course-to-course similarity and every job's recommended courses."""
+    skill_matrix = course_skill_matrix(cursor)
+    course_ids, _, _, matrix = skill_matrix
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0)
+    cursor.execute('DELETE FROM course_related')
+    cursor.executemany('INSERT INTO course_related (course_id, related_id, score) VALUES (?, ?, ?)', [
+        (course_id, related_id, score)
+        for course_id, scores in zip(course_ids, similarity)
+        for related_id, score in top_scores(course_ids, scores)
+    ])
+    refresh_job_courses(cursor, skill_matrix=skill_matrix)
+
+@app.cli.command('refresh-course-recommendations')
+def refresh_course_recommendations_command():
+    """Recompute related courses and job course recommendations."""
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        refresh_course_recommendations(cursor)
+        conn.commit()
+        cursor.execute('SELECT (SELECT COUNT(*) FROM course_related), (SELECT COUNT(*) FROM job_courses)')
+        related, job_courses = cursor.fetchone()
+    click.echo(f"Stored {related} related-course and {job_courses} job-course recommendations.")
+
 # ---------- Course Enrollments API ----------
 @app.route('/api/enroll', methods=['POST'])
 def enroll_course():
@@ -1945,6 +5081,457 @@ def export_enrollments_excel():
         logger.error(f"Export enrollments error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ---------- Upload Storage (GC & Usage) ----------
+def upload_basename(value):
+    """Normalize a stored upload reference (file name, relative path or /uploads/ URL) to a file name."""
+    if not value:
+        return None
+    value = str(value).replace('\\', '/')
+    if value.startswith(('http://', 'https://')) and '/uploads/' not in value:
+        return None
+    return value.rstrip('/').rsplit('/', 1)[-1] or None
+
+def upload_names(value):
+    """File names referenced by a column value; JSON values (e.g. thumbnail variants) are walked."""
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        names = set()
+        for item in value:
+            names.update(upload_names(item))
+        return names
+    name = upload_basename(value) if isinstance(value, str) else None
+    return {name} if name else set()
+
+def mark_referenced_uploads(cursor):
+    """Return {table: set of file names} for every upload still referenced by a row."""
+    referenced = {}
+    for table, column in UPLOAD_REFERENCES:
+        names = referenced.setdefault(table, set())
+        owner = f" AND {UPLOAD_REFERENCE_OWNERS[table]}" if table in UPLOAD_REFERENCE_OWNERS else ''
+        cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL AND {column} != ''{owner}")
+        for (value,) in cursor.fetchall():
+            names.update(upload_names(value))
+    return referenced
+
+def scan_upload_folder():
+    """Return {file name: (size, mtime)} for the regular files directly under UPLOAD_FOLDER."""
+    files = {}
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                files[entry.name] = (st.st_size, st.st_mtime)
+    return files
+
+def collect_orphaned_uploads(grace_seconds=None, batch_size=None, dry_run=False):
+    """Mark-and-sweep unreferenced files in UPLOAD_FOLDER.
+
+    References are re-marked before every batch, so a row written while the
+    sweep is running still protects its file.
+    """
+    grace_seconds = UPLOAD_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    batch_size = max(1, batch_size or UPLOAD_GC_BATCH_SIZE)
+    cutoff = time.time() - grace_seconds
+
+    with sqlite3.connect(DB_FILE) as conn:
+        live = set().union(*mark_referenced_uploads(conn.cursor()).values())
+
+    candidates = []
+    within_grace = 0
+    for name, (size, mtime) in scan_upload_folder().items():
+        if name in live:
+            continue
+        if mtime > cutoff:
+            within_grace += 1
+            continue
+        candidates.append((name, size))
+
+    removed = 0
+    freed_bytes = 0
+    errors = []
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        if start:
+            with sqlite3.connect(DB_FILE) as conn:
+                live = set().union(*mark_referenced_uploads(conn.cursor()).values())
+        for name, size in batch:
+            if name in live:
+                continue
+            if dry_run:
+                removed += 1
+                freed_bytes += size
+                continue
+            try:
+                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], name))
+                removed += 1
+                freed_bytes += size
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append({'file': name, 'error': str(e)})
+
+    logger.info(f"Upload GC {'(dry run) ' if dry_run else ''}removed {removed} files, freed {freed_bytes} bytes")
+    return {
+        'dry_run': dry_run,
+        'removed': removed,
+        'freed_bytes': freed_bytes,
+        'skipped_within_grace': within_grace,
+        'errors': errors
+    }
+
+def upload_disk_usage():
+    """Per-table disk usage of referenced uploads plus the unreferenced remainder."""
+    with sqlite3.connect(DB_FILE) as conn:
+        referenced = mark_referenced_uploads(conn.cursor())
+    files = scan_upload_folder()
+
+    tables = {}
+    for table, names in referenced.items():
+        present = [files[name][0] for name in names if name in files]
+        tables[table] = {
+            'files': len(present),
+            'bytes': sum(present),
+            'missing_files': len(names) - len(present)
+        }
+
+    live = set().union(*referenced.values())
+    orphaned = [size for name, (size, _) in files.items() if name not in live]
+    return {
+        'tables': tables,
+        'orphaned': {'files': len(orphaned), 'bytes': sum(orphaned)},
+        'total': {'files': len(files), 'bytes': sum(size for size, _ in files.values())}
+    }
+
+@app.route('/api/admin/storage/usage', methods=['GET'])
+@admin_only_login_required
+def get_storage_usage():
+    try:
+        return jsonify(upload_disk_usage())
+    except Exception as e:
+        logger.error(f"Storage usage error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/storage/gc', methods=['POST'])
+@admin_only_login_required
+def run_storage_gc():
+    try:
+        data = request.get_json(silent=True) or {}
+        grace_hours = data.get('grace_hours')
+        result = collect_orphaned_uploads(
+            grace_seconds=None if grace_hours is None else int(float(grace_hours) * 3600),
+            batch_size=data.get('batch_size'),
+            dry_run=bool(data.get('dry_run', False))
+        )
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Storage GC error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', type=float, default=None, help='Only remove files older than this.')
+@click.option('--dry-run', is_flag=True, help='Report what would be removed without deleting.')
+def gc_uploads_command(grace_hours, dry_run):
+    """Remove upload files no longer referenced by any table."""
+    result = collect_orphaned_uploads(
+        grace_seconds=None if grace_hours is None else int(grace_hours * 3600),
+        dry_run=dry_run
+    )
+    click.echo(result)
+
+@app.cli.command('build-thumbnails')
+def build_thumbnails_command():
+    """Generate variants for uploaded course thumbnails that predate the variant pipeline."""
+    if Image is None:
+        click.echo('Pillow is not installed; nothing to do.')
+        return
+    built = 0
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, thumbnail_url FROM courses WHERE thumbnail_url LIKE '/uploads/%' AND thumbnail_variants IS NULL")
+        for course_id, thumbnail_url in cursor.fetchall():
+            path = os.path.join(app.config['UPLOAD_FOLDER'], upload_basename(thumbnail_url))
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            try:
+                variants = build_thumbnail_variants(data, hashlib.sha256(data).hexdigest()[:20])
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                click.echo(f"Course {course_id}: {e}")
+                continue
+            cursor.execute('UPDATE courses SET thumbnail_url = ?, thumbnail_variants = ? WHERE id = ?',
+                           (variants[THUMBNAIL_DEFAULT_SIZE]['jpeg'], json.dumps(variants), course_id))
+            built += 1
+        conn.commit()
+    click.echo(f"Built thumbnail variants for {built} courses.")
+
+# ---------- Notification Retention ----------
+def enable_incremental_vacuum(conn):
+    """Switch an existing database to auto_vacuum=INCREMENTAL (a one-off full VACUUM). Returns True if it ran."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    logger.info("Database converted to auto_vacuum=INCREMENTAL")
+    return True
+
+def apply_notification_retention(rollup_days=None, ttl_days=None, batch_size=None, vacuum_pages=None):
+    """Roll up old read notifications, delete expired ones, then release free pages.
+
+    Each batch is its own short transaction: the rolled-up rows are counted into
+    notification_rollups (employee, UTC day, type) and deleted together.
+    """
+    rollup_days = NOTIFICATION_ROLLUP_DAYS if rollup_days is None else rollup_days
+    ttl_days = NOTIFICATION_TTL_DAYS if ttl_days is None else ttl_days
+    batch_size = max(1, batch_size or NOTIFICATION_RETENTION_BATCH_SIZE)
+    vacuum_pages = INCREMENTAL_VACUUM_PAGES if vacuum_pages is None else vacuum_pages
+    now = int(time.time())
+    rollup_cutoff = now - rollup_days * 86400
+    ttl_cutoff = now - ttl_days * 86400
+    rolled_up = expired = 0
+
+    with sqlite3.connect(DB_FILE) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id FROM notifications WHERE status = ? AND created_at < ? ORDER BY id LIMIT ?
+            ''', (NOTIFICATION_STATUSES['read'], rollup_cutoff, batch_size))
+            ids = json.dumps([row[0] for row in cursor.fetchall()])
+            if ids == '[]':
+                conn.rollback()
+                break
+            cursor.execute('''
+                INSERT INTO notification_rollups (employee_id, day, type, count)
+                SELECT employee_id, date(created_at, 'unixepoch'), type, COUNT(*) FROM notifications
+                WHERE id IN (SELECT value FROM json_each(?))
+                GROUP BY employee_id, date(created_at, 'unixepoch'), type
+                ON CONFLICT (employee_id, day, type) DO UPDATE SET count = count + excluded.count
+            ''', (ids,))
+            cursor.execute('DELETE FROM notifications WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+            rolled_up += cursor.rowcount
+            conn.commit()
+
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                DELETE FROM notifications WHERE id IN (
+                    SELECT id FROM notifications WHERE created_at < ? ORDER BY id LIMIT ?
+                )
+            ''', (ttl_cutoff, batch_size))
+            deleted = cursor.rowcount
+            conn.commit()
+            expired += deleted
+            if deleted < batch_size:
+                break
+        cursor.execute("DELETE FROM notification_rollups WHERE day < date(?, 'unixepoch')", (ttl_cutoff,))
+        expired_rollups = cursor.rowcount
+        conn.commit()
+
+        # Never converts the file here: that is a full VACUUM, run via the CLI command below
+        incremental = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        freelist_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if vacuum_pages and incremental:
+            conn.execute(f'PRAGMA incremental_vacuum({int(vacuum_pages)})').fetchall()
+        freelist_after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    if not incremental:
+        logger.warning("auto_vacuum is not INCREMENTAL; run `flask enable-incremental-vacuum` to release free pages")
+    logger.info(f"Notification retention rolled up {rolled_up}, expired {expired}, "
+                f"released {freelist_before - freelist_after} pages")
+    return {
+        'rolled_up': rolled_up,
+        'expired': expired,
+        'expired_rollups': expired_rollups,
+        'incremental_vacuum': incremental,
+        'pages_released': freelist_before - freelist_after,
+        'free_pages': freelist_after
+    }
+
+@app.route('/api/admin/notifications/retention', methods=['POST'])
+@admin_only_login_required
+def run_notification_retention():
+    try:
+        data = request.get_json(silent=True) or {}
+        return jsonify(apply_notification_retention(
+            rollup_days=data.get('rollup_days'),
+            ttl_days=data.get('ttl_days'),
+            batch_size=data.get('batch_size'),
+            vacuum_pages=data.get('vacuum_pages')
+        ))
+    except Exception as e:
+        logger.error(f"Notification retention error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/notifications/rollups', methods=['GET'])
+@login_required
+def get_notification_rollups():
+    try:
+        query = 'SELECT employee_id, day, type, count FROM notification_rollups'
+        params = []
+        if request.args.get('employee_id'):
+            query += ' WHERE employee_id = ?'
+            params.append(request.args.get('employee_id', type=int))
+        query += ' ORDER BY day DESC'
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rollups = [dict(row) for row in cursor.fetchall()]
+        for rollup in rollups:
+            rollup['type'] = NOTIFICATION_TYPE_NAMES.get(rollup['type'], rollup['type'])
+        return jsonify(rollups)
+    except Exception as e:
+        logger.error(f"Get notification rollups error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('notifications-retention')
+@click.option('--rollup-days', type=int, default=None, help='Roll up read notifications older than this.')
+@click.option('--ttl-days', type=int, default=None, help='Delete notifications older than this.')
+def notification_retention_command(rollup_days, ttl_days):
+    """Roll up, expire and compact notifications."""
+    click.echo(apply_notification_retention(rollup_days=rollup_days, ttl_days=ttl_days))
+
+@app.cli.command('enable-incremental-vacuum')
+def enable_incremental_vacuum_command():
+    """One-off: switch the database to auto_vacuum=INCREMENTAL (rewrites the whole file; run off-peak)."""
+    with sqlite3.connect(DB_FILE) as conn:
+        converted = enable_incremental_vacuum(conn)
+    click.echo('Converted to auto_vacuum=INCREMENTAL.' if converted else 'Already using auto_vacuum=INCREMENTAL.')
+
+# ---------- Message Archive ----------
+def open_message_archive(conn):
+    """Attach the archive database if configured and return messages_archive's qualified name.
+
+    Read-only: returns None while nothing has been archived yet (no archive file or table).
+    """
+    schema = 'main'
+    if MESSAGE_ARCHIVE_DB:
+        if not os.path.exists(MESSAGE_ARCHIVE_DB):
+            return None
+        attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+        if 'archive' not in attached:
+            conn.execute('ATTACH DATABASE ? AS archive', (MESSAGE_ARCHIVE_DB,))
+        schema = 'archive'
+    found = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'messages_archive'")
+    return f'{schema}.messages_archive' if found.fetchone() else None
+
+def create_message_archive(conn):
+    """Attach the archive database if configured, create messages_archive once, and return its qualified name."""
+    schema = 'main'
+    if MESSAGE_ARCHIVE_DB:
+        attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+        if 'archive' not in attached:
+            conn.execute('ATTACH DATABASE ? AS archive', (MESSAGE_ARCHIVE_DB,))
+        schema = 'archive'
+    archive_table = open_message_archive(conn)
+    if archive_table:
+        return archive_table
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.messages_archive ({MESSAGE_ARCHIVE_TABLE})')
+    create_message_archive_indexes(conn, schema)
+    return f'{schema}.messages_archive'
+
+def archive_old_messages(months=None, batch_size=None, max_batches=None):
+    """Move read messages older than `months` into messages_archive, one short transaction per batch.
+
+    Only read messages move, so unread counts and conversation counters are
+    unaffected; the messages delete trigger drops archived rows from search.
+    """
+    months = MESSAGE_ARCHIVE_MONTHS if months is None else months
+    batch_size = max(1, batch_size or MESSAGE_ARCHIVE_BATCH_SIZE)
+    columns = ', '.join(MESSAGE_ARCHIVE_COLUMNS)
+    archived = batches = 0
+    with sqlite3.connect(DB_FILE) as conn:
+        archive_table = create_message_archive(conn)
+        conn.commit()
+        cursor = conn.cursor()
+        while max_batches is None or batches < max_batches:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id FROM messages WHERE is_read = 1 AND created_at < CAST(strftime('%s', 'now', ?) AS INTEGER)
+                ORDER BY id LIMIT ?
+            ''', (f'-{int(months)} months', batch_size))
+            ids = json.dumps([row[0] for row in cursor.fetchall()])
+            if ids == '[]':
+                conn.rollback()
+                break
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {archive_table} ({columns})
+                SELECT {columns} FROM messages WHERE id IN (SELECT value FROM json_each(?))
+            ''', (ids,))
+            cursor.execute('DELETE FROM messages WHERE id IN (SELECT value FROM json_each(?))', (ids,))
+            archived += cursor.rowcount
+            batches += 1
+            conn.commit()
+    logger.info(f"Archived {archived} messages older than {months} months in {batches} batches")
+    return {'archived': archived, 'batches': batches, 'months': months,
+            'archive': 'attached' if MESSAGE_ARCHIVE_DB else 'main'}
+
+@app.route('/api/admin/messages/archive', methods=['POST'])
+@admin_only_login_required
+def run_message_archive():
+    try:
+        data = request.get_json(silent=True) or {}
+        months = data.get('months')
+        return jsonify(archive_old_messages(
+            months=None if months is None else int(months),
+            batch_size=data.get('batch_size'),
+            max_batches=data.get('max_batches')
+        ))
+    except Exception as e:
+        logger.error(f"Message archive error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/messages/archive', methods=['GET'])
+def get_archived_messages():
+    """The caller's archived messages, newest first, paginated with ?before=<message id>."""
+    user_type, user_id = current_identity()
+    if not user_type:
+        return jsonify({'error': 'Authentication required'}), 401
+    try:
+        limit = max(1, min(request.args.get('limit', CONVERSATION_PAGE_SIZE, type=int), CONVERSATION_PAGE_SIZE))
+        visible, params = message_visibility(user_type, user_id)
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            archive_table = open_message_archive(conn)
+            if archive_table is None:
+                return jsonify({'messages': [], 'next_before': None})
+            query = f'SELECT * FROM {archive_table} m WHERE {visible}'
+            if request.args.get('context'):
+                query += ' AND m.context = ?'
+                params.append(MESSAGE_CONTEXTS.get(request.args['context'], request.args['context']))
+            before = request.args.get('before', type=int)
+            if before:
+                query += ' AND m.id < ?'
+                params.append(before)
+            query += ' ORDER BY m.id DESC LIMIT ?'
+            params.append(limit + 1)
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            messages = [message_to_dict(row) for row in cursor.fetchall()]
+        
+        next_before = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_before = messages[-1]['id']
+        return jsonify({'messages': populate_sender_names(messages), 'next_before': next_before})
+    except Exception as e:
+        logger.error(f"Get archived messages error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('archive-messages')
+@click.option('--months', type=int, default=None, help='Archive read messages older than this many months.')
+@click.option('--batch-size', type=int, default=None, help='Messages moved per transaction.')
+def archive_messages_command(months, batch_size):
+    """Move old, read messages out of the hot messages table."""
+    click.echo(archive_old_messages(months=months, batch_size=batch_size))
+
 # ---------- Error Handlers ----------
 @app.errorhandler(404)
 def not_found_error(error):
@@ -1965,4 +5552,5 @@ if __name__ == '__main__':
     debug = os.environ.get("FLASK_DEBUG", "False").lower() in ("1","true","yes")
     logger = app.logger
     logger.info(f"Starting Flask server on http://0.0.0.0:{port}")
+    init_db()
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,84 @@
+import io
+import os
+import sqlite3
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Hash inline with cheap parameters and keep background extraction out of the way
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['RESUME_EXTRACT_WORKERS'] = '0'
+os.environ.pop('MESSAGE_ARCHIVE_DB', None)
+
+import app as backend  # noqa: E402
+
+ADMIN_CREDENTIALS = {'username': backend.ADMIN_USERNAME, 'password': 'BHR@6789$'}
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The backend module running against a fresh database and upload folder in tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    # Absolute, because send_file resolves relative paths against the app's root
+    monkeypatch.setitem(backend.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(backend, 'BUNDLE_CACHE_FOLDER', str(tmp_path / 'bundle_cache'))
+    os.makedirs(backend.app.config['UPLOAD_FOLDER'])
+    os.makedirs(backend.BUNDLE_CACHE_FOLDER)
+    for cache in (backend.timesheet_matrix_cache, backend.manager_overview_cache, backend.profile_cache):
+        cache.clear()
+    monkeypatch.setitem(backend._match_idf, 'vector', None)
+    monkeypatch.setattr(backend, 'send_application_email', lambda *args: None)
+    backend.init_db()
+    return backend
+
+@pytest.fixture
+def admin(app_module):
+    client = app_module.app.test_client()
+    assert client.post('/api/admin/login', json=ADMIN_CREDENTIALS).status_code == 200
+    return client
+
+@pytest.fixture
+def make_employee(app_module, admin):
+    """Create an employee through the admin API; returns (employee id, logged-in client)."""
+    def make(username='alice', role='employee'):
+        response = admin.post('/api/admin/employees', json={
+            'username': username, 'password': 'secret', 'employee_name': username.title(),
+            'employee_id_field': f'EMP-{username}', 'email': f'{username}@example.com', 'role': role,
+        })
+        assert response.status_code == 201, response.get_json()
+        client = app_module.app.test_client()
+        assert client.post('/api/employee/login', json={
+            'employee_id': f'EMP-{username}', 'username': username, 'password': 'secret',
+        }).status_code == 200
+        return response.get_json()['employee_id'], client
+    return make
+
+def pdf_upload(content=b'%PDF-1.4 test'):
+    return io.BytesIO(content)
+
+def upload_timesheet(client, year=2026, month=3, week=1, content=b'%PDF-1.4 test'):
+    return client.post('/api/employee/timesheets', data={
+        'year': str(year), 'month': str(month), 'week': str(week), 'file': (pdf_upload(content), 'timesheet.pdf'),
+    }, content_type='multipart/form-data')
+
+def docx_upload(text):
+    """A minimal .docx holding `text` as one paragraph."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('word/document.xml', f'<w:document><w:body><w:p><w:t>{text}</w:t></w:p></w:body></w:document>')
+    buffer.seek(0)
+    return buffer
+
+def apply(client, name='Dana Scully', email='dana@example.com', contact_no='555-0100', job_id=1,
+          resume_text='python developer', resume_name='resume.docx'):
+    """Submit an application through /api/apply; returns the new application id."""
+    response = client.post('/api/apply', data={
+        'name': name, 'email': email, 'contact_no': contact_no, 'job_id': str(job_id), 'job_title': 'Engineer',
+        'location': 'Remote', 'visa_status': 'Citizen', 'relocation': 'No',
+        'resume': (docx_upload(resume_text), resume_name),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    with sqlite3.connect(backend.DB_FILE) as conn:
+        return conn.execute('SELECT MAX(id) FROM applications').fetchone()[0]
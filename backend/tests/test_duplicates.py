@@ -0,0 +1,69 @@
+import sqlite3
+from concurrent.futures import Future
+
+import numpy as np
+
+from conftest import apply
+
+def store_resume(app_module, application_id, text):
+    future = Future()
+    future.set_result(text)
+    app_module.store_resume_text(application_id, future)
+
+def groups(app_module):
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        return dict(conn.execute('SELECT id, duplicate_group FROM applications').fetchall())
+
+def rebuild(app_module):
+    result = app_module.app.test_cli_runner().invoke(args=['index-duplicates'])
+    assert result.exit_code == 0, result.output
+    return groups(app_module)
+
+def test_same_person_is_grouped_online_and_by_rebuild(app_module):
+    client = app_module.app.test_client()
+    first = apply(client, name='John Smith', email='John.Smith+jobs@gmail.com', contact_no='(555) 123-4567',
+                  resume_name='a.docx')
+    second = apply(client, name='Smith John', email='johnsmith@gmail.com', contact_no='555 123 4567',
+                   resume_name='b.docx')
+    other = apply(client, name='Dana Scully', email='dana@fbi.gov', contact_no='555-987-6543', resume_name='c.docx')
+
+    online = groups(app_module)
+    assert online == {first: first, second: first, other: None}
+    assert rebuild(app_module) == online
+
+def test_similar_resumes_are_grouped(app_module):
+    client = app_module.app.test_client()
+    resume = ' '.join(f'word{n}' for n in range(200))
+    first = apply(client, name='Ann Lee', email='ann@example.com', contact_no='555-000-0001', resume_name='a.docx')
+    second = apply(client, name='Bo Chan', email='bo@example.com', contact_no='555-000-0002', resume_name='b.docx')
+    store_resume(app_module, first, resume)
+    store_resume(app_module, second, resume + ' extra words at the end')
+
+    online = groups(app_module)
+    assert online[first] == online[second] == first
+    assert rebuild(app_module) == online
+
+def test_rebuild_groups_chains_missed_by_the_lowest_id(app_module, monkeypatch):
+    # B agrees with A and with C on 44/64 values, A and C on only 24/64. B takes C's value at every
+    # other position, so every band B shares with C (or with A) is shared by all three.
+    base = np.arange(64, dtype=np.uint32)
+    signatures = {'A': base.copy(), 'B': base.copy(), 'C': base.copy()}
+    signatures['C'][4:44] += 1000
+    signatures['B'][4:44:2] += 1000
+    assert np.mean(signatures['A'] == signatures['C']) < app_module.DUPLICATE_THRESHOLD
+    original = app_module.minhash_signature
+    monkeypatch.setattr(app_module, 'resume_shingles', lambda text: {f'resume:{text}'} if text else set())
+    monkeypatch.setattr(app_module, 'minhash_signature', lambda shingles: (
+        signatures[next(iter(shingles))[len('resume:'):]] if shingles and next(iter(shingles)).startswith('resume:')
+        else original(shingles)))
+
+    client = app_module.app.test_client()
+    ids = {}
+    for n, (label, name) in enumerate((('A', 'Ann Lee'), ('B', 'Bo Chan'), ('C', 'Cy Diaz'))):
+        ids[label] = apply(client, name=name, email=f'{label.lower()}@example.com',
+                           contact_no=f'555-000-000{n}', resume_name=f'{label}.docx')
+        store_resume(app_module, ids[label], label)
+
+    online = groups(app_module)
+    assert {online[ids[label]] for label in 'ABC'} == {ids['A']}
+    assert rebuild(app_module) == online
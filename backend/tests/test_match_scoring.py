@@ -0,0 +1,70 @@
+import sqlite3
+from concurrent.futures import Future
+
+from conftest import apply
+
+def create_job(admin, title='Python Developer', description='python django postgres rest apis'):
+    response = admin.post('/api/admin/jobs', json={'title': title, 'location': 'Remote', 'description': description})
+    assert response.status_code == 201
+    return response.get_json()['job_id']
+
+def apply_with_resume(app_module, job_id, n, text):
+    application_id = apply(app_module.app.test_client(), email=f'applicant{n}@example.com', job_id=job_id,
+                           resume_name=f'resume{n}.docx')
+    future = Future()
+    future.set_result(text)
+    app_module.store_resume_text(application_id, future)
+    return application_id
+
+def listed_scores(admin, job_id):
+    response = admin.get(f'/api/admin/applications?job_id={job_id}&sort=-match_score')
+    assert response.status_code == 200
+    return [(row['id'], row['match_score']) for row in response.get_json()]
+
+def stored_scores(app_module, job_id):
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        return conn.execute('SELECT application_id, score, generation FROM match_scores WHERE job_id = ?',
+                            (job_id,)).fetchall()
+
+def test_listing_ranks_applicants_by_match(app_module, admin):
+    job_id = create_job(admin)
+    weak = apply_with_resume(app_module, job_id, 1, 'retail cashier customer service')
+    strong = apply_with_resume(app_module, job_id, 2, 'python django developer building rest apis on postgres')
+    partial = apply_with_resume(app_module, job_id, 3, 'java developer with some python')
+
+    ranked = listed_scores(admin, job_id)
+    assert [application_id for application_id, _ in ranked] == [strong, partial, weak]
+    assert ranked[0][1] > ranked[1][1] > ranked[2][1]
+
+def test_a_job_is_scored_on_one_scale(app_module, admin):
+    job_id = create_job(admin)
+    other_job = create_job(admin, 'Accountant', 'ledger audit tax reconciliation')
+    apply_with_resume(app_module, job_id, 1, 'python django developer')
+    listed_scores(admin, job_id)
+    # New documents shift the IDF; earlier applicants must be rescored with the later ones
+    apply_with_resume(app_module, job_id, 2, 'python developer and tax accountant')
+    apply_with_resume(app_module, other_job, 3, 'tax audit ledger')
+
+    listed = dict(listed_scores(admin, job_id))
+    assert len({generation for _, _, generation in stored_scores(app_module, job_id)}) == 1
+
+    assert admin.post(f'/api/admin/jobs/{job_id}/rescore').get_json()['scored'] == 2
+    assert listed == {application_id: score for application_id, score, _ in stored_scores(app_module, job_id)}
+
+def test_scores_are_computed_when_read_not_on_arrival(app_module, admin):
+    job_id = create_job(admin)
+    apply_with_resume(app_module, job_id, 1, 'python developer')
+    assert stored_scores(app_module, job_id) == []
+    assert listed_scores(admin, job_id)[0][1] is not None
+    generation = stored_scores(app_module, job_id)[0][2]
+
+    # Nothing changed: reading again does not rescore
+    listed_scores(admin, job_id)
+    assert stored_scores(app_module, job_id)[0][2] == generation
+
+def test_migration_vectorizes_existing_jobs(app_module):
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        job_id = conn.execute("INSERT INTO jobs (title, location, description) VALUES ('Legacy', 'Remote', 'cobol')").lastrowid
+    app_module.init_db()
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        assert conn.execute("SELECT 1 FROM match_vectors WHERE kind = 'job' AND ref_id = ?", (job_id,)).fetchone()
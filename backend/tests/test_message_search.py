@@ -0,0 +1,61 @@
+import pytest
+
+def send(client, message, **fields):
+    payload = {'context': 'direct_message', 'message': message, 'receiver_type': 'admin', 'receiver_id': 1}
+    payload.update(fields)
+    response = client.post('/api/messages', json=payload)
+    assert response.status_code in (200, 201), response.get_json()
+
+def search(client, q, **params):
+    return client.get('/api/messages/search', query_string=dict(params, q=q))
+
+def test_fts_phrases_quotes_terms_and_prefixes_the_last(app_module):
+    assert app_module.fts_phrases('zebra crossing') == '"zebra" "crossing"*'
+    assert app_module.fts_phrases('say "hi" OR NOT') == '"say" "hi" "OR" "NOT"*'
+    assert app_module.fts_phrases('  ""  ') is None
+    assert app_module.fts_phrases(' '.join(['word'] * 40)).count('"word"') == 16
+
+def test_fts_match_query_scopes_to_the_caller(app_module):
+    match = app_module.fts_match_query('hello', 'employee', 7)
+    assert match.startswith('{audience}: (toemployee7 OR fromemployee7)')
+    assert app_module.fts_match_query('', 'employee', 7) is None
+
+@pytest.mark.parametrize('q', ['"unbalanced', 'a AND', 'NEAR(', 'x OR', '*', 'col:value', '(', '-minus', 'a^b'])
+def test_search_escapes_fts_syntax(make_employee, q):
+    _, employee = make_employee()
+    send(employee, 'zebra crossing ahead')
+    response = search(employee, q)
+    assert response.status_code == 200, response.get_json()
+
+def test_search_matches_prefixes_and_scopes_to_visible_messages(make_employee):
+    _, alice = make_employee('alice')
+    _, bob = make_employee('bob')
+    send(alice, 'zebra crossing ahead')
+    send(bob, 'zebra spotted by bob')
+
+    results = search(alice, 'zeb').get_json()['results']
+    assert [row['message'] for row in results] == ['zebra crossing ahead']
+    assert '<mark>' in results[0]['snippet']
+    assert search(alice, 'spotted').get_json()['results'] == []
+
+def test_search_requires_a_query(make_employee):
+    _, employee = make_employee()
+    assert search(employee, '').status_code == 400
+    assert search(employee, '""').status_code == 400
+
+def test_search_pages_with_a_cursor(make_employee):
+    _, employee = make_employee()
+    for n in range(3):
+        send(employee, f'zebra note {n}')
+    seen, cursor = [], None
+    for _ in range(5):
+        params = {'limit': 1}
+        if cursor:
+            params['cursor'] = cursor
+        page = search(employee, 'zebra', **params).get_json()
+        seen.extend(row['id'] for row in page['results'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 3
+    assert search(employee, 'zebra', cursor='not-a-cursor').status_code == 400
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from conftest import apply
+
+class ManualPool:
+    """Stands in for the extraction pool; the test decides when and how each job finishes."""
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, path):
+        future = Future()
+        self.submitted.append((path, future))
+        return future
+
+def resume_row(app_module, application_id):
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        return conn.execute('SELECT status, content, queued_at FROM resume_texts WHERE application_id = ?',
+                            (application_id,)).fetchone()
+
+def test_extraction_results_are_stored_off_the_callback_thread(app_module, monkeypatch):
+    pool = ManualPool()
+    monkeypatch.setattr(app_module, 'RESUME_EXTRACT_WORKERS', 1)
+    monkeypatch.setattr(app_module, '_get_resume_pool', lambda: pool)
+    stored_on = []
+    store = app_module.store_resume_text
+    monkeypatch.setattr(app_module, 'store_resume_text',
+                        lambda *args: (stored_on.append(threading.current_thread().name), store(*args)))
+
+    application_id = apply(app_module.app.test_client())
+    assert len(pool.submitted) == 1
+    assert resume_row(app_module, application_id)[0] == 'pending'
+
+    # Completing the future runs the done-callback here; the store happens on the store thread
+    pool.submitted[0][1].set_result('senior python developer')
+    app_module._resume_results.join()
+    assert stored_on == ['resume-store']
+    assert resume_row(app_module, application_id)[:2] == ('done', 'senior python developer')
+
+def test_failed_extraction_is_recorded(app_module, monkeypatch):
+    pool = ManualPool()
+    monkeypatch.setattr(app_module, 'RESUME_EXTRACT_WORKERS', 1)
+    monkeypatch.setattr(app_module, '_get_resume_pool', lambda: pool)
+
+    application_id = apply(app_module.app.test_client())
+    pool.submitted[0][1].set_exception(ValueError('corrupt file'))
+    app_module._resume_results.join()
+    assert resume_row(app_module, application_id)[0] == 'failed'
+
+def test_apply_does_not_requeue_stale_rows(app_module, monkeypatch):
+    pool = ManualPool()
+    monkeypatch.setattr(app_module, 'RESUME_EXTRACT_WORKERS', 1)
+    monkeypatch.setattr(app_module, '_get_resume_pool', lambda: pool)
+    client = app_module.app.test_client()
+    stale_id = apply(client, resume_name='first.docx')
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        conn.execute("UPDATE resume_texts SET queued_at = datetime('now', '-1 day') WHERE application_id = ?", (stale_id,))
+
+    apply(client, email='fox@example.com', resume_name='second.docx')
+    assert [path.endswith('second.docx') for path, _ in pool.submitted] == [False, True]
+    assert resume_row(app_module, stale_id)[0] == 'pending'
+
+def test_claim_takes_unqueued_and_stale_rows_once(app_module):
+    client = app_module.app.test_client()
+    unqueued = apply(client, resume_name='a.docx')  # no background pool: never queued
+    stale = apply(client, email='b@example.com', resume_name='b.docx')
+    fresh = apply(client, email='c@example.com', resume_name='c.docx')
+    failed = apply(client, email='d@example.com', resume_name='d.docx')
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        conn.execute("UPDATE resume_texts SET queued_at = datetime('now', '-1 day') WHERE application_id = ?", (stale,))
+        conn.execute('UPDATE resume_texts SET queued_at = CURRENT_TIMESTAMP WHERE application_id = ?', (fresh,))
+        conn.execute("UPDATE resume_texts SET status = 'failed' WHERE application_id = ?", (failed,))
+
+    assert sorted(row[0] for row in app_module.claim_resume_extractions()) == [unqueued, stale]
+    assert app_module.claim_resume_extractions() == []
+    assert [row[0] for row in app_module.claim_resume_extractions(retry_failed=True)] == [failed]
+
+def test_extract_resumes_command_stores_pending_text(app_module):
+    application_id = apply(app_module.app.test_client(), resume_text='kubernetes operator')
+    result = app_module.app.test_cli_runner().invoke(args=['extract-resumes'])
+    assert 'Extracted 1 resumes, 0 failed.' in result.output
+    assert resume_row(app_module, application_id)[:2] == ('done', 'kubernetes operator')
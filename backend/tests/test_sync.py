@@ -0,0 +1,75 @@
+from conftest import upload_timesheet
+
+def sync(client, since=None, limit=None):
+    query = []
+    if since is not None:
+        query.append(f'since={since}')
+    if limit is not None:
+        query.append(f'limit={limit}')
+    response = client.get('/api/employee/sync' + ('?' + '&'.join(query) if query else ''))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_sync_pages_through_changes_with_the_token(make_employee):
+    _, employee = make_employee()
+    for week in range(1, 4):
+        assert upload_timesheet(employee, week=week).status_code == 201
+
+    seen, token = [], None
+    for _ in range(10):
+        page = sync(employee, since=token, limit=1)
+        seen.extend(row['week'] for row in page['changes']['timesheets'])
+        token = page['token']
+        if not page['has_more']:
+            break
+    assert sorted(set(seen)) == [1, 2, 3]
+
+    # Nothing new since the final token
+    assert sync(employee, since=token)['changes']['timesheets'] == []
+
+def test_sync_returns_updated_rows_again(make_employee):
+    _, employee = make_employee()
+    upload_timesheet(employee)
+    token = sync(employee)['token']
+    timesheet_id = employee.get('/api/employee/timesheets').get_json()[0]['id']
+
+    assert employee.post(f'/api/employee/timesheets/{timesheet_id}/submit').status_code == 200
+    changed = sync(employee, since=token)['changes']['timesheets']
+    assert [(row['id'], row['status']) for row in changed] == [(timesheet_id, 'submitted')]
+
+def test_sync_limit_is_clamped_below(make_employee):
+    _, employee = make_employee()
+    upload_timesheet(employee, week=1)
+    upload_timesheet(employee, week=2)
+    for limit in (0, -5):
+        page = sync(employee, limit=limit)
+        assert len(page['changes']['timesheets']) == 1
+        assert page['has_more'] is True
+
+def test_sync_rejects_a_bad_token(make_employee):
+    _, employee = make_employee()
+    assert employee.get('/api/employee/sync?since=abc').status_code == 400
+
+def test_sync_includes_broadcasts_and_their_read_state(admin, make_employee):
+    _, employee = make_employee()
+    token = sync(employee)['token']
+    response = admin.post('/api/admin/broadcasts', json={'audience': 'employees', 'message': 'Office closed Friday'})
+    broadcast_id = response.get_json()['broadcast_id']
+
+    page = sync(employee, since=token)
+    assert [(row['id'], row['message'], row['is_read']) for row in page['changes']['broadcasts']] == [
+        (-broadcast_id, 'Office closed Friday', 0)]
+    token = page['token']
+    assert sync(employee, since=token)['changes']['broadcasts'] == []
+
+    # Reading it is a change too
+    assert employee.post(f'/api/broadcasts/{broadcast_id}/mark-read').status_code == 200
+    page = sync(employee, since=token)
+    assert [(row['broadcast_id'], row['is_read']) for row in page['changes']['broadcasts']] == [(broadcast_id, 1)]
+    assert sync(employee, since=page['token'])['changes']['broadcasts'] == []
+
+def test_sync_leaves_out_broadcasts_for_other_audiences(admin, make_employee):
+    _, employee = make_employee(role='employee')
+    admin.post('/api/admin/broadcasts', json={'audience': 'managers', 'message': 'Managers only'})
+    admin.post('/api/admin/broadcasts', json={'audience': 'role', 'role': 'contractor', 'message': 'Contractors only'})
+    assert sync(employee)['changes']['broadcasts'] == []
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+
+from conftest import upload_timesheet
+
+def timesheets(client):
+    response = client.get('/api/employee/timesheets')
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_reupload_replaces_draft_and_keeps_history(app_module, admin, make_employee):
+    _, client = make_employee()
+    first = upload_timesheet(client, content=b'%PDF-1.4 first').get_json()
+    second = upload_timesheet(client, content=b'%PDF-1.4 second').get_json()
+    assert (first['replaced'], second['replaced']) == (False, True)
+    assert second['timesheet_id'] == first['timesheet_id'] and second['version'] == 2
+
+    [live] = timesheets(client)
+    assert live['status'] == 'draft' and live['version'] == 2
+    [previous] = admin.get(f"/api/admin/timesheets/{live['id']}/versions").get_json()
+    assert previous['version'] == 1 and previous['status'] == 'draft'
+    download = admin.get(f"/api/admin/timesheets/versions/{previous['id']}/download")
+    assert download.status_code == 200 and download.data == b'%PDF-1.4 first'
+
+def test_history_is_capped(app_module, admin, make_employee, monkeypatch):
+    monkeypatch.setattr(app_module, 'TIMESHEET_HISTORY_LIMIT', 2)
+    _, client = make_employee()
+    for attempt in range(5):
+        timesheet_id = upload_timesheet(client, content=f'%PDF-1.4 {attempt}'.encode()).get_json()['timesheet_id']
+    versions = admin.get(f'/api/admin/timesheets/{timesheet_id}/versions').get_json()
+    assert [version['version'] for version in versions] == [4, 3]
+
+def test_submitted_period_cannot_be_replaced(app_module, make_employee):
+    _, client = make_employee()
+    timesheet_id = upload_timesheet(client).get_json()['timesheet_id']
+    assert client.post(f'/api/employee/timesheets/{timesheet_id}/submit').status_code == 200
+
+    response = upload_timesheet(client, content=b'%PDF-1.4 late')
+    assert response.status_code == 409 and response.get_json()['status'] == 'submitted'
+    assert len(os.listdir(app_module.app.config['UPLOAD_FOLDER'])) == 1
+
+def test_reupload_after_rejection_starts_a_clean_draft(app_module, admin, make_employee):
+    _, client = make_employee()
+    timesheet_id = upload_timesheet(client).get_json()['timesheet_id']
+    client.post(f'/api/employee/timesheets/{timesheet_id}/submit')
+    rejected = admin.post('/api/admin/timesheets/bulk-reject', json={'timesheet_ids': [timesheet_id], 'note': 'Wrong week'})
+    assert rejected.get_json()['updated'] == 1
+    [live] = timesheets(client)
+    assert live['status'] == 'rejected' and live['review_note'] == 'Wrong week'
+
+    assert upload_timesheet(client, content=b'%PDF-1.4 fixed').status_code == 201
+    [live] = timesheets(client)
+    assert live['status'] == 'draft' and live['review_note'] is None and live['reviewed_at'] is None
+    [previous] = admin.get(f'/api/admin/timesheets/{timesheet_id}/versions').get_json()
+    assert previous['status'] == 'rejected' and previous['review_note'] == 'Wrong week'
+    assert previous['reviewed_at'] is not None
+
+def test_version_download_resolves_legacy_windows_paths(app_module, admin, make_employee):
+    _, client = make_employee()
+    timesheet_id = upload_timesheet(client, content=b'%PDF-1.4 first').get_json()['timesheet_id']
+    upload_timesheet(client, content=b'%PDF-1.4 second')
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        conn.execute("UPDATE timesheet_versions SET file_path = 'uploads\\' || filename")
+    [previous] = admin.get(f'/api/admin/timesheets/{timesheet_id}/versions').get_json()
+
+    download = admin.get(f"/api/admin/timesheets/versions/{previous['id']}/download")
+    assert download.status_code == 200 and download.data == b'%PDF-1.4 first'
+
+def test_bulk_transitions_report_each_item(app_module, admin, make_employee):
+    _, alice = make_employee('alice')
+    _, bob = make_employee('bob')
+    first = upload_timesheet(alice, week=1).get_json()['timesheet_id']
+    second = upload_timesheet(alice, week=2).get_json()['timesheet_id']
+    bobs = upload_timesheet(bob, week=1).get_json()['timesheet_id']
+
+    response = alice.post('/api/employee/timesheets/bulk-submit', json={'timesheet_ids': [first, first, bobs, 999]})
+    body = response.get_json()
+    assert response.status_code == 200 and body['updated'] == 1
+    assert [(item['id'], item['success']) for item in body['results']] == [(first, True), (bobs, False), (999, False)]
+
+    body = admin.post('/api/admin/timesheets/bulk-approve', json={'timesheet_ids': [first, second]}).get_json()
+    assert body['updated'] == 1
+    assert body['results'][1] == {'id': second, 'success': False, 'status': 'draft',
+                                  'error': 'Cannot approve a timesheet that is draft'}
+
+    body = alice.post('/api/employee/timesheets/bulk-submit', json={'year': 2026, 'month': 3}).get_json()
+    assert [(item['id'], item['success']) for item in body['results']] == [(first, False), (second, True)]
+    statuses = {ts['id']: ts['status'] for ts in timesheets(alice)}
+    assert statuses == {first: 'approved', second: 'submitted'}
+
+def test_bulk_requests_are_validated(app_module, admin, make_employee):
+    _, client = make_employee()
+    assert client.post('/api/employee/timesheets/bulk-submit', json={'timesheet_ids': 'all'}).status_code == 400
+    assert client.post('/api/employee/timesheets/bulk-submit', json={'timesheet_ids': ['x']}).status_code == 400
+    assert client.post('/api/employee/timesheets/bulk-submit', json={}).status_code == 400
+    assert admin.post('/api/admin/timesheets/bulk-delete', json={'timesheet_ids': [1]}).status_code == 404
+
+def test_resubmitting_keeps_the_rejection_note(app_module, admin, make_employee):
+    _, client = make_employee()
+    timesheet_id = upload_timesheet(client).get_json()['timesheet_id']
+    client.post('/api/employee/timesheets/bulk-submit', json={'timesheet_ids': [timesheet_id], 'note': 'All hours'})
+    admin.post('/api/admin/timesheets/bulk-reject', json={'timesheet_ids': [timesheet_id], 'note': 'Missing Friday'})
+
+    body = client.post('/api/employee/timesheets/bulk-submit',
+                       json={'timesheet_ids': [timesheet_id], 'note': 'Friday added'}).get_json()
+    assert body['updated'] == 1
+    [live] = timesheets(client)
+    assert live['status'] == 'submitted'
+    assert live['review_note'] == 'Missing Friday' and live['submit_note'] == 'Friday added'
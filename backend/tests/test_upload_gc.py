@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import time
+
+from conftest import pdf_upload, upload_timesheet
+
+def age_uploads(app_module, seconds):
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    past = time.time() - seconds
+    for name in os.listdir(folder):
+        os.utime(os.path.join(folder, name), (past, past))
+
+def test_unreferenced_upload_is_collected_after_grace(app_module):
+    path = os.path.join(app_module.app.config['UPLOAD_FOLDER'], 'stray.pdf')
+    with open(path, 'wb') as fh:
+        fh.write(b'x' * 10)
+
+    result = app_module.collect_orphaned_uploads(grace_seconds=3600)
+    assert result['removed'] == 0 and result['skipped_within_grace'] == 1
+
+    age_uploads(app_module, 7200)
+    result = app_module.collect_orphaned_uploads(grace_seconds=3600)
+    assert result['removed'] == 1 and result['freed_bytes'] == 10
+    assert not os.path.exists(path)
+
+def test_referenced_uploads_are_kept(app_module, make_employee):
+    _, client = make_employee()
+    assert upload_timesheet(client).status_code == 201
+    age_uploads(app_module, 7200)
+
+    result = app_module.collect_orphaned_uploads(grace_seconds=3600)
+    assert result['removed'] == 0
+    assert len(os.listdir(app_module.app.config['UPLOAD_FOLDER'])) == 1
+
+def test_deleted_employee_uploads_become_orphans(app_module, admin, make_employee):
+    employee_id, client = make_employee()
+    assert upload_timesheet(client, week=1).status_code == 201
+    assert upload_timesheet(client, week=1, content=b'%PDF-1.4 second').status_code == 201  # one history version
+    assert client.post('/api/employee/visa-docs', data={
+        'doc_name': 'Passport', 'file': (pdf_upload(), 'passport.pdf'),
+    }, content_type='multipart/form-data').status_code == 201
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    assert len(os.listdir(folder)) == 3
+
+    assert admin.delete(f'/api/admin/employees/{employee_id}').status_code == 200
+    usage = app_module.upload_disk_usage()
+    assert usage['orphaned']['files'] == 3
+
+    assert app_module.collect_orphaned_uploads(grace_seconds=3600)['skipped_within_grace'] == 3
+    age_uploads(app_module, 7200)
+    assert app_module.collect_orphaned_uploads(grace_seconds=3600)['removed'] == 3
+    assert os.listdir(folder) == []
+
+def test_rows_left_by_earlier_employee_deletes_do_not_pin_files(app_module, make_employee):
+    employee_id, client = make_employee()
+    assert upload_timesheet(client).status_code == 201
+    with sqlite3.connect(app_module.DB_FILE) as conn:
+        conn.execute('DELETE FROM employees WHERE id = ?', (employee_id,))  # as delete_employee used to
+    age_uploads(app_module, 7200)
+
+    assert app_module.collect_orphaned_uploads(grace_seconds=3600)['removed'] == 1
@@ -0,0 +1,39 @@
+# workers.py - jobs run in the backend's process pools
+#
+# Pool workers start from a fresh interpreter (forkserver/spawn) and import the
+# module a job is defined in to unpickle it. Keep this module free of import-time
+# side effects: no database access, no password hashing, no Flask app.
+import os
+import re
+import html
+import zipfile
+from werkzeug.security import generate_password_hash
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF resume text is unavailable
+    PdfReader = None
+
+RESUME_TEXT_MAX_CHARS = int(os.getenv('RESUME_TEXT_MAX_CHARS', 200000))
+
+def hash_password_batch(passwords, method):
+    return [generate_password_hash(password, method=method) for password in passwords]
+
+def extract_resume_text(path):
+    """Plain text of a PDF, DOCX or DOC resume; runs in the extraction pool."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.pdf':
+        if PdfReader is None:
+            raise RuntimeError('pypdf is not installed')
+        text = '\n'.join(page.extract_text() or '' for page in PdfReader(path).pages)
+    elif extension == '.docx':
+        with zipfile.ZipFile(path) as archive:
+            document = archive.read('word/document.xml').decode('utf-8', 'ignore')
+        text = html.unescape(re.sub(r'<[^>]+>', ' ', re.sub(r'</w:p>', '\n', document)))
+    elif extension == '.doc':
+        # Legacy binary Word: keep the runs of printable text
+        with open(path, 'rb') as fh:
+            text = b' '.join(re.findall(rb'[\x20-\x7e]{4,}', fh.read())).decode('ascii')
+    else:
+        raise ValueError(f'Unsupported resume type: {extension}')
+    return ' '.join(text.split())[:RESUME_TEXT_MAX_CHARS]
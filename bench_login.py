@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Concurrent login benchmark for the BrainHR backend.
+
+Fires employee logins from many threads while probing /health, and reports
+login throughput plus latency percentiles for both. Start the backend first,
+e.g. from backend/:  gunicorn -w 2 --threads 8 -b 127.0.0.1:5000 'app:create_app()'
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def post_json(url, payload):
+    """POST a JSON body and return the HTTP status code."""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, latencies, elapsed=None):
+    ms = [v * 1000 for v in latencies]
+    line = (f"{name:<8} n={len(ms):<5} p50={percentile(ms, 50):8.1f}ms  p95={percentile(ms, 95):8.1f}ms  "
+            f"p99={percentile(ms, 99):8.1f}ms  max={max(ms, default=0):8.1f}ms")
+    if elapsed:
+        line += f"  throughput={len(ms) / elapsed:7.1f}/s"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--base-url', default='http://localhost:5000')
+    parser.add_argument('--employee-id', default='emp001')
+    parser.add_argument('--username', default='qwe')
+    parser.add_argument('--password', default='qwe')
+    parser.add_argument('--users', type=int, default=32, help='concurrent login clients')
+    parser.add_argument('--requests', type=int, default=256, help='total login attempts')
+    args = parser.parse_args()
+
+    payload = {'employee_id': args.employee_id, 'username': args.username, 'password': args.password}
+    login_latencies, health_latencies, failures = [], [], []
+    done = threading.Event()
+
+    def login(_):
+        start = time.perf_counter()
+        status = post_json(f"{args.base_url}/api/employee/login", payload)
+        elapsed = time.perf_counter() - start
+        if status != 200:
+            failures.append(status)
+        login_latencies.append(elapsed)
+
+    def probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            get(f"{args.base_url}/health")
+            health_latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+
+    status = post_json(f"{args.base_url}/api/employee/login", payload)  # warm up
+    if status != 200:
+        raise SystemExit(f"warm-up login failed with HTTP {status}")
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(login, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+
+    print(f"{args.requests} logins from {args.users} clients in {elapsed:.2f}s")
+    report('login', login_latencies, elapsed)
+    report('health', health_latencies)
+    if failures:
+        print(f"failures: {len(failures)} (status codes: {sorted(set(failures))})")
+    if health_latencies:
+        print(f"health mean={statistics.mean(health_latencies) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()